@@ -0,0 +1,178 @@
+"""
+Library for calling the blocking library classes (PPL, WPL, TPL) from asyncio code. AsyncLibrary wraps an instance and
+runs its WebDriver work on a bounded thread pool, so a single event loop can drive many accounts and overlap their
+network waits:
+
+- a library instance owns one driver, so its calls run one at a time
+- LibraryLimits caps the number of calls that run at the same time per library system
+- a call that times out or is cancelled stops waiting at once. A call that hasn't started yet never runs. A call that
+  is already running in its thread can't be interrupted, so its library instance (and its slot in the system's limit)
+  stays taken until the blocking call returns, and the next call on that instance waits for it.
+
+Usage:
+    async with AsyncLibrary(PPL(driver_pool=pool), timeout=120) as ppl:
+        items = await ppl.snapshot(username, password)
+"""
+
+import asyncio
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = 8
+DEFAULT_LIMITS = {"ppl": 2, "wpl": 2, "tpl": 2}
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+
+def default_executor():
+    """
+    Returns the thread pool shared by AsyncLibrary instances that aren't given one, which runs at most DEFAULT_WORKERS
+    blocking calls at the same time
+    """
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = ThreadPoolExecutor(max_workers=DEFAULT_WORKERS, thread_name_prefix="libscrape-async")
+        return _default_executor
+
+
+class LibraryLimits:
+    """
+    The maximum number of calls that run at the same time per library system
+
+    Attributes:
+      - limits: dict of the maximum number of concurrent calls keyed by library system (e.g. {"tpl": 1})
+      - default: the maximum number of concurrent calls of a system that isn't in limits
+    """
+
+    def __init__(self, limits=None, default=2):
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.default = default
+        # asyncio semaphores belong to one event loop, so each running loop gets its own
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def semaphore(self, system):
+        semaphores = self._semaphores.setdefault(asyncio.get_running_loop(), {})
+        if system not in semaphores:
+            semaphores[system] = asyncio.Semaphore(self.limits.get(system, self.default))
+        return semaphores[system]
+
+
+DEFAULT_LIBRARY_LIMITS = LibraryLimits()
+
+
+class AsyncLibrary:
+    """
+    Async counterparts of the blocking methods of a PPL, WPL or TPL instance
+
+    Attributes:
+      - library: the wrapped PPL, WPL or TPL instance
+      - system: the library system the limits are applied to. Defaults to the lowercase name of the library's class.
+      - executor: the thread pool the blocking calls run on
+      - limits: the LibraryLimits the calls are counted against
+      - timeout: the default number of seconds to wait for a call (None to wait forever)
+    """
+
+    def __init__(self, library, system=None, executor=None, limits=None, timeout=None):
+        self.library = library
+        self.system = system or type(library).__name__.lower()
+        self.executor = executor or default_executor()
+        self.limits = limits or DEFAULT_LIBRARY_LIMITS
+        self.timeout = timeout
+        self._lock = asyncio.Lock()
+
+    async def _call(self, timeout, function, *args):
+        """
+        Runs a blocking function on the executor once the library and a slot of its system are free
+
+        Parameters
+        ----------
+        timeout: float
+            The number of seconds to wait for the whole call, including waiting for a free slot. Uses self.timeout if
+            None.
+        function: function
+            The blocking function
+        Returns
+        -------
+        The value returned by the function. Raises asyncio.TimeoutError if the call timed out.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        return await asyncio.wait_for(self._run(function, *args), timeout)
+
+    async def _run(self, function, *args):
+        semaphore = self.limits.semaphore(self.system)
+        await semaphore.acquire()
+        try:
+            await self._lock.acquire()
+        except BaseException:
+            semaphore.release()
+            raise
+        loop = asyncio.get_running_loop()
+
+        def release():
+            self._lock.release()
+            semaphore.release()
+
+        def release_from_thread(_):
+            # the library is only free again once its blocking call has returned, even if the caller stopped waiting
+            try:
+                loop.call_soon_threadsafe(release)
+            except RuntimeError:
+                pass  # the event loop has already been closed
+
+        try:
+            future = self.executor.submit(function, *args)
+        except BaseException:
+            release()
+            raise
+        future.add_done_callback(release_from_thread)
+        # cancelling the wrapped future cancels the call if it hasn't started running yet
+        return await asyncio.wrap_future(future)
+
+    async def items_on_hold(self, username, password, timeout=None):
+        return await self._call(timeout, self.library.items_on_hold, username, password)
+
+    async def items_checked_out(self, username, password, timeout=None):
+        return await self._call(timeout, self.library.items_checked_out, username, password)
+
+    async def snapshot(self, username, password, timeout=None):
+        return await self._call(timeout, self.library.snapshot, username, password)
+
+    async def hours(self, branch, timeout=None):
+        return await self._call(timeout, self.library.hours, branch)
+
+    async def close(self, timeout=None):
+        """
+        Closes the wrapped library once its running call has returned
+        """
+        await self._call(timeout, self.library.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        await self.close()
+
+
+async def snapshot_all(accounts, timeout=None):
+    """
+    Takes a snapshot of every account concurrently
+
+    Parameters
+    ----------
+    accounts: dict
+        (AsyncLibrary, username, password) keyed by the name of the account
+    timeout: float
+        The number of seconds to wait for each snapshot
+    Returns
+    -------
+    dict
+        The items of each account (see PPL.snapshot), or the exception its snapshot raised, keyed by the name of the
+        account
+    """
+    names = list(accounts)
+    results = await asyncio.gather(*(library.snapshot(username, password, timeout)
+                                     for library, username, password in accounts.values()), return_exceptions=True)
+    return dict(zip(names, results))
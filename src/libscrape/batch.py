@@ -0,0 +1,433 @@
+"""
+Scrapes the holds and checkouts of many library accounts in one run. The accounts are read from a CSV file with the
+columns system, username, secret and phone, where the secret is a reference to the account's password rather than the
+password itself:
+
+- env:NAME reads the password from the environment variable NAME
+- file:PATH reads the password from the first line of the file at PATH
+
+The accounts are handed out to a pool of worker processes one at a time, so a slow account never holds up a shard of
+others. Each worker signs in over plain HTTP first and only starts a headless Chrome (once, reused for the rest of its
+accounts) when a site needs one. The number of sign-ins per minute is limited per library host across all the workers.
+Transient errors are retried with backoff, and a library whose circuit breaker opened after repeated failures is
+skipped (its accounts fail at once) until it recovers.
+Every account's result is yielded (and written as a json line) the moment it finishes, followed by a summary of the
+throughput and latency of the run.
+
+Usage:
+    python batch.py accounts.csv --output items.jsonl [--workers 4] [--rate 6] [--sms]
+"""
+
+import argparse
+import csv
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from multiprocessing.util import Finalize
+from urllib.parse import urlsplit
+
+from driver_pool import DriverPool, headless_chrome
+from http_backend import SITES, HttpBackend, http_snapshot_pages
+from library import PPL, WPL, TPL
+from resilience import NO_RETRIES, BreakerRegistry, CircuitOpenError, RetryPolicy
+
+LIBRARY_CLASSES = {"ppl": PPL, "wpl": WPL, "tpl": TPL}
+HOSTS = {system: urlsplit(site.base_url).netloc for system, site in SITES.items()}
+DEFAULT_RATE = 6  # sign-ins per minute per library host
+
+# the driver pool of the current worker process, created by start_worker
+_driver_pool = None
+
+
+class Account:
+    """
+    A library account to scrape
+
+    Attributes:
+      - system: the library system of the account ("ppl", "wpl" or "tpl")
+      - username: the username of the account
+      - secret: the reference to the account's password (e.g. "env:PPL_PASS" or "file:/run/secrets/ppl")
+      - phone: the phone number the account's items are texted to (may be empty)
+    """
+
+    def __init__(self, system, username, secret, phone=""):
+        self.system = system
+        self.username = username
+        self.secret = secret
+        self.phone = phone
+
+    @property
+    def name(self):
+        return f"{self.system}:{self.username}"
+
+    def __repr__(self):
+        return f"Account({self.name})"
+
+
+def resolve_secret(reference):
+    """
+    Returns the password a secret reference points to
+
+    Parameters
+    ----------
+    reference: str
+        "env:NAME" for the environment variable NAME or "file:PATH" for the first line of the file at PATH
+    Returns
+    -------
+    str
+    """
+    kind, _, location = reference.partition(':')
+    if kind == "env":
+        if location not in os.environ:
+            raise KeyError(f"The environment variable {location} is not set")
+        return os.environ[location]
+    if kind == "file":
+        with open(location, encoding='utf-8') as f:
+            return f.readline().rstrip('\r\n')
+    raise ValueError(f"Unknown secret reference {reference!r}, expected env:NAME or file:PATH")
+
+
+def read_accounts(path):
+    """
+    Reads the accounts of a CSV file with the columns system, username, secret and phone
+
+    Returns
+    -------
+    Account[]
+    """
+    accounts = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for line_number, row in enumerate(csv.DictReader(f), start=2):
+            system = (row.get("system") or "").strip().lower()
+            if system not in LIBRARY_CLASSES:
+                raise ValueError(f"{path}:{line_number}: unknown library system {system!r}")
+            accounts.append(Account(system, row["username"].strip(), row["secret"].strip(),
+                                    (row.get("phone") or "").strip()))
+    return accounts
+
+
+class RateLimiter:
+    """
+    Limits the number of sign-ins per minute per library host across processes. Each call to wait reserves the next
+    free slot of its host, so sign-ins are spread evenly instead of bursting at the start of each minute.
+
+    Attributes:
+      - rate: the number of sign-ins per minute of a host that isn't in rates
+      - rates: dict of the number of sign-ins per minute keyed by host
+    """
+
+    def __init__(self, manager, rate=DEFAULT_RATE, rates=None):
+        self.rate = rate
+        self.rates = dict(rates or {})
+        # the next free slot of each host, shared with the worker processes through the manager
+        self._slots = manager.dict()
+        self._lock = manager.Lock()
+
+    def wait(self, host):
+        """
+        Blocks until the host's next free slot and returns the number of seconds waited
+        """
+        interval = 60.0 / self.rates.get(host, self.rate)
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._slots.get(host, 0.0))
+            self._slots[host] = slot + interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+class AccountResult:
+    """
+    The outcome of scraping one account
+
+    Attributes:
+      - account: the Account
+      - items: the items of the account (see PPL.snapshot), or None if scraping it failed
+      - error: the formatted error scraping the account raised, or None if it succeeded
+      - waited: the number of seconds the account waited for the rate limit
+      - seconds: the number of seconds it took to scrape the account, without waiting for the rate limit
+      - skipped: True if the account wasn't scraped because the circuit of its library was open
+      - skipped_items: the number of the account's items that were skipped because their layout is unknown (see
+        lib_layouts)
+    """
+
+    def __init__(self, account, items=None, error=None, waited=0.0, seconds=0.0, skipped=False):
+        self.account = account
+        self.items = items
+        self.error = error
+        self.waited = waited
+        self.seconds = seconds
+        self.skipped = skipped
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def skipped_items(self):
+        return self.items.get("skipped_items", 0) if self.items is not None else 0
+
+    def to_dict(self):
+        result = {"system": self.account.system, "username": self.account.username, "ok": self.ok,
+                  "error": self.error, "skipped": self.skipped, "skipped_items": self.skipped_items,
+                  "waited": round(self.waited, 3), "seconds": round(self.seconds, 3)}
+        if self.items is not None:
+            result["holds"] = [item.to_dict() for item in self.items["holds"]]
+            result["checkouts"] = [item.to_dict() for item in self.items["checkouts"]]
+        return result
+
+
+def percentile(values, fraction):
+    """
+    Returns the nearest-rank percentile of values (e.g. fraction=0.95 for the 95th percentile), or None if empty
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(len(ordered) * fraction)) - 1]
+
+
+class BatchStats:
+    """
+    The throughput and latency of a batch run
+
+    Attributes:
+      - latencies: the seconds each finished account took, in the order they finished
+      - failed: the number of accounts that failed
+      - seconds: the wall-clock time of the run so far
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.failed = 0
+        self.seconds = 0.0
+
+    def add(self, result):
+        self.latencies.append(result.seconds)
+        if not result.ok:
+            self.failed += 1
+
+    @property
+    def accounts_per_minute(self):
+        return len(self.latencies) * 60.0 / self.seconds if self.seconds else 0.0
+
+    def summary(self):
+        """
+        Returns a plain text summary of the throughput and the p50, p95 and p99 latency of the run
+        """
+        latencies = ', '.join(f"p{int(fraction * 100)} {percentile(self.latencies, fraction) or 0.0:.2f}s"
+                              for fraction in (0.5, 0.95, 0.99))
+        return (f"{len(self.latencies) - self.failed}/{len(self.latencies)} accounts succeeded in {self.seconds:.2f}s "
+                f"({self.accounts_per_minute:.1f} accounts/min; latency {latencies})")
+
+
+def start_worker(driver_factory):
+    """
+    Initializes a worker process with a driver pool of one driver, which is only started when a site can't be scraped
+    over HTTP and is quit when the worker exits
+    """
+    global _driver_pool
+    _driver_pool = DriverPool(size=1, driver_factory=driver_factory, prewarm=False)
+    Finalize(_driver_pool, _driver_pool.close, exitpriority=10)
+
+
+def snapshot_account(system, username, password):
+    """
+    Returns the items of an account, signing in over HTTP when possible and with the worker's driver otherwise
+    """
+    backend = HttpBackend(system)
+    try:
+        pages = http_snapshot_pages(backend, username, password)
+    finally:
+        backend.close()
+    if pages is not None:
+        return LIBRARY_CLASSES[system]().parse_snapshot(*pages)
+    library = LIBRARY_CLASSES[system](driver_pool=_driver_pool)
+    try:
+        return library.snapshot(username, password)
+    finally:
+        library.close()
+
+
+def scrape_account(account, rate_limiter, scrape=snapshot_account, breakers=None, retry_policy=NO_RETRIES):
+    """
+    Scrapes an account in a worker process once its host's rate limit allows it, unless the circuit of its library is
+    open
+
+    Returns
+    -------
+    AccountResult
+    """
+    result = AccountResult(account)
+    try:
+        password = resolve_secret(account.secret)
+        breaker = breakers.breaker(account.system) if breakers is not None else None
+        if breaker is not None and breaker.rejecting():
+            raise CircuitOpenError(account.system, breaker.retry_at)
+        result.waited = rate_limiter.wait(HOSTS.get(account.system, account.system))
+        start = time.perf_counter()
+        try:
+            if breaker is not None:
+                result.items = breaker.call(scrape, account.system, account.username, password,
+                                            retry_policy=retry_policy)
+            else:
+                result.items = retry_policy.call(scrape, account.system, account.username, password)
+        finally:
+            result.seconds = time.perf_counter() - start
+    except CircuitOpenError as e:
+        result.error = f"{type(e).__name__}: {e}"
+        result.skipped = True
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    return result
+
+
+def run_batch(accounts, workers=None, rate=DEFAULT_RATE, rates=None, stats=None, scrape=snapshot_account,
+              driver_factory=headless_chrome, retry_policy=None, failure_threshold=3, reset_timeout=300,
+              on_outage=None):
+    """
+    Scrapes the accounts across a pool of worker processes and yields the result of each account as soon as it
+    finishes
+
+    Parameters
+    ----------
+    accounts: Account[]
+    workers: int
+        The number of worker processes. Defaults to the number of CPUs.
+    rate: float
+        The number of sign-ins per minute per library host
+    rates: dict
+        The number of sign-ins per minute of specific hosts (e.g. {"account.torontopubliclibrary.ca": 3})
+    stats: BatchStats
+        Updated with every result and the wall-clock time of the run as the results are yielded
+    scrape: function
+        A picklable function that takes the system, username and password of an account and returns its items
+    driver_factory: function
+        A picklable function without arguments that returns a new WebDriver, started by a worker the first time one of
+        its accounts can't be scraped over HTTP
+    retry_policy: resilience.RetryPolicy
+        How transient errors are retried. Defaults to 3 attempts with exponential backoff.
+    failure_threshold: int
+        The number of consecutive transient failures of a library after which its accounts are skipped
+    reset_timeout: float
+        The number of seconds a failing library is skipped before one of its accounts is tried again
+    on_outage: function
+        Called with the AccountResult of the first skipped account of each phone number while a library is down, e.g.
+        to tell the user once instead of once per account
+    Returns
+    -------
+    generator of AccountResult
+    """
+    stats = stats if stats is not None else BatchStats()
+    start = time.perf_counter()
+    with multiprocessing.Manager() as manager:
+        rate_limiter = RateLimiter(manager, rate, rates)
+        # the breakers let one account through to test a failing library instead of probing it, which
+        # keeps the registry picklable
+        registry = BreakerRegistry(failure_threshold, reset_timeout, manager=manager)
+        retry_policy = retry_policy or RetryPolicy()
+        with ProcessPoolExecutor(max_workers=workers, initializer=start_worker,
+                                 initargs=(driver_factory,)) as executor:
+            futures = [executor.submit(scrape_account, account, rate_limiter, scrape, registry, retry_policy)
+                       for account in accounts]
+            for future in as_completed(futures):
+                result = future.result()
+                if result.skipped and on_outage is not None and \
+                        registry.notify_once(result.account.system, result.account.phone):
+                    on_outage(result)
+                stats.add(result)
+                stats.seconds = time.perf_counter() - start
+                yield result
+
+
+def text_result(result, messaging_session=None, snapshot_store=None):
+    """
+    Adds the checkouts and holds of a scraped account to the consolidated text of its phone number in
+    messaging_session, or texts them at once without a session. With a snapshot_store.SnapshotStore, only what
+    changed since the account's last snapshot is added.
+    """
+    from lib_assets import MessagingSession
+    from snapshot_store import add_account_snapshot
+
+    session = messaging_session or MessagingSession()
+    add_account_snapshot(session, result.account.phone, LIBRARY_CLASSES[result.account.system].name, result.items,
+                         snapshot_store, result.account.system, result.account.username)
+    if messaging_session is None:
+        session.send()
+
+
+def text_outage(result, outbox=None):
+    """
+    Texts an account's phone number that its library isn't responding, or adds the text to an outbox.Outbox so that
+    the batch doesn't wait for it to be sent
+    """
+    from lib_assets import Messenger
+
+    name = LIBRARY_CLASSES[result.account.system].name
+    text = f"{name} isn't responding, your checkouts and holds will be sent once it is back up."
+    if outbox is not None:
+        outbox.enqueue(result.account.phone, text)
+    else:
+        Messenger(name).send_text(result.account.phone, text)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("accounts", help="the CSV file of accounts")
+    arg_parser.add_argument("--output", default="-", help="the json lines file the results are written to")
+    arg_parser.add_argument("--workers", type=int, default=None, help="the number of worker processes")
+    arg_parser.add_argument("--rate", type=float, default=DEFAULT_RATE,
+                            help="the number of sign-ins per minute per library host")
+    arg_parser.add_argument("--sms", action="store_true", help="text each account's items to its phone number")
+    arg_parser.add_argument("--outbox", default=os.environ.get('LIBSCRAPE_OUTBOX'),
+                            help="the database the texts are queued in until they have been sent (defaults to "
+                                 "outbox.sqlite3 next to outbox.py)")
+    arg_parser.add_argument("--snapshots", default=os.environ.get('LIBSCRAPE_SNAPSHOTS'),
+                            help="the json file of the last snapshot of every account (defaults to snapshots.json next "
+                                 "to snapshot_store.py)")
+    arg_parser.add_argument("--full", action="store_true",
+                            help="text the full checkouts and holds instead of only what changed since the last batch")
+    args = arg_parser.parse_args()
+
+    run_stats = BatchStats()
+    # the accounts of a phone number are texted together once the batch is done. The texts are queued in an outbox
+    # that is drained in the background, so sending them never holds up the scrapes. Unless --full is given, only what
+    # changed since an account's last batch is texted.
+    messaging = outbox = delivery = snapshots = None
+    if args.sms:
+        from lib_assets import MessagingSession
+        from outbox import BackgroundDelivery, Outbox
+        from snapshot_store import SnapshotStore
+        messaging = MessagingSession()
+        outbox = Outbox(args.outbox) if args.outbox else Outbox()
+        if not args.full:
+            snapshots = SnapshotStore(args.snapshots) if args.snapshots else SnapshotStore()
+        delivery = BackgroundDelivery(outbox).start()
+    out = sys.stdout if args.output == "-" else open(args.output, 'w', encoding='utf-8')
+    try:
+        outage_alert = partial(text_outage, outbox=outbox) if args.sms else None
+        for account_result in run_batch(read_accounts(args.accounts), args.workers, args.rate, stats=run_stats,
+                                        on_outage=outage_alert):
+            out.write(json.dumps(account_result.to_dict()) + '\n')
+            out.flush()
+            if not account_result.ok:
+                print(f"{account_result.account.name} failed: {account_result.error}", file=sys.stderr)
+            elif args.sms and account_result.account.phone:
+                text_result(account_result, messaging, snapshots)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if delivery is not None:
+            messaging.enqueue(outbox)
+            if snapshots is not None:
+                snapshots.save()
+            print(f"Texts: {delivery.finish().summary()}", file=sys.stderr)
+            outbox.close()
+    print(run_stats.summary(), file=sys.stderr)
@@ -0,0 +1,413 @@
+"""
+Benchmarks for the scraping and parsing pipeline. Every benchmark runs offline on saved pages, except capture which
+loads the public pages of the library sites in headless Chrome. When there are no saved pages (sample_pages/ isn't
+checked in), extraction and parsing run on synthetic pages of the built-in items instead.
+
+Usage:
+    python benchmarks.py extraction [page_dir]
+    python benchmarks.py parsing [page_dir]
+    python benchmarks.py suite [--sizes 10 100 1000 10000] [--output benchmark-results.json]
+    python benchmarks.py capture [url ...] [--output capture-results.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import timeit
+import tracemalloc
+from datetime import date, datetime
+
+from bs4 import BeautifulSoup
+
+from capture_profile import LEAN_PROFILE, page_load_timing
+from driver_pool import headless_chrome
+
+from lib_assets import Item, Messenger
+from lib_extractor import available_engines, default_engine, extract_item_lines
+from lib_parser import DurhamCheckoutParser, DurhamHoldParser
+from library import DurhamLibrary, PPL, WPL, TPL
+from parser_utils import parse_saved_page_name
+from synthetic_pages import PAGE_SELECTORS, SAMPLE_PAGES, built_in_page, synthetic_page
+
+SUITE_SIZES = (10, 100, 1000, 10000)
+SUITE_PAGES = (("ppl", "holds"), ("ppl", "checkouts"), ("tpl", "holds"), ("tpl", "checkouts"))
+# the number of items on the synthetic pages used when there are no saved pages
+FALLBACK_ITEMS = 50
+LIBRARY_CLASSES = {"ppl": PPL, "wpl": WPL, "tpl": TPL}
+# public pages of the library sites, which load the same images, fonts and scripts as the account pages
+CAPTURE_URLS = ("https://pickeringlibrary.ca/locations/PC/", "https://www.whitbylibrary.ca/hours",
+                "https://www.torontopubliclibrary.ca/branches/",
+                "https://pickering.bibliocommons.com/v2/search?query=a")
+
+
+def page_selector(file_name):
+    """
+    Returns the item container selector of a saved page, or None if the page isn't a holds or checkouts page
+
+    Parameters
+    ----------
+    file_name: str
+        The name of a page saved by save_output_as_html (e.g. wpl-holds-Jan-05-2022.html)
+    Returns
+    -------
+    str
+    """
+    page_info = parse_saved_page_name(file_name)
+    if page_info is None:
+        return None
+    return PAGE_SELECTORS.get(page_info[:2])
+
+
+def saved_pages(page_dir, libraries=("ppl", "wpl", "tpl")):
+    """
+    Returns the name, item container selector and source of every saved holds and checkouts page of the libraries in
+    page_dir, or an empty list if the directory doesn't exist
+    """
+    if not page_dir or not os.path.isdir(page_dir):
+        return []
+    pages = []
+    for file_name in sorted(os.listdir(page_dir)):
+        selector = page_selector(file_name)
+        if not selector or not file_name.startswith(tuple(library + "-" for library in libraries)):
+            continue
+        with open(os.path.join(page_dir, file_name), encoding='utf-8') as f:
+            pages.append((file_name, selector, f.read()))
+    return pages
+
+
+def benchmark_pages(page_dir, libraries=("ppl", "wpl", "tpl"), num_items=FALLBACK_ITEMS):
+    """
+    Returns the saved pages of the libraries in page_dir (see saved_pages), or a synthetic holds and checkouts page of
+    num_items built-in items for each library if there are none
+
+    Returns
+    -------
+    ((str, str, str)[], bool)
+        The (name, selector, page source) of every page and whether the pages are synthetic
+    """
+    pages = saved_pages(page_dir, libraries)
+    if pages:
+        return pages, False
+    return [(f"{library}-{page}-synthetic-{num_items}", PAGE_SELECTORS[(library, page)],
+             built_in_page(library, page, num_items)) for library in libraries for page in ("holds", "checkouts")], True
+
+
+def best_time(func, repeat, number=1):
+    """
+    Returns the fastest time in seconds of a single call to func
+    """
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+
+def benchmark_extraction(page_dir=SAMPLE_PAGES, repeat=5):
+    """
+    Times every extraction engine on each saved holds and checkouts page in page_dir, or on synthetic pages if there
+    are none
+
+    Parameters
+    ----------
+    page_dir: str
+        The directory of saved pages
+    repeat: int
+        The number of times each engine is timed on each page. The fastest time is reported.
+    Returns
+    -------
+    dict[]
+    """
+    results = []
+    for file_name, selector, page_source in benchmark_pages(page_dir)[0]:
+        reference = extract_item_lines(page_source, selector, "soup")
+        row = {"page": file_name, "items": len(reference)}
+        for engine in available_engines():
+            if extract_item_lines(page_source, selector, engine) != reference:
+                raise AssertionError(f"The {engine} engine does not match the reference output on {file_name}")
+            row[engine] = best_time(lambda: extract_item_lines(page_source, selector, engine), repeat)
+        results.append(row)
+    return results
+
+
+def print_extraction_results(results):
+    engines = available_engines()
+    print(f"{'page':<40}{'items':>6}" + ''.join(f"{engine + ' (ms)':>14}" for engine in engines) + f"{'speedup':>10}")
+    for row in results:
+        timings = ''.join(f"{row[engine] * 1000:>14.2f}" for engine in engines)
+        speedup = row["soup"] / row["lxml"] if "lxml" in row else 1
+        print(f"{row['page']:<40}{row['items']:>6}" + timings + f"{speedup:>9.1f}x")
+
+
+def reference_durham_fields(library_obj, lines, is_hold):
+    """
+    Parses a Durham Region library item the way DurhamLibrary did before the layout table: with select_parser,
+    has_subtitle and the parser's all method
+    """
+    parser_class = DurhamHoldParser if is_hold else DurhamCheckoutParser
+    parsers = library_obj.parsers["holds" if is_hold else "checkouts"]
+    item_format = parser_class.format(lines)
+    parser, generic_format = library_obj.select_parser(item_format, parsers)
+    if not parser:
+        return None
+    return tuple(parser.all(lines, generic_format, parser_class.has_subtitle(lines, generic_format)))
+
+
+def reference_durham_items(library_obj, item_lines, is_hold):
+    """
+    Parses Durham Region library items into Items the way DurhamLibrary.parse_hold_data and parse_checkout_data did
+    before the layout table
+    """
+    items = []
+    for lines in item_lines:
+        fields = reference_durham_fields(library_obj, lines, is_hold)
+        if fields is None:
+            continue
+        title, item_format, contributors, status, item_date = fields[:5]
+        item = Item(date_retrieved=date.today(), title=title, contributors=contributors, item_format=item_format,
+                    is_hold=is_hold, item_date=item_date, status=status, branch=fields[5] if is_hold else '',
+                    system='durham')
+        if item.title:
+            items.append(item)
+    return items
+
+
+def benchmark_durham_parsing(page_dir=SAMPLE_PAGES, repeat=5):
+    """
+    Times the per-item cost of parsing the Durham Region items on each saved PPL and WPL page in page_dir, or on
+    synthetic pages if there are none, with DurhamLibrary.parse_hold_data and parse_checkout_data (the layout table)
+    and with the reference parsers they replaced
+
+    Parameters
+    ----------
+    page_dir: str
+        The directory of saved pages
+    repeat: int
+        The number of times each page is parsed. The fastest time is reported.
+    Returns
+    -------
+    dict[]
+    """
+    library_obj = DurhamLibrary()
+    results = []
+    for file_name, selector, page_source in benchmark_pages(page_dir, ("ppl", "wpl"))[0]:
+        is_hold = "-holds" in file_name
+        parse = library_obj.parse_hold_data if is_hold else library_obj.parse_checkout_data
+        item_lines = extract_item_lines(page_source, selector)
+        if not item_lines:
+            continue
+        skipped_before = library_obj.skipped_items
+        parse(item_lines)
+        skipped = library_obj.skipped_items - skipped_before
+        reference = best_time(lambda: reference_durham_items(library_obj, item_lines, is_hold), repeat, number=100)
+        layouts = best_time(lambda: parse(item_lines), repeat, number=100)
+        results.append({"page": file_name, "items": len(item_lines), "skipped": skipped,
+                        "reference": reference / len(item_lines), "layouts": layouts / len(item_lines)})
+    return results
+
+
+def print_parsing_results(results):
+    print(f"{'page':<40}{'items':>6}{'skipped':>9}{'reference (us/item)':>22}{'layouts (us/item)':>20}{'speedup':>10}")
+    for row in results:
+        print(f"{row['page']:<40}{row['items']:>6}{row['skipped']:>9}{row['reference'] * 1e6:>22.2f}"
+              f"{row['layouts'] * 1e6:>20.2f}{row['reference'] / row['layouts']:>9.1f}x")
+
+
+def suite_stages(library, page, page_source, engine):
+    """
+    Returns the stages of the scraping pipeline for a page in the order they run. Each stage is a (name, function)
+    pair and each function takes the output of the stage before it (the page source for the first two stages).
+
+    Parameters
+    ----------
+    library: str
+        The library the page is from ("ppl", "wpl", "tpl")
+    page: str
+        The kind of page ("holds", "checkouts")
+    page_source: str
+        Plain text html of the page
+    engine: str
+        The name of the extraction engine used by hold_data/checkout_data
+    Returns
+    -------
+    (str, function)[]
+    """
+    library_class = LIBRARY_CLASSES[library]
+    is_hold = page == "holds"
+    extract = library_class.hold_data if is_hold else library_class.checkout_data
+    if library == "tpl":
+        item_parser = TPL.parse_hold_data if is_hold else TPL.parse_checkout_data
+        parse_stage = ("TPL.parse_" + page[:-1] + "_data",
+                       lambda item_data: [item_parser(lines) for lines in item_data])
+    else:
+        library_obj = library_class()
+        parse = library_obj.parse_hold_data if is_hold else library_obj.parse_checkout_data
+        parse_stage = ("DurhamLibrary.parse_" + page[:-1] + "_data", parse)
+    return [
+        ("soup construction", lambda source: BeautifulSoup(source, "html.parser")),
+        (("hold_data" if is_hold else "checkout_data"), lambda source: extract(source, engine)),
+        parse_stage,
+        ("Messenger.formulate_text", lambda items: Messenger.formulate_text(items, "plain")),
+    ]
+
+
+def peak_memory(func, arg):
+    """
+    Returns the peak memory in bytes allocated by Python while calling func(arg)
+    """
+    tracemalloc.start()
+    try:
+        func(arg)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_suite(sizes=SUITE_SIZES, pages=SUITE_PAGES, engine=None, repeat=3, page_dir=SAMPLE_PAGES):
+    """
+    Times each stage of the scraping pipeline separately on synthetic holds and checkouts pages of every size and
+    measures the peak memory of each stage. Runs fully offline.
+
+    Parameters
+    ----------
+    sizes: int[]
+        The numbers of items on the synthetic pages
+    pages: (str, str)[]
+        The (library, page) pairs to benchmark
+    engine: str
+        The name of the extraction engine used by hold_data/checkout_data. Uses the global default if not given.
+    repeat: int
+        The number of times each stage is timed. The fastest time is reported.
+    page_dir: str
+        The directory of fixture pages the synthetic pages are grown from (see synthetic_pages.synthetic_page)
+    Returns
+    -------
+    dict[]
+        One row per library, page, size and stage with the fastest time in seconds, the throughput in items per second
+        and the peak memory in bytes
+    """
+    engine = engine or default_engine()
+    results = []
+    for library, page in pages:
+        for size in sizes:
+            page_source = synthetic_page(library, page, size, page_dir)
+            stages = suite_stages(library, page, page_source, engine)
+            stage_input = page_source
+            for name, func in stages:
+                # soup construction feeds nothing forward, every other stage feeds the next one
+                output = func(stage_input)
+                seconds = best_time(lambda: func(stage_input), repeat)
+                results.append({"library": library, "page": page, "items": size, "stage": name, "seconds": seconds,
+                                "items_per_second": size / seconds if seconds else None,
+                                "peak_memory_bytes": peak_memory(func, stage_input)})
+                if name != "soup construction":
+                    stage_input = output
+    return results
+
+
+def write_suite_results(results, path, engine=None):
+    """
+    Writes the results of benchmark_suite with details of the environment to a json file
+    """
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "engine": engine or default_engine(),
+        "results": results,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+        f.write('\n')
+
+
+def print_suite_results(results):
+    print(f"{'page':<16}{'items':>7}  {'stage':<34}{'time (ms)':>12}{'items/s':>14}{'peak (KiB)':>13}")
+    for row in results:
+        print(f"{row['library'] + '-' + row['page']:<16}{row['items']:>7}  {row['stage']:<34}"
+              f"{row['seconds'] * 1000:>12.2f}{row['items_per_second'] or 0:>14.0f}"
+              f"{row['peak_memory_bytes'] / 1024:>13.1f}")
+
+
+def benchmark_capture(urls=CAPTURE_URLS, repeat=3, profiles=(("full", None), ("lean", LEAN_PROFILE))):
+    """
+    Times loading each url in headless Chrome with every capture profile
+
+    Parameters
+    ----------
+    urls: str[]
+        The pages to load
+    repeat: int
+        The number of times each page is loaded with each profile. The fastest load is kept.
+    profiles: tuple
+        The (name, CaptureProfile) pairs to compare, where a profile of None loads every resource
+    Returns
+    -------
+    dict[]
+        The "profile", "url", the wall-clock "get_seconds" of driver.get and the "dom_content_loaded" and "load" times
+        in seconds of the fastest load of each page with each profile
+    """
+    results = []
+    for name, profile in profiles:
+        driver = headless_chrome(profile)
+        try:
+            for url in urls:
+                best = None
+                for _ in range(repeat):
+                    driver.get("about:blank")
+                    start = timeit.default_timer()
+                    driver.get(url)
+                    get_seconds = timeit.default_timer() - start
+                    if best is None or get_seconds < best["get_seconds"]:
+                        best = {"profile": name, "url": url, "get_seconds": get_seconds,
+                                **(page_load_timing(driver) or {"dom_content_loaded": None, "load": None})}
+                results.append(best)
+        finally:
+            driver.quit()
+    return results
+
+
+def print_capture_results(results):
+    print(f"{'profile':<8}{'get (ms)':>10}{'DOM ready (ms)':>16}{'load (ms)':>11}  url")
+    for row in results:
+        times = [row[key] * 1000 if row[key] is not None else float('nan')
+                 for key in ("get_seconds", "dom_content_loaded", "load")]
+        print(f"{row['profile']:<8}{times[0]:>10.0f}{times[1]:>16.0f}{times[2]:>11.0f}  {row['url']}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = arg_parser.add_subparsers(dest="benchmark", required=True)
+    extraction = subparsers.add_parser("extraction", help="compare the extraction engines on saved pages")
+    extraction.add_argument("page_dir", nargs="?", default=SAMPLE_PAGES)
+    extraction.add_argument("--repeat", type=int, default=5)
+    parsing = subparsers.add_parser("parsing", help="compare the Durham parsers with the layout table")
+    parsing.add_argument("page_dir", nargs="?", default=SAMPLE_PAGES)
+    parsing.add_argument("--repeat", type=int, default=5)
+    suite = subparsers.add_parser("suite", help="time each pipeline stage on synthetic pages of increasing size")
+    suite.add_argument("--sizes", type=int, nargs="+", default=list(SUITE_SIZES))
+    suite.add_argument("--engine", default=None, help="the extraction engine to use (soup, lxml)")
+    suite.add_argument("--repeat", type=int, default=3)
+    suite.add_argument("--page-dir", default=SAMPLE_PAGES, help="the directory of fixture pages to grow")
+    suite.add_argument("--output", default="benchmark-results.json", help="the json file the results are written to")
+    capture = subparsers.add_parser("capture", help="compare page load times with and without the lean profile")
+    capture.add_argument("urls", nargs="*", default=list(CAPTURE_URLS))
+    capture.add_argument("--repeat", type=int, default=3)
+    capture.add_argument("--output", default="capture-results.json", help="the json file the results are written to")
+    args = arg_parser.parse_args()
+
+    if args.benchmark in ("extraction", "parsing") and not saved_pages(args.page_dir):
+        print(f"No saved holds or checkouts pages in {args.page_dir}, using synthetic pages of {FALLBACK_ITEMS} "
+              f"built-in items instead\n")
+    if args.benchmark == "extraction":
+        print_extraction_results(benchmark_extraction(args.page_dir, args.repeat))
+    elif args.benchmark == "parsing":
+        print_parsing_results(benchmark_durham_parsing(args.page_dir, args.repeat))
+    elif args.benchmark == "suite":
+        suite_results = benchmark_suite(args.sizes, engine=args.engine, repeat=args.repeat, page_dir=args.page_dir)
+        write_suite_results(suite_results, args.output, args.engine)
+        print_suite_results(suite_results)
+    elif args.benchmark == "capture":
+        capture_results = benchmark_capture(args.urls, args.repeat)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"created": datetime.now().isoformat(timespec="seconds"), "results": capture_results}, f,
+                      indent=2)
+            f.write('\n')
+        print_capture_results(capture_results)
@@ -0,0 +1,131 @@
+"""
+Library for lean page captures. Only the DOM text of the library sites is scraped, but every page also loads images,
+web fonts, analytics tags and ad scripts before its load event fires. A CaptureProfile blocks them:
+
+- hosts on the deny list are unresolvable for the whole browser (--host-resolver-rules), unless they are on the
+  allow list
+- images are disabled for the whole browser with a content setting
+- requests for blocked resource types (matched by file extension) and denied hosts are also blocked in each tab with
+  the Chrome DevTools Protocol (Network.setBlockedURLs), which covers resources the content setting doesn't
+- the eager page load strategy makes driver.get return once the DOM is ready instead of waiting for the load event
+
+The maintained lists are in capture_profile.json. Load times are recorded per page with page_load_timing, see
+'python benchmarks.py capture' to compare them with and without a profile.
+"""
+
+import json
+import os
+
+curr_path = os.path.dirname(__file__)
+DEFAULT_PROFILE_PATH = os.path.join(curr_path, 'capture_profile.json')
+
+# reads the navigation timing of the current page, in milliseconds since the navigation started
+NAVIGATION_TIMING_SCRIPT = """
+var entry = performance.getEntriesByType('navigation')[0];
+return entry ? [entry.domContentLoadedEventEnd, entry.loadEventEnd] : null;
+"""
+
+
+def host_matches(host, pattern):
+    """
+    Returns True if host is pattern or one of its subdomains
+    """
+    return host == pattern or host.endswith('.' + pattern)
+
+
+class CaptureProfile:
+    """
+    The resources a browser skips while capturing pages
+
+    Attributes:
+      - blocked_types: dict of the url patterns of each blocked resource type (e.g. {"font": ["*.woff2"]})
+      - deny_hosts: the hosts (and their subdomains) whose requests are blocked
+      - allow_hosts: the hosts (and their subdomains) that are never blocked, even if they are on the deny list
+      - eager: True to use the eager page load strategy
+    """
+
+    def __init__(self, blocked_types=None, deny_hosts=(), allow_hosts=(), eager=True):
+        self.blocked_types = dict(blocked_types or {})
+        self.deny_hosts = list(deny_hosts)
+        self.allow_hosts = list(allow_hosts)
+        self.eager = eager
+
+    @classmethod
+    def load(cls, path=DEFAULT_PROFILE_PATH, eager=True):
+        with open(path, encoding='utf-8') as f:
+            profile = json.load(f)
+        return cls(profile.get("blocked_types"), profile.get("deny_hosts", ()), profile.get("allow_hosts", ()), eager)
+
+    def blocked_hosts(self):
+        """
+        Returns the hosts on the deny list that aren't on the allow list
+        """
+        return [host for host in self.deny_hosts
+                if not any(host_matches(host, allowed) for allowed in self.allow_hosts)]
+
+    def blocked_urls(self):
+        """
+        Returns the url patterns of Network.setBlockedURLs ('*' matches any characters)
+        """
+        patterns = [pattern for type_patterns in self.blocked_types.values() for pattern in type_patterns]
+        for host in self.blocked_hosts():
+            patterns.extend((f"*://{host}/*", f"*://*.{host}/*"))
+        return patterns
+
+    def host_resolver_rules(self):
+        """
+        Returns the value of Chrome's --host-resolver-rules switch that makes the blocked hosts unresolvable
+        """
+        return ', '.join(f"MAP {pattern} ~NOTFOUND" for host in self.blocked_hosts() for pattern in (host, '*.' + host))
+
+    def configure(self, options):
+        """
+        Adds the browser-wide settings of this profile to ChromeOptions, before the driver is started
+        """
+        if self.blocked_hosts():
+            options.add_argument(f'--host-resolver-rules={self.host_resolver_rules()}')
+        if "image" in self.blocked_types:
+            options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+            options.add_argument('--blink-settings=imagesEnabled=false')
+        if self.eager:
+            options.set_capability("pageLoadStrategy", "eager")
+        return options
+
+    def apply(self, driver):
+        """
+        Blocks the resources of this profile in the current tab of a running driver. Returns False if the driver has
+        no Chrome DevTools Protocol.
+        """
+        try:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": self.blocked_urls()})
+        except Exception:
+            return False
+        return True
+
+
+LEAN_PROFILE = CaptureProfile.load()
+
+
+def page_load_timing(driver):
+    """
+    Returns the load times of the current page in seconds since its navigation started
+
+    Parameters
+    ----------
+    driver: selenium.webdriver.Chrome
+    Returns
+    -------
+    dict
+        The time until the DOM was ready under "dom_content_loaded" and until the load event ended under "load" (None
+        if the page is still loading), or None if the browser has no navigation timing
+    """
+    try:
+        timing = driver.execute_script(NAVIGATION_TIMING_SCRIPT)
+    except Exception:
+        return None
+    if not timing:
+        return None
+    dom_content_loaded, load = timing
+    return {"dom_content_loaded": dom_content_loaded / 1000 if dom_content_loaded else None,
+            "load": load / 1000 if load else None}
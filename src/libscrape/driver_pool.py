@@ -0,0 +1,348 @@
+"""
+Library for sharing a pool of pre-warmed headless Chrome WebDrivers between scraping jobs. Starting Chrome costs
+seconds of CPU, so the pool starts its drivers once and lends them out:
+
+- a borrowed driver is health-checked first and replaced if it no longer responds
+- a returned driver has its cookies, cache, the storage of every site it visited, its blocked urls and its
+  performance log cleared so the next borrower starts from a clean session
+- a borrower waits at most a configurable number of seconds for a driver, so that a driver that is never returned
+  fails the jobs waiting for it instead of hanging the run
+- a driver is recycled (quit and replaced) after a configurable number of sessions or when the memory of its browser
+  processes grows above a configurable ceiling
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from selenium import webdriver
+
+from gateway_capture import enable_performance_log
+
+try:
+    import psutil
+except ImportError:  # psutil is optional, the memory of the browser processes is read from /proc without it
+    psutil = None
+
+# the number of seconds acquire waits for a driver to be returned when every driver is lent out
+DEFAULT_ACQUIRE_TIMEOUT = 120
+
+
+def headless_chrome(capture_profile=None, performance_log=False):
+    """
+    Returns a new headless Chrome WebDriver
+
+    Parameters
+    ----------
+    capture_profile: capture_profile.CaptureProfile
+        The resources the browser skips (e.g. capture_profile.LEAN_PROFILE), or None to load every resource
+    performance_log: bool
+        True if the browser writes the network events of its pages to the performance log, which
+        gateway_capture.GatewayCapture reads
+    Returns
+    -------
+    selenium.webdriver.Chrome
+    """
+    options = webdriver.ChromeOptions()
+    options.add_argument('--no-sandbox')
+    options.add_argument('--window-size=1920,1080')
+    options.add_argument('--headless')
+    options.add_argument('--disable-gpu')
+    if capture_profile is not None:
+        capture_profile.configure(options)
+    if performance_log:
+        enable_performance_log(options)
+    driver = webdriver.Chrome(options=options)
+    if capture_profile is not None:
+        capture_profile.apply(driver)
+    return driver
+
+
+def process_tree_rss(pid):
+    """
+    Returns the resident set size in bytes of a process and all of its descendants, or None if it can't be measured
+
+    Parameters
+    ----------
+    pid: int
+        The id of the root process (e.g. the chromedriver process, whose descendants are the browser's processes)
+    Returns
+    -------
+    int
+    """
+    if psutil is not None:
+        try:
+            root = psutil.Process(pid)
+            processes = [root] + root.children(recursive=True)
+            return sum(process.memory_info().rss for process in processes)
+        except psutil.Error:
+            return None
+    if not os.path.isdir('/proc'):
+        return None
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # the parent's id is the second field after the command, which is wrapped in parentheses
+                parent = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/statm') as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            if current == pid:
+                return None
+            continue
+        pending.extend(children.get(current, []))
+    return total
+
+
+def driver_rss(driver):
+    """
+    Returns the resident set size in bytes of a WebDriver's processes, or None if it can't be measured
+    """
+    process = getattr(getattr(driver, 'service', None), 'process', None)
+    if process is None:
+        return None
+    return process_tree_rss(process.pid)
+
+
+def is_healthy(driver):
+    """
+    Returns True if the WebDriver's browser still responds to commands
+    """
+    try:
+        return driver.execute_script("return 1") == 1
+    except Exception:
+        return False
+
+
+def url_origin(url):
+    """
+    Returns the origin of an http or https url (e.g. "https://pickering.bibliocommons.com"), or None for other urls
+    """
+    parts = urlsplit(url or "")
+    return f"{parts.scheme}://{parts.netloc}" if parts.scheme in ("http", "https") and parts.netloc else None
+
+
+def visited_origins(driver):
+    """
+    Returns the origins of the pages in the navigation history of the current tab of a WebDriver and of the sites
+    that set its cookies
+    """
+    origins = set()
+    history = driver.execute_cdp_cmd("Page.getNavigationHistory", {}) or {}
+    for entry in history.get("entries", []):
+        origins.add(url_origin(entry.get("url")))
+    origins.add(url_origin(driver.current_url))
+    cookies = driver.execute_cdp_cmd("Network.getAllCookies", {}) or {}
+    for cookie in cookies.get("cookies", []):
+        domain = cookie.get("domain", "").lstrip('.')
+        if domain:
+            origins.add(f"https://{domain}")
+            origins.add(f"http://{domain}")
+    origins.discard(None)
+    return origins
+
+
+def clear_session(driver, blocked_urls=()):
+    """
+    Clears the cookies, cache and storage of every site a WebDriver visited, closes its other tabs, restores its
+    blocked urls and drains its performance log, and leaves it on a blank page with an empty history so the next
+    borrower starts from a clean session
+
+    Parameters
+    ----------
+    driver: selenium.webdriver.Chrome
+    blocked_urls: str[]
+        The url patterns the driver blocks between sessions (e.g. those of the capture profile it was started with)
+    """
+    try:
+        driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+    except Exception:
+        pass  # pages such as about:blank have no storage
+    try:
+        origins = set()
+        handles = list(driver.window_handles)
+        for handle in handles[1:]:
+            driver.switch_to.window(handle)
+            origins |= visited_origins(driver)
+            driver.close()
+        driver.switch_to.window(handles[0])
+        origins |= visited_origins(driver)
+        for origin in sorted(origins):
+            driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": list(blocked_urls)})
+    except Exception:
+        # drivers without the Chrome DevTools Protocol can only clear the cookies of the current domain
+        driver.delete_all_cookies()
+    driver.get("about:blank")
+    try:
+        driver.execute_cdp_cmd("Page.resetNavigationHistory", {})
+    except Exception:
+        pass
+    try:
+        driver.get_log("performance")
+    except Exception:
+        pass  # the driver doesn't write a performance log
+
+
+class DriverPool:
+    """
+    A pool of pre-warmed WebDrivers that are lent to one borrower at a time
+
+    Attributes:
+      - size: the number of drivers in the pool
+      - driver_factory: a function without arguments that returns a new WebDriver
+      - max_sessions: the number of times a driver is lent out before it is recycled
+      - max_rss: the resident set size in bytes of a driver's processes above which it is recycled (None to disable)
+      - acquire_timeout: the number of seconds acquire waits for a driver by default
+      - capture_profile: the capture profile the drivers are started with, whose blocked urls are restored when a
+        driver is returned (None if they block nothing)
+    """
+
+    def __init__(self, size=2, driver_factory=headless_chrome, max_sessions=50, max_rss=None, prewarm=True,
+                 acquire_timeout=DEFAULT_ACQUIRE_TIMEOUT, capture_profile=None):
+        self.size = size
+        self.driver_factory = driver_factory
+        self.max_sessions = max_sessions
+        self.max_rss = max_rss
+        self.acquire_timeout = acquire_timeout
+        self.capture_profile = capture_profile
+        self._idle = queue.LifoQueue()
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+        if prewarm and size > 0:
+            self._created = size
+            with ThreadPoolExecutor(max_workers=size) as executor:
+                for driver in executor.map(lambda _: self._new_driver(), range(size)):
+                    self._idle.put(driver)
+
+    def _new_driver(self):
+        # the caller has already counted the driver in self._created
+        try:
+            driver = self.driver_factory()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+        with self._lock:
+            self._sessions[id(driver)] = 0
+        return driver
+
+    def _discard(self, driver):
+        with self._lock:
+            self._sessions.pop(id(driver), None)
+            self._created -= 1
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def acquire(self, timeout=None):
+        """
+        Borrows a healthy driver from the pool, starting one if the pool isn't full yet
+
+        Parameters
+        ----------
+        timeout: float
+            The number of seconds to wait for a driver to be returned when every driver is lent out. Defaults to
+            acquire_timeout, raises TimeoutError when it runs out.
+        Returns
+        -------
+        selenium.webdriver.Chrome
+        """
+        if self._closed:
+            raise RuntimeError("The driver pool is closed")
+        timeout = self.acquire_timeout if timeout is None else timeout
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_start = self._created < self.size
+                    if can_start:
+                        self._created += 1
+                try:
+                    driver = self._new_driver() if can_start else self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"No driver was returned to the pool within {timeout} seconds") from None
+            if is_healthy(driver):
+                with self._lock:
+                    self._sessions[id(driver)] = self._sessions.get(id(driver), 0) + 1
+                return driver
+            self._discard(driver)
+
+    def release(self, driver):
+        """
+        Returns a borrowed driver to the pool. Its session is cleared, or it is recycled if it has been lent out
+        max_sessions times, uses more than max_rss bytes or no longer responds.
+
+        Parameters
+        ----------
+        driver: selenium.webdriver.Chrome
+            A driver borrowed with acquire
+        """
+        with self._lock:
+            sessions = self._sessions.get(id(driver), 0)
+        recycle = self._closed or sessions >= self.max_sessions
+        if not recycle and self.max_rss is not None:
+            rss = driver_rss(driver)
+            recycle = rss is not None and rss > self.max_rss
+        if not recycle:
+            try:
+                clear_session(driver, self.capture_profile.blocked_urls() if self.capture_profile is not None else ())
+            except Exception:
+                recycle = True
+        if not recycle:
+            self._idle.put(driver)
+            return
+        self._discard(driver)
+        if not self._closed:
+            # start the replacement now so borrowers waiting for a driver aren't left waiting for their timeout
+            with self._lock:
+                self._created += 1
+            self._idle.put(self._new_driver())
+
+    @contextmanager
+    def borrow(self, timeout=None):
+        """
+        Borrows a driver for the duration of a with block
+        """
+        driver = self.acquire(timeout)
+        try:
+            yield driver
+        finally:
+            self.release(driver)
+
+    def close(self):
+        """
+        Quits every idle driver. Drivers that are lent out are quit when they are returned.
+        """
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
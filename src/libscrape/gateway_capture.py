@@ -0,0 +1,285 @@
+"""
+Library for reading the account data of the BiblioCommons sites (PPL, WPL) from the JSON their pages are rendered
+from. The v2 holds and checkouts pages fetch the account's items from the BiblioCommons gateway
+(https://gateway.bibliocommons.com/v2/libraries/<library>/holds and /checkouts) and render them in the browser. Instead
+of waiting for the rendered item list and splitting its text into positional lines, GatewayCapture watches Chrome's
+performance log for the gateway responses, reads their bodies with the DevTools protocol and maps the payloads
+straight to Items.
+
+Chrome only writes the performance log when the driver was started with enable_performance_log (see
+driver_pool.headless_chrome). gateway_samples/ has payloads in the gateway's shape for offline tests, of PPL and of WPL
+(whose holds span two pages). They were written by hand to match the items of synthetic_pages, not recorded from a
+live account.
+
+The gateway returns the items a page at a time. When the first page says there are more ("pages" > 1), the rest are
+fetched by the browser from the same url with the next page numbers, so that the session's cookies go with them.
+
+Payload shape (the parts that are read):
+    {"borrowing": {"holds": {"pagination": {"page": 1, "pages": 2, "count": 30, "limit": 25},
+                             "results": ["<hold id>", ...]}},
+     "entities": {"holds": {"<hold id>": {"metadataId": "<bib id>", "status": "READY_FOR_PICKUP",
+                                          "pickupLocation": {"name": "Central Library"}, "expiryDate": "2024-01-13",
+                                          "pickupByDate": null}},
+                  "checkouts": {"<checkout id>": {"metadataId": "<bib id>", "status": "OUT", "dueDate": "2022-01-11"}},
+                  "bibs": {"<bib id>": {"briefInfo": {"title": "...", "authors": ["..."], "format": "BK"}}}}}
+"""
+
+import base64
+import json
+import os
+import re
+from datetime import date
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from lib_assets import Item
+
+curr_path = os.path.dirname(__file__)
+GATEWAY_SAMPLES = os.path.join(curr_path, 'gateway_samples')
+
+# the gateway requests of the holds and checkouts pages, e.g. /v2/libraries/pickering/holds?page=1&limit=25
+GATEWAY_URL = re.compile(r'^https?://gateway\.bibliocommons\.com/v2/libraries/[^/]+/'
+                         r'(?P<kind>holds|checkouts)(?:[/?]|$)')
+# the names the pages show for the format codes of the gateway
+FORMATS = {"BK": "Book", "DVD": "DVD", "BLURAY": "Blu-ray Disc", "MUSIC_CD": "Music CD", "EBOOK": "eBook",
+           "AB": "Audiobook CD", "BOOK_CD": "Audiobook CD", "EAUDIOBOOK": "eAudiobook", "LPRINT": "Large Print",
+           "GRAPHIC_NOVEL": "Graphic Novel", "MAG": "Magazine", "VIDEO_GAME": "Video Game", "BOARD_BK": "Board Book"}
+READY_HOLD_STATUSES = ("READY_FOR_PICKUP",)
+OVERDUE_CHECKOUT_STATUSES = ("OVERDUE",)
+DUE_SOON_CHECKOUT_STATUSES = ("COMING_DUE", "DUE_SOON")
+# checkouts due within this many days are "Due Soon" when the payload doesn't say
+DUE_SOON_DAYS = 3
+# fetches a gateway url with the cookies of the page and passes its body, or the error, to the callback of
+# execute_async_script
+FETCH_SCRIPT = """
+var done = arguments[arguments.length - 1];
+fetch(arguments[0], {credentials: "include", headers: {"Accept": "application/json"}})
+    .then(function (response) {
+        return response.ok ? response.text() : Promise.reject(new Error("HTTP " + response.status));
+    })
+    .then(function (body) { done({body: body}); }, function (error) { done({error: String(error)}); });
+"""
+
+
+class GatewayError(Exception):
+    """
+    Raised when the payloads of a page can't all be read from the gateway (e.g. a later page of results failed to load)
+    """
+
+
+def enable_performance_log(options):
+    """
+    Makes a browser started with options write the network events of its pages to the performance log
+
+    Parameters
+    ----------
+    options: selenium.webdriver.ChromeOptions
+    """
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+
+
+def display_date(iso_date):
+    """
+    Returns a date of the gateway ("2024-01-13") the way the pages show it ("Jan. 13, 2024")
+    """
+    if not iso_date:
+        return ""
+    day = date.fromisoformat(iso_date[:10])
+    # months are abbreviated with a period, except May, whose abbreviation is its name
+    month = f"{day:%b}" if f"{day:%b}" == f"{day:%B}" else f"{day:%b}."
+    return f"{month} {day:%d}, {day:%Y}"
+
+
+def display_format(code):
+    return FORMATS.get(code, (code or "").replace('_', ' ').title())
+
+
+def hold_status(hold):
+    """
+    Normalizes the status of a hold to "Ready" or "Not Ready", like lib_parser.hold_status
+    """
+    return "Ready" if hold.get("status") in READY_HOLD_STATUSES else "Not Ready"
+
+
+def checkout_status(checkout, today):
+    """
+    Normalizes the status of a checkout to "Due Soon", "Due Later" or "Overdue", like lib_parser.checkout_status
+    """
+    status = checkout.get("status")
+    due = date.fromisoformat(checkout["dueDate"][:10]) if checkout.get("dueDate") else None
+    if status in OVERDUE_CHECKOUT_STATUSES or (due is not None and due < today):
+        return "Overdue"
+    if status in DUE_SOON_CHECKOUT_STATUSES or (due is not None and (due - today).days <= DUE_SOON_DAYS):
+        return "Due Soon"
+    return "Due Later"
+
+
+def pagination(kind, payload):
+    """
+    Returns the page number of a payload and the number of pages of results, both 1 if the payload doesn't say
+    """
+    info = payload.get("borrowing", {}).get(kind, {}).get("pagination") or {}
+    return info.get("page") or 1, info.get("pages") or 1
+
+
+def page_url(url, page):
+    """
+    Returns a gateway url with its page parameter set to page
+    """
+    parts = urlsplit(url)
+    query = [(name, value) for name, value in parse_qsl(parts.query) if name != "page"] + [("page", str(page))]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def ordered_entities(kind, payloads):
+    """
+    Returns the hold or checkout entities of payloads in the order the pages list them, without duplicates, with the
+    bibs of every payload merged
+
+    Returns
+    -------
+    (dict[], dict)
+        The entities of the kind and the bibs keyed by their metadataId
+    """
+    entities, bibs, order = {}, {}, []
+    for payload in sorted(payloads, key=lambda payload: pagination(kind, payload)[0]):
+        payload_entities = payload.get("entities", {})
+        entities.update(payload_entities.get(kind, {}))
+        bibs.update(payload_entities.get("bibs", {}))
+        order.extend(payload.get("borrowing", {}).get(kind, {}).get("results", []))
+    order.extend(entities)
+    seen = set()
+    ordered = []
+    for entity_id in order:
+        if entity_id in entities and entity_id not in seen:
+            seen.add(entity_id)
+            ordered.append(entities[entity_id])
+    return ordered, bibs
+
+
+def items_from_payloads(kind, payloads, date_retrieved=None):
+    """
+    Maps the gateway payloads of a holds or checkouts page to Items
+
+    Parameters
+    ----------
+    kind: str
+        "holds" or "checkouts"
+    payloads: dict[]
+        The decoded JSON bodies of the gateway responses of the page (one per page of results)
+    date_retrieved: datetime.date
+        The date the payloads were captured. Defaults to today.
+    Returns
+    -------
+    Item[]
+    """
+    date_retrieved = date_retrieved or date.today()
+    entities, bibs = ordered_entities(kind, payloads)
+    items = []
+    for entity in entities:
+        info = bibs.get(entity.get("metadataId"), {}).get("briefInfo", {})
+        authors = info.get("authors") or []
+        title = info.get("title", "")
+        item_format = display_format(info.get("format"))
+        if not title:
+            continue
+        if kind == "holds":
+            ready = hold_status(entity) == "Ready"
+            item_date = display_date(entity.get("pickupByDate") if ready else None) or \
+                display_date(entity.get("expiryDate"))
+            items.append(Item(date_retrieved=date_retrieved, title=title, contributors=authors[0] if authors else "",
+                              item_format=item_format, is_hold=True, item_date=item_date, status=hold_status(entity),
+                              branch=(entity.get("pickupLocation") or {}).get("name", ""), system='durham'))
+        else:
+            items.append(Item(date_retrieved=date_retrieved, title=title, contributors=authors[0] if authors else "",
+                              item_format=item_format, is_hold=False, item_date=display_date(entity.get("dueDate")),
+                              status=checkout_status(entity, date_retrieved), branch='', system='durham'))
+    return items
+
+
+def load_sample(system, kind, sample_dir=GATEWAY_SAMPLES, page=1):
+    """
+    Returns a sample gateway payload (e.g. gateway_samples/ppl-holds.json, or gateway_samples/wpl-holds-page-2.json for
+    the second page of results)
+    """
+    file_name = f"{system}-{kind}.json" if page == 1 else f"{system}-{kind}-page-{page}.json"
+    with open(os.path.join(sample_dir, file_name), encoding='utf-8') as f:
+        return json.load(f)
+
+
+class GatewayCapture:
+    """
+    Collects the gateway payloads of the pages a driver loads from its performance log. Creating a capture discards
+    the events already in the log, so that payloads of an earlier session (e.g. the last user of a pooled driver)
+    aren't mistaken for the current one's.
+
+    Attributes:
+      - driver: a web driver started with enable_performance_log
+      - payloads: the decoded payloads captured so far, keyed by kind ("holds", "checkouts")
+      - urls: the url of the first gateway response of each kind, or None until one is captured
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.payloads = {"holds": [], "checkouts": []}
+        self.urls = {"holds": None, "checkouts": None}
+        self._pending = {}  # the kind of every gateway response whose body hasn't finished loading, keyed by request
+        driver.get_log("performance")
+
+    def poll(self):
+        """
+        Reads the new events of the performance log and fetches the bodies of the gateway responses that have finished
+        loading
+        """
+        for entry in self.driver.get_log("performance"):
+            message = json.loads(entry["message"])["message"]
+            method, params = message.get("method"), message.get("params", {})
+            if method == "Network.responseReceived":
+                match = GATEWAY_URL.match(params.get("response", {}).get("url", ""))
+                if match and params.get("type", "XHR") in ("XHR", "Fetch"):
+                    self._pending[params["requestId"]] = match.group("kind")
+                    self.urls[match.group("kind")] = self.urls[match.group("kind")] or params["response"]["url"]
+            elif method == "Network.loadingFinished" and params.get("requestId") in self._pending:
+                kind = self._pending.pop(params["requestId"])
+                self.payloads[kind].append(self._body(params["requestId"]))
+
+    def _body(self, request_id):
+        response = self.driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": request_id})
+        body = response["body"]
+        if response.get("base64Encoded"):
+            body = base64.b64decode(body).decode('utf-8')
+        return json.loads(body)
+
+    def captured(self, kind):
+        """
+        Returns an expectation that a payload of the kind has been captured
+        """
+        def gateway_captured(driver):
+            self.poll()
+            return bool(self.payloads[kind])
+        return gateway_captured
+
+    def missing_pages(self, kind):
+        """
+        Returns the numbers of the pages of results of the kind that haven't been captured, in order
+        """
+        captured = {pagination(kind, payload)[0] for payload in self.payloads[kind]}
+        pages = max((pagination(kind, payload)[1] for payload in self.payloads[kind]), default=1)
+        return [page for page in range(1, pages + 1) if page not in captured]
+
+    def fetch_missing_pages(self, kind):
+        """
+        Fetches the pages of results of the kind the page hasn't loaded itself (e.g. holds 26 to 50 of an account with
+        a page limit of 25) in the browser, with the url of the first page. Raises GatewayError if a page can't be
+        fetched.
+        """
+        for page in self.missing_pages(kind):
+            if self.urls[kind] is None:
+                raise GatewayError(f"No gateway url to fetch page {page} of the {kind} from")
+            url = page_url(self.urls[kind], page)
+            result = self.driver.execute_async_script(FETCH_SCRIPT, url) or {}
+            if "body" not in result:
+                raise GatewayError(f"Could not fetch page {page} of the {kind} from {url}: {result.get('error')}")
+            self.payloads[kind].append(json.loads(result["body"]))
+
+    def items(self, kind, date_retrieved=None):
+        return items_from_payloads(kind, self.payloads[kind], date_retrieved)
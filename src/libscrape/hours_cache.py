@@ -0,0 +1,138 @@
+"""
+Library for caching the hours of library branches on disk. Branch hours change a few times a year, so the hours of
+each (system, branch) are kept in a json file and served without a browser until they are older than the cache's
+time to live. An expired entry is refreshed by scraping the hours again and comparing the hash of the scraped hours
+with the stored hash: the stored hours are only rewritten when they have actually changed, otherwise only the time
+the entry was last checked is updated.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+curr_path = os.path.dirname(__file__)
+# runtime state, kept out of the source tree (see .gitignore)
+DEFAULT_CACHE_PATH = os.path.join(curr_path, 'state', 'hours_cache.json')
+DEFAULT_TTL = 7 * 24 * 60 * 60  # one week in seconds
+
+
+def content_hash(hours):
+    """
+    Returns the sha256 hex digest of the hours of a branch
+    """
+    return hashlib.sha256(hours.encode('utf-8')).hexdigest()
+
+
+class HoursCache:
+    """
+    A persistent cache of branch hours keyed by (system, branch)
+
+    Attributes:
+      - path: the path of the json file the cache is stored in
+      - ttl: the number of seconds an entry is served before it is checked again
+      - clock: a function that returns the current time in seconds since the epoch
+      - entries: dict of entries keyed by "system/branch". Each entry holds the "hours", their "hash", the time they
+        last "changed" and the time they were last "checked".
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def key(system, branch):
+        return f"{system}/{branch}"
+
+    def get(self, system, branch):
+        """
+        Returns the cached hours of a branch, or None if they aren't cached or have expired
+
+        Parameters
+        ----------
+        system: str
+            The library system of the branch (e.g. "ppl", "wpl", "tpl")
+        branch: str
+            The name of the branch
+        Returns
+        -------
+        str
+        """
+        entry = self.entries.get(self.key(system, branch))
+        if entry is None or self.clock() - entry["checked"] >= self.ttl:
+            return None
+        return entry["hours"]
+
+    def put(self, system, branch, hours):
+        """
+        Stores freshly scraped hours of a branch. The stored hours and the time they changed are only rewritten if the
+        hash of the hours differs from the stored hash.
+
+        Parameters
+        ----------
+        system: str
+            The library system of the branch (e.g. "ppl", "wpl", "tpl")
+        branch: str
+            The name of the branch
+        hours: str
+            The scraped hours of the branch
+        Returns
+        -------
+        bool
+            True if the stored hours changed
+        """
+        now = self.clock()
+        digest = content_hash(hours)
+        with self._lock:
+            entry = self.entries.get(self.key(system, branch))
+            changed = entry is None or entry["hash"] != digest
+            if changed:
+                self.entries[self.key(system, branch)] = {"hours": hours, "hash": digest, "changed": now,
+                                                          "checked": now}
+            else:
+                entry["checked"] = now
+            self.save()
+        return changed
+
+    def hours(self, system, branch, scrape):
+        """
+        Returns the hours of a branch from the cache, scraping them with scrape if they aren't cached or have expired
+
+        Parameters
+        ----------
+        system: str
+            The library system of the branch (e.g. "ppl", "wpl", "tpl")
+        branch: str
+            The name of the branch
+        scrape: function
+            A function without arguments that scrapes the hours of the branch (e.g. a bound _scrape_hours method)
+        Returns
+        -------
+        str
+        """
+        hours = self.get(system, branch)
+        if hours is None:
+            hours = scrape()
+            self.put(system, branch, hours)
+        return hours
+
+    def save(self):
+        """
+        Writes the cache to its json file. The file is replaced atomically so that a crash never leaves it half
+        written.
+        """
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+            f.write('\n')
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,226 @@
+"""
+Library for scraping holds and checkouts over plain HTTP instead of a browser. The login form is fetched and posted
+with a pooled requests.Session (connections are kept alive between requests) and the html of the holds and checkouts
+pages is handed to the same hold_data/checkout_data/parse_*_data code as the Selenium pages. A session costs a few MB
+instead of a browser's hundreds, but it only works while the sites render the item lists on the server, so the
+libraries fall back to Selenium whenever an HttpBackendError is raised.
+"""
+
+import logging
+from urllib.parse import urljoin
+
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0 Safari/537.36"
+
+
+class HttpBackendError(Exception):
+    """
+    Raised when a page can't be scraped over HTTP (e.g. the login was rejected or the page needs JavaScript)
+    """
+
+
+class HttpSite:
+    """
+    The urls and markup of a library system's account pages
+
+    Attributes:
+      - system: the library system (e.g. "ppl", "wpl", "tpl")
+      - base_url: the scheme and host of the account pages (e.g. "https://pickering.bibliocommons.com")
+      - login_path: the path of the login page, including the query string that redirects to the holds page
+      - holds_path: the path of the holds page
+      - checkouts_path: the path of the checkouts page
+      - username_selector: the CSS selector of the login form's username input
+      - password_selector: the CSS selector of the login form's password input
+      - signed_out_marker: part of the url the site redirects to when the user isn't signed in
+      - holds_marker: markup that is only on the holds page once its items have been rendered on the server
+      - checkouts_marker: markup that is only on the checkouts page once its items have been rendered on the server
+    """
+
+    def __init__(self, system, base_url, login_path, holds_path, checkouts_path, username_selector, password_selector,
+                 signed_out_marker, holds_marker, checkouts_marker):
+        self.system = system
+        self.base_url = base_url
+        self.login_path = login_path
+        self.holds_path = holds_path
+        self.checkouts_path = checkouts_path
+        self.username_selector = username_selector
+        self.password_selector = password_selector
+        self.signed_out_marker = signed_out_marker
+        self.holds_marker = holds_marker
+        self.checkouts_marker = checkouts_marker
+
+    def url(self, path):
+        return self.base_url.rstrip('/') + path
+
+    def rebased(self, base_url):
+        """
+        Returns a copy of this site served from another base url (e.g. a local replay server)
+        """
+        return HttpSite(self.system, base_url, self.login_path, self.holds_path, self.checkouts_path,
+                        self.username_selector, self.password_selector, self.signed_out_marker, self.holds_marker,
+                        self.checkouts_marker)
+
+
+SITES = {
+    "ppl": HttpSite("ppl", "https://pickering.bibliocommons.com", "/user/login?destination=%2Fv2%2Fholds",
+                    "/v2/holds", "/v2/checkedout", "input[testid=field_username]", "input[testid=field_userpin]",
+                    "/user/login", "cp-item-list", "cp-item-list"),
+    "wpl": HttpSite("wpl", "https://whitby.bibliocommons.com", "/user/login?destination=%2Fv2%2Fholds",
+                    "/v2/holds", "/v2/checkedout", "input[testid=field_username]", "input[testid=field_userpin]",
+                    "/user/login", "cp-item-list", "cp-item-list"),
+    "tpl": HttpSite("tpl", "https://account.torontopubliclibrary.ca", "/signin?redirect=%2Fholds", "/holds",
+                    "/checkouts", "#userID", "#password", "/signin", "holds-redux", "item-wrapper"),
+}
+
+
+def pooled_session(pool_size=10):
+    """
+    Returns a requests.Session that keeps up to pool_size connections per host alive between requests
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+
+def login_form_data(page_source, username_selector, password_selector, username, password):
+    """
+    Fills in a login form
+
+    Parameters
+    ----------
+    page_source: str
+        Plain text html of the login page
+    username_selector: str
+        The CSS selector of the username input
+    password_selector: str
+        The CSS selector of the password input
+    username: str
+    password: str
+    Returns
+    -------
+    (str, dict)
+        The action of the form (None if it posts to the login page itself) and the form's fields, including its hidden
+        fields such as CSRF tokens
+    """
+    soup = BeautifulSoup(page_source, "html.parser")
+    username_input = soup.select_one(username_selector)
+    password_input = soup.select_one(password_selector)
+    if username_input is None or password_input is None:
+        raise HttpBackendError("The login page has no login form")
+    form = username_input.find_parent("form")
+    if form is None:
+        raise HttpBackendError("The login inputs are not in a form")
+    data = {}
+    for field in form.select("input[name], select[name], textarea[name]"):
+        field_type = (field.get("type") or "text").lower()
+        if field_type in ("submit", "button", "image", "reset", "file"):
+            continue
+        if field_type in ("checkbox", "radio") and not field.has_attr("checked"):
+            continue
+        data[field["name"]] = field.get("value", "")
+    data[username_input.get("name", "username")] = username
+    data[password_input.get("name", "password")] = password
+    return form.get("action"), data
+
+
+class HttpBackend:
+    """
+    Scrapes the holds and checkouts pages of a library system over HTTP
+
+    Attributes:
+      - site: the HttpSite of the library system
+      - session: the requests.Session the pages are fetched with
+      - timeout: the number of seconds to wait for each response
+    """
+
+    def __init__(self, site, session=None, timeout=10):
+        self.site = SITES[site] if isinstance(site, str) else site
+        self.session = session or pooled_session()
+        self.timeout = timeout
+
+    def _get(self, url):
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise HttpBackendError(f"Could not fetch {url}: {e}") from e
+        return response
+
+    def login(self, username, password):
+        """
+        Posts the login form. Returns the response of the page the site redirects to after signing in.
+        """
+        login_url = self.site.url(self.site.login_path)
+        login_page = self._get(login_url)
+        if self.site.signed_out_marker not in login_page.url:
+            return login_page  # the session is still signed in
+        action, data = login_form_data(login_page.text, self.site.username_selector, self.site.password_selector,
+                                       username, password)
+        try:
+            response = self.session.post(urljoin(login_page.url, action or login_page.url), data=data,
+                                         timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise HttpBackendError(f"Could not sign in to {self.site.system}: {e}") from e
+        if self.site.signed_out_marker in response.url:
+            raise HttpBackendError(f"The {self.site.system} login was rejected")
+        return response
+
+    def fetch_page(self, path, marker):
+        """
+        Returns the html of a page that requires the user to be signed in
+
+        Parameters
+        ----------
+        path: str
+            The path of the page
+        marker: str
+            Markup the page must contain, which shows its items were rendered on the server
+        Returns
+        -------
+        str
+        """
+        response = self._get(self.site.url(path))
+        if self.site.signed_out_marker in response.url:
+            raise HttpBackendError(f"Signed out of {self.site.system} while fetching {path}")
+        if marker not in response.text:
+            raise HttpBackendError(f"{path} has no {marker!r} markup, the page may need JavaScript to render")
+        return response.text
+
+    def snapshot_pages(self, username, password):
+        """
+        Signs in and fetches the holds and checkouts pages
+
+        Returns
+        -------
+        (str, str)
+            The html of the holds page and the html of the checkouts page
+        """
+        self.login(username, password)
+        return (self.fetch_page(self.site.holds_path, self.site.holds_marker),
+                self.fetch_page(self.site.checkouts_path, self.site.checkouts_marker))
+
+    def close(self):
+        self.session.close()
+
+
+def http_snapshot_pages(backend, username, password):
+    """
+    Fetches the holds and checkouts pages with an HttpBackend, or returns None so that the caller can fall back to
+    Selenium if the backend is missing or fails
+    """
+    if backend is None:
+        return None
+    try:
+        return backend.snapshot_pages(username, password)
+    except HttpBackendError as e:
+        logger.warning("Falling back to Selenium: %s", e)
+        return None
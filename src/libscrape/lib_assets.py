@@ -4,6 +4,8 @@ Library containing classes that represent assets that libraries require for oper
 Classes:
 - Item: an item that can be checked out or put on hold in a library
 - Messenger: used to formulate and send text messages on behalf of the library
+- MessagingSession: collects the holds and checkouts (or their changes) of every library for each recipient and texts
+  them as one consolidated message
 """
 from datetime import date
 
@@ -13,7 +15,10 @@ from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 
 import os
-from twilio.rest import Client
+import threading
+
+from messaging import MAX_BODY_LENGTH, pack_bodies, twilio_client
+from tracing import traced
 
 
 class Item:
@@ -63,6 +68,18 @@ class Item:
                + f"item_format={self.item_format},is_hold={self.is_hold},status={self.status}," \
                 f"item_date={self.item_date},branch={self.branch})"
 
+    def to_dict(self):
+        """
+        Returns the attributes of this item as a json serializable dict. The date the data was retrieved is written in
+        ISO format (YYYY-MM-DD).
+        """
+        date_retrieved = self.date_retrieved
+        if isinstance(date_retrieved, date):
+            date_retrieved = date_retrieved.isoformat()
+        return {"date_retrieved": date_retrieved, "title": self.title, "contributors": self.contributors,
+                "item_format": self.item_format, "is_hold": self.is_hold, "status": self.status,
+                "item_date": self.item_date, "branch": self.branch, "system": self.system}
+
     def generate_mock(self):
         """
         Formulates a string version of the command needed to create this object using the Item
@@ -190,6 +207,28 @@ class Messenger:
         res += self.formulate_text(holds, text_type)
         return res
 
+    def formulate_changes_text(self, changes):
+        """
+        Returns the complete text that lists the changes of an account since its last snapshot
+
+        Parameters
+        ----------
+        changes: snapshot_store.Change[]
+            The changes to list
+        Returns
+        -------
+        str
+        """
+        res = '\n' + self.region + f" UPDATES ({date.today()}):\n"
+        for i, change in enumerate(changes, 1):
+            res += f"{i}. {change.kind.capitalize()}: {self.text_string(change.item)}"
+            if change.previous is not None and change.previous.item_date != change.item.item_date and \
+                    not change.item.is_hold:
+                res += f" (was {change.previous.item_date})"
+            res += '\n'
+        return res
+
+    @traced(category="messaging")
     def append_doc(self, items, is_hold):
         """
         Appends a report about items to the official Library Summary Google Doc
@@ -250,6 +289,24 @@ class Messenger:
 
         service.documents().batchUpdate(documentId=document_id, body={'requests': req}).execute()
 
+    @traced(category="messaging")
+    def send_text(self, phone_number, body):
+        """
+        Sends a plain text message (e.g. a notice that the library isn't responding)
+
+        Parameters
+        ----------
+        phone_number: the phone number that the text will be sent to, starting with "+" and the country calling
+            code
+        body: str
+            The text of the message
+        Returns
+        -------
+        An HTTP response attained after sending the text using the Twilio API
+        """
+        return twilio_client().messages.create(body=body, from_=os.environ['PHONE_FROM'], to=phone_number)
+
+    @traced(category="messaging")
     def send_checkouts_text(self, phone_number, data, text_type):
         """
         Sends a text reporting the current status of checkouts at a Durham Library
@@ -266,11 +323,8 @@ class Messenger:
         -------
         TODO: What is the return type?
         """
-        account_sid = os.environ['TWILIO_ACCOUNT_SID']
-        auth_token = os.environ['TWILIO_AUTH_TOKEN']
-        client = Client(account_sid, auth_token)
         res = self.formulate_checkouts_text(data, text_type)
-        message = client.messages \
+        message = twilio_client().messages \
             .create(
             body=res,
             from_=os.environ['PHONE_FROM'],
@@ -278,6 +332,7 @@ class Messenger:
         )
         return message
 
+    @traced(category="messaging")
     def send_holds_text(self, phone_number, data, text_type):
         """
         Sends a text reporting the current status of holds at a Durham Library
@@ -294,13 +349,148 @@ class Messenger:
         -------
         An HTTP response attained after sending the text using the Twilio API
         """
-        account_sid = os.environ['TWILIO_ACCOUNT_SID']
-        auth_token = os.environ['TWILIO_AUTH_TOKEN']
-        client = Client(account_sid, auth_token)
         res = self.formulate_holds_text(data, text_type)
-        message = client.messages.create(
+        message = twilio_client().messages.create(
             body=res,
             from_=os.environ['PHONE_FROM'],
             to=phone_number
         )
         return message
+
+
+class MessagingSession:
+    """
+    Collects the texts of a run for each recipient and sends them with as few API calls as possible: the checkouts
+    and holds of every library and any notices for a recipient are packed into as few messages of at most
+    MAX_BODY_LENGTH characters as possible, sent through the pooled client of the process. Sections can be added from
+    several threads.
+
+    Attributes:
+      - client: the Twilio client the messages are sent with (defaults to messaging.twilio_client())
+      - from_: the phone number the messages are sent from (defaults to the PHONE_FROM environment variable)
+      - text_type: the type of text the items are listed in ("doc", "plain")
+      - limit: the maximum number of characters of a message
+      - pending: the sections not sent yet, keyed by recipient in the order they were added
+    """
+
+    def __init__(self, client=None, from_=None, text_type="plain", limit=MAX_BODY_LENGTH):
+        self.client = client
+        self.from_ = from_
+        self.text_type = text_type
+        self.limit = limit
+        self.pending = {}
+        self._lock = threading.Lock()
+
+    def add_text(self, phone_number, text):
+        """
+        Adds a section of plain text (e.g. a notice that a library isn't responding) to a recipient's next message
+        """
+        with self._lock:
+            self.pending.setdefault(phone_number, []).append(text)
+
+    def add_items(self, phone_number, region, checkouts=None, holds=None):
+        """
+        Adds the checkouts and holds of a library to a recipient's next message
+
+        Parameters
+        ----------
+        phone_number: str
+            The phone number of the recipient, starting with "+" and the country calling code
+        region: str
+            The name of the library (e.g. "Pickering Public Library")
+        checkouts: Item[]
+            The checkouts to list, or None to leave them out
+        holds: Item[]
+            The holds to list, or None to leave them out
+        """
+        messenger = Messenger(region)
+        if checkouts is not None:
+            self.add_text(phone_number, messenger.formulate_checkouts_text(checkouts, self.text_type))
+        if holds is not None:
+            self.add_text(phone_number, messenger.formulate_holds_text(holds, self.text_type))
+
+    def add_changes(self, phone_number, region, changes):
+        """
+        Adds the changes of a library's account since its last snapshot to a recipient's next message. Nothing is
+        added if there are no changes.
+
+        Parameters
+        ----------
+        phone_number: str
+            The phone number of the recipient, starting with "+" and the country calling code
+        region: str
+            The name of the library (e.g. "Pickering Public Library")
+        changes: snapshot_store.Change[]
+            The changes to list (see snapshot_store.notable)
+        """
+        if changes:
+            self.add_text(phone_number, Messenger(region).formulate_changes_text(changes))
+
+    def bodies(self, phone_number):
+        """
+        Returns the bodies of the messages that send would send to a recipient
+        """
+        with self._lock:
+            sections = list(self.pending.get(phone_number, []))
+        return pack_bodies(sections, self.limit)
+
+    def enqueue(self, outbox, provider="twilio"):
+        """
+        Adds the messages of the pending sections of every recipient to an outbox.Outbox, to be sent by
+        outbox.deliver, and clears them. Like send, it puts the messages not added yet back in pending if one can't
+        be added.
+
+        Returns
+        -------
+        int
+            The number of messages added. A message that is already in the outbox isn't added again.
+        """
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        unsent = {phone_number: pack_bodies(sections, self.limit) for phone_number, sections in pending.items()}
+        added = 0
+        try:
+            for phone_number, bodies in list(unsent.items()):
+                while bodies:
+                    added += outbox.enqueue(phone_number, bodies[0], provider)
+                    bodies.pop(0)
+                del unsent[phone_number]
+        finally:
+            self._restore(unsent)
+        return added
+
+    @traced(category="messaging")
+    def send(self):
+        """
+        Sends the pending sections of every recipient and clears them. If a message can't be sent, the messages not
+        sent yet are put back in pending, ahead of any sections added since, and the error is raised.
+
+        Returns
+        -------
+        dict
+            The message instances sent to each recipient, keyed by phone number
+        """
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        unsent = {phone_number: pack_bodies(sections, self.limit) for phone_number, sections in pending.items()}
+        sent = {}
+        try:
+            client = self.client or twilio_client()
+            from_ = self.from_ or os.environ['PHONE_FROM']
+            for phone_number, bodies in list(unsent.items()):
+                sent[phone_number] = []
+                while bodies:
+                    sent[phone_number].append(client.messages.create(body=bodies[0], from_=from_, to=phone_number))
+                    bodies.pop(0)
+                del unsent[phone_number]
+        finally:
+            self._restore(unsent)
+        return sent
+
+    def _restore(self, unsent):
+        """
+        Puts the bodies of messages that weren't sent back in pending, ahead of the sections added since
+        """
+        with self._lock:
+            for phone_number, bodies in unsent.items():
+                self.pending[phone_number] = bodies + self.pending.get(phone_number, [])
@@ -0,0 +1,455 @@
+"""
+Library of extraction engines that pull the text of item containers (e.g. "div.cp-batch-actions-list-item") out of a
+scraped page. Every engine returns the same str[][] structure: one list of lines per matching container, produced by
+joining the container's text nodes with the newline character and splitting the result on the newline character.
+
+Available engines:
+- "soup": BeautifulSoup with Python's html.parser (the reference implementation)
+- "lxml": lxml's C-backed HTML parser
+
+iter_item_lines is a streaming counterpart of the engines that yields the lines of each container as soon as the
+container's closing tag has been read.
+
+extract_in_browser runs the extraction inside the browser instead, so only the lines of the containers cross the
+WebDriver wire rather than the whole page source.
+"""
+
+import json
+import re
+from abc import ABC, abstractmethod
+
+from bs4 import BeautifulSoup
+
+from tracing import span
+
+try:
+    import lxml.html
+    from lxml import etree
+    from lxml.cssselect import CSSSelector
+except ImportError:  # pragma: no cover - lxml is optional, the soup engine always works
+    lxml = None
+
+# BeautifulSoup stores the text inside these tags as special string types that get_text() leaves out
+SKIPPED_TEXT_TAGS = ("script", "style", "template", "rt", "rp")
+# BeautifulSoup collapses whitespace-only strings to a single character everywhere but inside these tags
+PRESERVE_WHITESPACE_TAGS = ("pre", "textarea")
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+
+class ItemExtractor(ABC):
+    """
+    An abstract ItemExtractor that outlines the required methods for a concrete extraction engine
+    """
+
+    @abstractmethod
+    def extract(self, page_source, selector):
+        """
+        Returns a list of lists of textual data for each element in page_source that matches selector
+
+        Parameters
+        ----------
+        page_source: str
+            Plain text html of a scraped page
+        selector: str
+            The CSS selector of the item containers
+
+        Returns
+        -------
+        str[][]
+        """
+        pass
+
+
+class SoupExtractor(ItemExtractor):
+    """
+    Reference extraction engine built on BeautifulSoup and Python's html.parser
+    """
+
+    def extract(self, page_source, selector):
+        res = []
+        soup = BeautifulSoup(page_source, "html.parser")
+        for item in soup.select(selector):
+            res.append(item.get_text('\n').split('\n'))
+        return res
+
+
+class LxmlExtractor(ItemExtractor):
+    """
+    Extraction engine built on lxml's C-backed HTML parser. Produces the same output as SoupExtractor.
+    """
+
+    def __init__(self):
+        if lxml is None:
+            raise ImportError("The lxml extraction engine requires the lxml and cssselect packages")
+        self._parser = lxml.html.HTMLParser(encoding='utf-8')
+        self._selectors = {}
+        skipped = " or ".join("ancestor::" + tag for tag in SKIPPED_TEXT_TAGS)
+        self._text_nodes = etree.XPath("descendant-or-self::text()[not(" + skipped + ")]", smart_strings=False)
+        self._parented_text_nodes = etree.XPath("descendant-or-self::text()[not(" + skipped + ")]")
+        preserved = " or ".join("descendant-or-self::" + tag for tag in PRESERVE_WHITESPACE_TAGS)
+        self._preserves_whitespace = etree.XPath("boolean(" + preserved + ")")
+
+    def _compiled(self, selector):
+        compiled = self._selectors.get(selector)
+        if compiled is None:
+            compiled = self._selectors[selector] = CSSSelector(selector)
+        return compiled
+
+    def element_lines(self, element):
+        """
+        Returns the text of an lxml element split into lines exactly like BeautifulSoup's get_text('\\n').split('\\n')
+
+        Parameters
+        ----------
+        element: lxml.html.HtmlElement
+
+        Returns
+        -------
+        str[]
+        """
+        if self._preserves_whitespace(element):
+            strings = [text if text.strip(ASCII_SPACES) or self._is_preserved(text) else _collapse(text)
+                       for text in self._parented_text_nodes(element)]
+        else:
+            strings = [text if text.strip(ASCII_SPACES) else _collapse(text) for text in self._text_nodes(element)]
+        return '\n'.join(strings).split('\n')
+
+    @staticmethod
+    def _is_preserved(text):
+        parent = text.getparent()
+        if text.is_tail:
+            parent = parent.getparent()
+        while parent is not None:
+            if parent.tag in PRESERVE_WHITESPACE_TAGS:
+                return True
+            parent = parent.getparent()
+        return False
+
+    def extract(self, page_source, selector):
+        if isinstance(page_source, str):
+            page_source = page_source.encode('utf-8')
+        if not page_source.strip():
+            return []
+        root = lxml.html.document_fromstring(page_source, parser=self._parser)
+        return [self.element_lines(item) for item in self._compiled(selector)(root)]
+
+
+class BrowserItems(list):
+    """
+    The lines of the item containers of a page, extracted in the browser by extract_in_browser. extract_item_lines
+    returns them as they are instead of parsing a page source.
+
+    Attributes:
+      - selector: the CSS selector the containers were matched with
+    """
+
+    def __init__(self, selector, lines):
+        super().__init__(lines)
+        self.selector = selector
+
+
+# mirrors SoupExtractor: the text nodes of each container outside of SKIPPED_TEXT_TAGS, with adjacent text nodes
+# merged and whitespace-only text collapsed outside of PRESERVE_WHITESPACE_TAGS, joined and split on newlines
+ITEM_LINES_SCRIPT = r"""
+var skipped = {SCRIPT: true, STYLE: true, TEMPLATE: true, RT: true, RP: true};
+var preserved = {PRE: true, TEXTAREA: true};
+function within(node, tags) {
+    for (var parent = node.parentNode; parent && parent.nodeType === 1; parent = parent.parentNode) {
+        if (tags[parent.nodeName.toUpperCase()]) {
+            return true;
+        }
+    }
+    return false;
+}
+var containers = document.querySelectorAll(arguments[0]);
+var items = [];
+for (var i = 0; i < containers.length; i++) {
+    var walker = document.createTreeWalker(containers[i], NodeFilter.SHOW_TEXT, null, false);
+    var strings = [];
+    var previous = null;
+    for (var node = walker.nextNode(); node; node = walker.nextNode()) {
+        if (!node.data || within(node, skipped)) {
+            continue;
+        }
+        if (previous !== null && node.previousSibling === previous) {
+            strings[strings.length - 1].text += node.data;
+        } else {
+            strings.push({text: node.data, node: node});
+        }
+        previous = node;
+    }
+    var texts = [];
+    for (var j = 0; j < strings.length; j++) {
+        var text = strings[j].text;
+        if (/^[ \n\t\f\r]*$/.test(text) && !within(strings[j].node, preserved)) {
+            text = text.indexOf("\n") >= 0 ? "\n" : " ";
+        }
+        texts.push(text);
+    }
+    items.push(texts.join("\n").split("\n"));
+}
+return JSON.stringify(items);
+"""
+
+
+def extract_in_browser(driver, selector):
+    """
+    Returns the lines of each element of the driver's current page that matches selector, extracted by a script that
+    runs in the browser. Produces the same lines as extract_item_lines does from the page source.
+
+    Parameters
+    ----------
+    driver: selenium.webdriver.Chrome
+        A web driver that has loaded the page
+    selector: str
+        The CSS selector of the item containers
+
+    Returns
+    -------
+    BrowserItems
+    """
+    with span("extract: browser", "parse"):
+        return BrowserItems(selector, json.loads(driver.execute_script(ITEM_LINES_SCRIPT, selector)))
+
+
+def _collapse(whitespace):
+    """
+    Collapses a whitespace-only string the same way BeautifulSoup does while building its tree
+    """
+    return '\n' if '\n' in whitespace else ' '
+
+
+_engines = {"soup": SoupExtractor}
+if lxml is not None:
+    _engines["lxml"] = LxmlExtractor
+
+_instances = {}
+_default_engine = "soup"
+
+
+def available_engines():
+    """
+    Returns the names of the extraction engines that can be used in this environment
+
+    Returns
+    -------
+    str[]
+    """
+    return list(_engines)
+
+
+def get_engine(name=None):
+    """
+    Returns the extraction engine with the given name
+
+    Parameters
+    ----------
+    name: str
+        The name of the engine ("soup", "lxml"). The global default engine is used if no name is given.
+
+    Returns
+    -------
+    ItemExtractor
+    """
+    if name is None:
+        name = _default_engine
+    if name not in _engines:
+        raise ValueError(f"Unknown extraction engine {name!r}, expected one of {available_engines()}")
+    engine = _instances.get(name)
+    if engine is None:
+        engine = _instances[name] = _engines[name]()
+    return engine
+
+
+def default_engine():
+    """
+    Returns the name of the extraction engine used when no engine is given to extract_item_lines
+
+    Returns
+    -------
+    str
+    """
+    return _default_engine
+
+
+def set_default_engine(name):
+    """
+    Sets the extraction engine used when no engine is given to extract_item_lines
+
+    Parameters
+    ----------
+    name: str
+        The name of the engine ("soup", "lxml")
+    """
+    global _default_engine
+    get_engine(name)
+    _default_engine = name
+
+
+def extract_item_lines(page_source, selector, engine=None):
+    """
+    Returns a list of lists of textual data for each element in page_source that matches selector
+
+    Parameters
+    ----------
+    page_source: str
+        Plain text html of a scraped page, or the BrowserItems extract_in_browser extracted from the page
+    selector: str
+        The CSS selector of the item containers
+    engine: str
+        The name of the extraction engine to use. The global default engine is used if no name is given.
+
+    Returns
+    -------
+    str[][]
+    """
+    if isinstance(page_source, BrowserItems):
+        if page_source.selector != selector:
+            raise ValueError(f"The items were extracted with {page_source.selector!r} instead of {selector!r}")
+        return list(page_source)
+    with span("extract: " + (engine or _default_engine), "parse"):
+        return get_engine(engine).extract(page_source, selector)
+
+
+_COMPOUND_SELECTOR = re.compile(r'^(?P<tag>[A-Za-z][\w-]*|\*)?(?P<rest>(?:[#.][\w-]+)*)$')
+
+
+def _compile_simple_selector(selector):
+    """
+    Compiles a CSS selector made of tag, id and class selectors joined by child (">") or descendant (" ")
+    combinators into a function that tests if an lxml element matches the selector
+
+    Parameters
+    ----------
+    selector: str
+        The CSS selector (e.g. "#PageContent > div.holds-redux > table tbody")
+    Returns
+    -------
+    function
+    """
+    steps = []
+    combinator = None
+    for token in selector.replace('>', ' > ').split():
+        if token == '>':
+            combinator = '>'
+            continue
+        match = _COMPOUND_SELECTOR.match(token)
+        if not match:
+            raise ValueError(f"Streaming extraction does not support the selector {selector!r}")
+        tag = match.group('tag')
+        ids = frozenset(re.findall(r'#([\w-]+)', match.group('rest')))
+        classes = frozenset(re.findall(r'\.([\w-]+)', match.group('rest')))
+        steps.append((combinator or ' ', None if tag in (None, '*') else tag.lower(), ids, classes))
+        combinator = None
+
+    def compound_matches(element, tag, ids, classes):
+        if tag is not None and element.tag != tag:
+            return False
+        if ids and element.get('id') not in ids:
+            return False
+        return not classes or classes.issubset((element.get('class') or '').split())
+
+    def matches(element, index=len(steps) - 1):
+        combinator, tag, ids, classes = steps[index]
+        if not compound_matches(element, tag, ids, classes):
+            return False
+        if index == 0:
+            return True
+        parent = element.getparent()
+        if combinator == '>':
+            return parent is not None and matches(parent, index - 1)
+        while parent is not None:
+            if matches(parent, index - 1):
+                return True
+            parent = parent.getparent()
+        return False
+
+    return matches
+
+
+def iter_chunks(source, chunk_size=64 * 1024):
+    """
+    Splits a source of html into chunks
+
+    Parameters
+    ----------
+    source: str, bytes, file-like object or iterable
+        The html to split. Strings and bytes are sliced, file-like objects are read chunk_size at a time and any other
+        iterable (e.g. a socket reader) is assumed to already produce chunks.
+    chunk_size: int
+        The size of each chunk
+    Returns
+    -------
+    generator of str or bytes
+    """
+    if isinstance(source, (str, bytes)):
+        for start in range(0, len(source), chunk_size):
+            yield source[start:start + chunk_size]
+    elif hasattr(source, 'read'):
+        chunk = source.read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = source.read(chunk_size)
+    else:
+        yield from source
+
+
+def iter_item_lines(source, selector, chunk_size=64 * 1024):
+    """
+    Yields the textual data of each element in the html source that matches selector as soon as the element's closing
+    tag has been read. Produces the same lines, in the same order, as extract_item_lines. Elements outside the item
+    containers are discarded as the page is read, so memory use does not grow with the size of the page.
+
+    Parameters
+    ----------
+    source: str, bytes, file-like object or iterable of chunks
+        The html to parse (see iter_chunks)
+    selector: str
+        The CSS selector of the item containers. Only tag, id and class selectors with child or descendant
+        combinators are supported.
+    chunk_size: int
+        The size of the chunks read from strings and file-like objects
+    Returns
+    -------
+    generator of str[]
+    """
+    matches = _compile_simple_selector(selector)
+    engine = get_engine("lxml")
+    parser = etree.HTMLPullParser(events=("start", "end"))
+    # lines of the containers in document order. None marks a container that hasn't been closed yet.
+    pending = []
+    open_containers = []
+
+    def read_events():
+        for event, element in parser.read_events():
+            if event == "start":
+                if matches(element):
+                    open_containers.append((element, len(pending)))
+                    pending.append(None)
+            elif open_containers and open_containers[-1][0] is element:
+                _, index = open_containers.pop()
+                pending[index] = engine.element_lines(element)
+                if not open_containers:
+                    _discard(element)
+                    yield from pending
+                    pending.clear()
+            elif not open_containers:
+                _discard(element)
+
+    for chunk in iter_chunks(source, chunk_size):
+        parser.feed(chunk)
+        yield from read_events()
+    parser.close()
+    yield from read_events()
+
+
+def _discard(element):
+    """
+    Frees a closed element and every closed sibling before it. The element's ancestors are kept so that selectors
+    can still be matched against them.
+    """
+    element.clear()
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
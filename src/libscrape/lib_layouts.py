@@ -0,0 +1,430 @@
+"""
+Library for recognizing the layout of items scraped from Durham Region library systems (BiblioCommons). The layout of
+an item is fingerprinted by the kinds of its lines (title, byline, status, date, ...) and looked up in a table of known
+layouts that maps each fingerprint to the offsets of the item's fields. New layouts are learned from saved pages with:
+
+    python lib_layouts.py learn sample_pages/ppl-holds-Jan-12-2022.html [more pages...]
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+from functools import lru_cache
+from operator import itemgetter
+
+from lib_parser import checkout_date, checkout_status, hold_branch, hold_date, hold_status
+from tracing import traced
+
+curr_path = os.path.dirname(__file__)
+DEFAULT_TABLE_PATH = os.path.join(curr_path, 'layouts.json')
+
+logger = logging.getLogger(__name__)
+
+# kinds of lines
+SELECT = "select"
+TEXT = "text"
+BYLINE = "byline"
+DASH = "dash"
+YEAR = "year"
+EDITION = "edition"
+BLANK = "blank"
+DETAILS = "details"
+RATING = "rating"
+STATUS = "status"
+POSITION = "position"
+COPIES = "copies"
+REMAINING = "remaining"
+PICKUP = "pickup"
+DATE_LABEL = "date_label"
+DATE = "date"
+# the item's actions (e.g. "Renew", "Cancel hold") follow all of its fields, so the fingerprint stops at them
+ACTIONS = "actions"
+# lines that come and go with the state of an item (e.g. the queue position of a hold that isn't ready yet) and hold
+# none of its fields, so they are left out of the fingerprint
+INCIDENTAL = frozenset((POSITION, COPIES, REMAINING))
+
+_PREFIX_KINDS = (
+    ("Select. Item ", SELECT),
+    ("View details", DETAILS),
+    ("You have not rated", RATING),
+    ("You rated", RATING),
+    ("Rate this", RATING),
+    ("Pick up at", PICKUP),
+    ("Expires on", DATE_LABEL),
+    ("Pick up by", DATE_LABEL),
+    ("Due by", DATE_LABEL),
+    ("Add ", ACTIONS),
+    ("Placed on", ACTIONS),
+)
+_ACTIONS = frozenset(("Pause hold", "Resume hold", "Cancel hold", "Renew", "For Later", "In Progress", "Completed"))
+_STATUS = re.compile(r'(Not ready|Ready for pickup|Ready|In transit|Paused|Due later|Due soon|Due today|Overdue)$')
+_DATE = re.compile(r'[A-Z][a-z]{2,3}\.? \d{1,2}, \d{4}$')
+_YEAR = re.compile(r'\d{4}$')
+_POSITION = re.compile(r'#\d+$')
+
+
+# most lines (labels, statuses, actions, dates) recur across items and pages, so their kinds are memoized
+@lru_cache(maxsize=4096)
+def line_kind(line):
+    """
+    Classifies a single line of a scraped library item
+
+    Parameters
+    ----------
+    line: str
+        A line of the scraped text of a library item
+
+    Returns
+    -------
+    str
+        One of the kinds of lines defined in this module (e.g. STATUS, DATE, TEXT)
+    """
+    stripped = line.strip()
+    if not stripped:
+        return BLANK
+    for prefix, kind in _PREFIX_KINDS:
+        if line.startswith(prefix):
+            return kind
+    if stripped in _ACTIONS:
+        return ACTIONS
+    if stripped == "by":
+        return BYLINE
+    if stripped == "-":
+        return DASH
+    if _YEAR.match(stripped):
+        return YEAR
+    if "Language:" in stripped:
+        return EDITION
+    if _STATUS.match(stripped):
+        return STATUS
+    if _POSITION.match(stripped):
+        return POSITION
+    if stripped.endswith("copies") or stripped.endswith("copy"):
+        return COPIES
+    if "remaining" in stripped:
+        return REMAINING
+    if _DATE.match(stripped):
+        return DATE
+    return TEXT
+
+
+def significant_lines(lines):
+    """
+    Classifies the lines of a scraped library item in one pass and keeps the lines its layout is made of: the lines up
+    to its item date or its actions, whichever comes first, without the incidental lines
+
+    Parameters
+    ----------
+    lines: list of strings generated by splitting the scraped text of a single library item by the new line character
+
+    Returns
+    -------
+    (tuple of str, list of str)
+        The kinds of the lines kept (the fingerprint of the item) and the lines kept
+    """
+    kinds, kept = [], []
+    for line in lines:
+        kind = line_kind(line)
+        if kind == ACTIONS:
+            break
+        if kind in INCIDENTAL:
+            continue
+        kinds.append(kind)
+        kept.append(line)
+        # lines after the item date (e.g. "2 people waiting", "Renewed 5 times") aren't fields either
+        if kind == DATE and len(kinds) > 1 and kinds[-2] == DATE_LABEL:
+            break
+    return tuple(kinds), kept
+
+
+def fingerprint(lines):
+    """
+    Computes the structural fingerprint of a scraped library item in one pass over its lines
+
+    Parameters
+    ----------
+    lines: list of strings generated by splitting the scraped text of a single library item by the new line character
+
+    Returns
+    -------
+    tuple of str
+        The kinds of the item's significant lines (see significant_lines)
+    """
+    return significant_lines(lines)[0]
+
+
+def derive_offsets(kinds, is_hold):
+    """
+    Locates the fields of a library item from the kinds of its lines
+
+    Parameters
+    ----------
+    kinds: tuple of str
+        The fingerprint of the item
+    is_hold: bool
+        True if the item is on hold, False if it is checked out
+
+    Returns
+    -------
+    dict
+        The offsets of the "title", "contributors" (None if the item has no contributors), "status", "item_date" and
+        (holds only) "branch" lines or None if a required field can't be located
+    """
+    if SELECT not in kinds:
+        return None
+    title = kinds.index(SELECT) + 2
+    if title >= len(kinds) or kinds[title] != TEXT:
+        return None
+
+    # every field follows the title line, which keeps titles such as "Overdue" from being taken for a field
+    def first(kind, next_kind=None):
+        for i in range(title + 1, len(kinds)):
+            if kinds[i] == kind and next_kind is None:
+                return i
+            if kinds[i] == kind and i + 1 < len(kinds) and kinds[i + 1] == next_kind:
+                return i + 1
+        return None
+
+    offsets = {
+        "title": title,
+        "contributors": first(BYLINE, TEXT),
+        "status": first(STATUS),
+        "item_date": first(DATE_LABEL, DATE),
+    }
+    if is_hold:
+        offsets["branch"] = first(PICKUP, TEXT)
+    if any(offset is None for field, offset in offsets.items() if field != "contributors"):
+        return None
+    return offsets
+
+
+class Layout:
+    """
+    A known layout of a library item
+
+    Attributes:
+      - is_hold: True if the layout is of items on hold, False if it is of items checked out
+      - offsets: dict of the offsets of the item's fields among its significant lines (see derive_offsets)
+      - fetch: an itemgetter that fetches the title, status, date, branch (holds only) and contributors (if any) lines
+    """
+
+    def __init__(self, is_hold, offsets):
+        self.is_hold = is_hold
+        self.offsets = offsets
+        fields = ["title", "status", "item_date"] + (["branch"] if is_hold else [])
+        if offsets["contributors"] is not None:
+            fields.append("contributors")
+        self.fetch = itemgetter(*[offsets[field] for field in fields])
+
+    def fields(self, lines):
+        """
+        Gets all relevant data of a library item with this layout
+
+        Parameters
+        ----------
+        lines: the significant lines of a single library item (see significant_lines)
+
+        Returns
+        -------
+        A tuple of the title, format, contributors, status, date and (holds only) branch of the library item in the
+        same form as DurhamHoldParser.all and DurhamCheckoutParser.all or None if the title line has no format
+        """
+        values = self.fetch(lines)
+        contributors = values[-1] if self.offsets["contributors"] is not None else ""
+        title_and_format = values[0].rsplit(", ", 1)
+        if len(title_and_format) != 2:
+            return None
+        title, item_format = title_and_format
+        if self.is_hold:
+            return title, item_format, contributors, hold_status(values[1]), hold_date(values[2]), \
+                hold_branch(values[3])
+        return title, item_format, contributors, checkout_status(values[1]), checkout_date(values[2])
+
+
+class LayoutTable:
+    """
+    A memo table of known item layouts keyed by fingerprint
+
+    Attributes:
+      - layouts: dict of Layout keyed by (is_hold, fingerprint)
+    """
+
+    def __init__(self, layouts=None):
+        self.layouts = layouts if layouts is not None else {}
+        self._reported = set()
+
+    @classmethod
+    def load(cls, path=DEFAULT_TABLE_PATH):
+        """
+        Loads a table of known layouts from a json file. An empty table is returned if the file doesn't exist.
+
+        Parameters
+        ----------
+        path: str
+            The path of the json file
+
+        Returns
+        -------
+        LayoutTable
+        """
+        table = cls()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            for kind, is_hold in (("holds", True), ("checkouts", False)):
+                for entry in data.get(kind, []):
+                    table.layouts[(is_hold, tuple(entry["fingerprint"].split(",")))] = Layout(is_hold, entry["offsets"])
+        return table
+
+    def save(self, path=DEFAULT_TABLE_PATH):
+        """
+        Saves the table of known layouts to a json file
+
+        Parameters
+        ----------
+        path: str
+            The path of the json file
+        """
+        data = {"holds": [], "checkouts": []}
+        for (is_hold, kinds), layout in sorted(self.layouts.items()):
+            entry = {"fingerprint": ",".join(kinds), "offsets": layout.offsets}
+            data["holds" if is_hold else "checkouts"].append(entry)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+            f.write('\n')
+
+    def learn(self, lines, is_hold):
+        """
+        Adds the layout of a library item to the table
+
+        Parameters
+        ----------
+        lines: list of strings generated by splitting the scraped text of a single library item by the new line
+            character
+        is_hold: bool
+            True if the item is on hold, False if it is checked out
+
+        Returns
+        -------
+        bool
+            True if the layout is now known, False if the fields of the item couldn't be located
+        """
+        kinds = fingerprint(lines)
+        if (is_hold, kinds) in self.layouts:
+            return True
+        offsets = derive_offsets(kinds, is_hold)
+        if offsets is None:
+            return False
+        self.layouts[(is_hold, kinds)] = Layout(is_hold, offsets)
+        return True
+
+    def fields(self, lines, is_hold):
+        """
+        Gets all relevant data of a library item if its layout is known. Unknown layouts are logged once.
+
+        Parameters
+        ----------
+        lines: list of strings generated by splitting the scraped text of a single library item by the new line
+            character
+        is_hold: bool
+            True if the item is on hold, False if it is checked out
+
+        Returns
+        -------
+        A tuple in the same form as Layout.fields or None if the layout of the item is unknown. The fields of an item
+        with an unknown layout are never guessed.
+        """
+        kinds, kept = significant_lines(lines)
+        layout = self.layouts.get((is_hold, kinds))
+        if layout is None:
+            if (is_hold, kinds) not in self._reported:
+                self._reported.add((is_hold, kinds))
+                logger.warning("Unknown %s layout %s for item %r. Learn it from a saved page with lib_layouts.py",
+                               "hold" if is_hold else "checkout", ",".join(kinds), lines[:3])
+            return None
+        return layout.fields(kept)
+
+    @traced(category="parse")
+    def hold(self, lines):
+        return self.fields(lines, True)
+
+    @traced(category="parse")
+    def checkout(self, lines):
+        return self.fields(lines, False)
+
+
+_default_table = None
+
+
+def default_table():
+    """
+    Returns the table of known layouts shipped in layouts.json, loaded once per process
+
+    Returns
+    -------
+    LayoutTable
+    """
+    global _default_table
+    if _default_table is None:
+        _default_table = LayoutTable.load()
+    return _default_table
+
+
+def learn_layouts(page_paths, table=None):
+    """
+    Learns the layouts of every item on saved PPL and WPL holds and checkouts pages
+
+    Parameters
+    ----------
+    page_paths: str[]
+        Paths of pages saved by save_output_as_html (e.g. sample_pages/wpl-holds-Jan-05-2022.html)
+    table: LayoutTable
+        The table to add the layouts to. A new table is created if none is given.
+
+    Returns
+    -------
+    (LayoutTable, int, int)
+        The table, the number of items learned and the number of items whose fields couldn't be located
+    """
+    from library import PPL, WPL
+    from parser_utils import parse_saved_page_name
+
+    table = table if table is not None else LayoutTable()
+    learned = failed = 0
+    for path in page_paths:
+        page_info = parse_saved_page_name(os.path.basename(path))
+        if page_info is None or page_info[0] not in ("ppl", "wpl"):
+            logger.warning("Skipping %s because it isn't a saved PPL or WPL holds or checkouts page", path)
+            continue
+        library_class = PPL if page_info[0] == "ppl" else WPL
+        is_hold = page_info[1] == "holds"
+        with open(path, encoding='utf-8') as f:
+            page_source = f.read()
+        if is_hold:
+            item_data = library_class.hold_data(page_source)
+        else:
+            item_data = library_class.checkout_data(page_source)
+        for lines in item_data:
+            if table.learn(lines, is_hold):
+                learned += 1
+            else:
+                failed += 1
+                logger.warning("Could not locate the fields of item %r in %s", lines[:3], path)
+    return table, learned, failed
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(levelname)s: %(message)s")
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+    learn = subparsers.add_parser("learn", help="learn the item layouts of saved pages")
+    learn.add_argument("pages", nargs="+")
+    learn.add_argument("--table", default=DEFAULT_TABLE_PATH, help="the layout table to update")
+    args = arg_parser.parse_args()
+
+    if args.command == "learn":
+        layout_table, num_learned, num_failed = learn_layouts(args.pages, LayoutTable.load(args.table))
+        layout_table.save(args.table)
+        print(f"{num_learned} items learned, {num_failed} items failed, {len(layout_table.layouts)} known layouts")
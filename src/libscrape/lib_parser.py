@@ -5,6 +5,55 @@ Library for managing applying parse rules to raw data from scraped library pages
 import re
 from abc import ABC, abstractmethod
 
+from tracing import traced
+
+
+def hold_status(status):
+    """
+    Normalizes the hold status scraped from a Durham Region library system to "Ready" or "Not Ready"
+    """
+    if "Not ready" in status:
+        return "Not Ready"
+    else:
+        return "Ready"
+
+
+def hold_date(item_date):
+    """
+    Strips the label from the pick-up date scraped from a Durham Region library system
+    """
+    if "Expires on " in item_date:
+        item_date = item_date.replace("Expires on ", "")
+    elif "Pick up by " in item_date:
+        item_date = item_date.replace("Pick up by", "")
+    return item_date
+
+
+def hold_branch(branch):
+    """
+    Strips the label from the pick-up branch scraped from a Durham Region library system
+    """
+    return branch.replace("Pick up by ", "")
+
+
+def checkout_status(status):
+    """
+    Normalizes the checkout status scraped from a Durham Region library system to "Due Soon", "Due Later" or "Overdue"
+    """
+    if "Due soon" in status:
+        return "Due Soon"
+    elif "Due later" in status:
+        return "Due Later"
+    else:
+        return "Overdue"
+
+
+def checkout_date(item_date):
+    """
+    Strips the label from the return date scraped from a Durham Region library system
+    """
+    return item_date.replace("Due by ", "")
+
 
 class LibraryParser(ABC):
     """
@@ -188,10 +237,7 @@ class DurhamHoldParser(DurhamParser):
         else:
             status = data_to_parse[self.parse_rule.status_without_subtitle]
 
-        if "Not ready" in status:
-            return "Not Ready"
-        else:
-            return "Ready"
+        return hold_status(status)
 
     def item_date(self, data_to_parse, has_subtitle=None):
         """
@@ -215,12 +261,7 @@ class DurhamHoldParser(DurhamParser):
         else:
             item_date = data_to_parse[self.parse_rule.item_date_without_subtitle]
 
-        if "Expires on " in item_date:
-            item_date = item_date.replace("Expires on ", "")
-        elif "Pick up by " in item_date:
-            item_date = item_date.replace("Pick up by", "")
-
-        return item_date
+        return hold_date(item_date)
 
     def branch(self, data_to_parse, has_subtitle=None):
         """
@@ -244,8 +285,9 @@ class DurhamHoldParser(DurhamParser):
         else:
             branch = data_to_parse[self.parse_rule.branch_without_subtitle]
 
-        return branch.replace("Pick up by ", "")
+        return hold_branch(branch)
 
+    @traced(category="parse")
     def all(self, data_to_parse, generic_format, has_subtitle=None):
         """
         Gets all relevant data (title, format, contributors, status, pick up date, pick up branch) of this library item
@@ -339,12 +381,7 @@ class DurhamCheckoutParser(DurhamParser):
         else:
             status = data_to_parse[self.parse_rule.status_without_subtitle]
 
-        if "Due soon" in status:
-            return "Due Soon"
-        elif "Due later" in status:
-            return "Due Later"
-        else:
-            return "Overdue"
+        return checkout_status(status)
 
     def item_date(self, data_to_parse, has_subtitle=None):
         """
@@ -368,10 +405,9 @@ class DurhamCheckoutParser(DurhamParser):
         else:
             item_date = data_to_parse[self.parse_rule.item_date_without_subtitle]
 
-        item_date = item_date.replace("Due by ", "")
-
-        return item_date
+        return checkout_date(item_date)
 
+    @traced(category="parse")
     def all(self, data_to_parse, generic_format, has_subtitle=None):
         """
         Gets all relevant data (title, format, contributors, checkout status) of this library item
@@ -497,6 +533,7 @@ class TorontoHoldParser(TorontoParser):
         """
         return data_to_parse[self.parse_rule.branch]
 
+    @traced(category="parse")
     def all(self, data_to_parse):
         """
         Gets all relevant data (title, format, contributors, pickup date, hold status, pickup location) of this library
@@ -565,6 +602,7 @@ class TorontoCheckoutParser(TorontoParser):
         else:
             return "Due Later"
 
+    @traced(category="parse")
     def all(self, data_to_parse):
         """
         Gets all relevant data (title, format, contributors, return date, checkout status) of this library
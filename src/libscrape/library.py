@@ -3,6 +3,7 @@ Library that containing classes for scraping and processing data from
 three library systems: Toronto Public Library, Whitby Public Library,
 and Pickering Public Library
 Available classes:
+- LibrarySystem: Base class for all library systems
 - DurhamLibrary: Base class for all libraries in Durham Region
 - PPL: Pickering Public Library
 - WPL: Whitby Public Library
@@ -14,23 +15,247 @@ from __future__ import print_function
 from bs4 import BeautifulSoup
 
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import NoSuchElementException, TimeoutException
 
+from lib_extractor import extract_in_browser, extract_item_lines, iter_item_lines
+from lib_layouts import default_table
+from session_store import all_cookies, inject_cookies
+from http_backend import http_snapshot_pages
+from login_outcome import DURHAM_LOGIN_PAGE, TPL_LOGIN_PAGE, LoginOutcome, sign_in
+from capture_profile import page_load_timing
+from gateway_capture import GatewayCapture
+from tracing import WebDriverWait, traced, traced_get, traced_page_source
 from lib_parser import *
 from parse_rule import *
 
 from parser_utils import *
 from datetime import date
+from urllib.parse import quote
 from lib_assets import *
 
 
-class DurhamLibrary:
-    def __init__(self):
+def open_tab(driver, url):
+    """
+    Starts loading the url in a new browser tab without switching to it
+
+    Parameters
+    ----------
+    driver: selenium.webdriver.Chrome
+        The web driver that will open the tab
+    url: str
+        The url to load in the new tab
+    Returns
+    -------
+    str
+        The window handle of the new tab
+    """
+    handles = set(driver.window_handles)
+    driver.execute_script("window.open(arguments[0], '_blank');", url)
+    return (set(driver.window_handles) - handles).pop()
+
+
+def url_excludes(text):
+    """
+    An expectation that the url of the current page doesn't contain text (e.g. that a login page has been left)
+    """
+    def url_excludes(driver):
+        return text not in driver.current_url
+    return url_excludes
+
+
+def read_items(driver, selector, in_browser=False):
+    """
+    Returns what the item containers of the driver's current page are extracted from by hold_data and checkout_data:
+    the page source, or the lines of the containers that match selector, extracted in the browser if in_browser is
+    True (see lib_extractor.extract_in_browser)
+    """
+    if in_browser:
+        return extract_in_browser(driver, selector)
+    return traced_page_source(driver)
+
+
+def resume_session(driver, session_store, system, account, url, login_path):
+    """
+    Injects the stored session of an account into the driver and loads url with it. The session is valid if the site
+    doesn't redirect to its login page, which costs no more than loading url itself. A rejected session is discarded.
+
+    Parameters
+    ----------
+    driver: selenium.webdriver.Chrome
+        The web driver that will load the page
+    session_store: session_store.SessionStore
+        The store of sessions, or None if sessions aren't stored
+    system: str
+        The library system the account belongs to (e.g. "ppl", "wpl", "tpl")
+    account: str
+        The username of the account
+    url: str
+        The url of a page that requires the account to be signed in
+    login_path: str
+        Part of the url of the site's login page (e.g. "/user/login")
+    Returns
+    -------
+    bool
+        True if url was loaded signed in, False if the login form has to be used
+    """
+    if session_store is None:
+        return False
+    cookies = session_store.load(system, account)
+    if not cookies:
+        return False
+    inject_cookies(driver, cookies)
+    traced_get(driver, url)
+    if login_path in driver.current_url:
+        session_store.discard(system, account)
+        return False
+    return True
+
+
+def remember_session(driver, session_store, system, account):
+    """
+    Stores the cookies of a driver that has just signed in to an account, if sessions are stored
+    """
+    if session_store is not None:
+        session_store.save(system, account, all_cookies(driver))
+
+
+def load_snapshot_pages(driver, holds_loaded, checkouts_url, checkouts_loaded, capture_profile=None, load_times=None,
+                        item_selectors=None):
+    """
+    Loads the checkouts page in a second tab while the holds page finishes loading in the current tab and returns the
+    page source of both pages. The second tab is closed afterwards.
+
+    Parameters
+    ----------
+    driver: selenium.webdriver.Chrome
+        A web driver that is signed in and is loading the holds page
+    holds_loaded: callable
+        An expected condition that is met once the holds page has loaded
+    checkouts_url: str
+        The url of the checkouts page
+    checkouts_loaded: callable
+        An expected condition that is met once the checkouts page has loaded
+    capture_profile: capture_profile.CaptureProfile
+        The resources the second tab skips, or None to load every resource
+    load_times: list
+        The (url, timing) of both pages are appended to it (see capture_profile.page_load_timing) if given
+    item_selectors: (str, str)
+        The CSS selectors of the hold and checkout containers, to extract the containers in the browser instead of
+        reading the page sources
+    Returns
+    -------
+    (str, str)
+        The page source of the holds page and the page source of the checkouts page, or their extracted containers
+        (lib_extractor.BrowserItems) if item_selectors is given
+    """
+    holds_selector, checkouts_selector = item_selectors or (None, None)
+    holds_tab = driver.current_window_handle
+    if capture_profile is None:
+        checkouts_tab = open_tab(driver, checkouts_url)
+    else:
+        # the resources are blocked per tab, so the tab is opened blank and navigated once they are
+        checkouts_tab = open_tab(driver, "about:blank")
+        driver.switch_to.window(checkouts_tab)
+        capture_profile.apply(driver)
+        driver.execute_script("window.location.href = arguments[0];", checkouts_url)
+        driver.switch_to.window(holds_tab)
+    try:
+        WebDriverWait(driver=driver, timeout=10).until(holds_loaded)
+        holds_source = read_items(driver, holds_selector, item_selectors is not None)
+        if load_times is not None:
+            load_times.append((driver.current_url, page_load_timing(driver)))
+        driver.switch_to.window(checkouts_tab)
+        WebDriverWait(driver=driver, timeout=10).until(checkouts_loaded)
+        checkouts_source = read_items(driver, checkouts_selector, item_selectors is not None)
+        if load_times is not None:
+            load_times.append((driver.current_url, page_load_timing(driver)))
+    finally:
+        if checkouts_tab in driver.window_handles:
+            driver.switch_to.window(checkouts_tab)
+            driver.close()
+        driver.switch_to.window(holds_tab)
+    return holds_source, checkouts_source
+
+
+class LibrarySystem:
+    """Base class for all library systems
+    Attributes:
+        - name: the name of the library system
+        - driver: an instance of a Selenium Chrome web driver
+        - account_url: the scheme and host of the account pages (ACCOUNT_URL unless overridden)
+        - site_url: the scheme and host of the library's website, which has the hours pages (SITE_URL unless
+          overridden)
+        - extract_in_browser: True if the item containers are extracted by a script in the browser instead of reading
+          the whole page source
+    """
+    name = None
+    ACCOUNT_URL = ""
+    SITE_URL = ""
+    HOLD_SELECTOR = None
+    CHECKOUT_SELECTOR = None
+
+    def __init__(self, driver=None, hours_cache=None, driver_pool=None, session_store=None, http_backend=None,
+                 capture_profile=None, account_url=None, site_url=None, extract_in_browser=False):
         super().__init__()
+        # without a driver of its own, the library borrows one from the driver pool until close is called
+        self._pooled_driver = driver is None and driver_pool is not None
+        self.driver = driver_pool.acquire() if self._pooled_driver else driver
+        self.driver_pool = driver_pool
         self.checkouts = []
         self.holds = []
+        self.hours_cache = hours_cache
+        self.session_store = session_store
+        self.http_backend = http_backend
+        self.capture_profile = capture_profile
+        self.load_times = []  # the (url, timing) of every page loaded by snapshot
+        if capture_profile is not None and self.driver is not None:
+            capture_profile.apply(self.driver)
+        # the sites can be replaced with a stand-in (e.g. replay_server.ReplayServer) for offline runs
+        self.account_url = (account_url or self.ACCOUNT_URL).rstrip('/')
+        self.site_url = (site_url or self.SITE_URL).rstrip('/')
+        self.extract_in_browser = extract_in_browser
+
+    def close(self):
+        """
+        Returns the driver to the driver pool it was borrowed from, or quits it if it wasn't borrowed
+        """
+        if self.driver is None:
+            return
+        if self._pooled_driver:
+            self.driver_pool.release(self.driver)
+        else:
+            self.driver.quit()
+        self.driver = None
+
+    def item_selectors(self):
+        """
+        Returns the selectors of the hold and checkout containers if they are extracted in the browser, otherwise None
+        """
+        return (self.HOLD_SELECTOR, self.CHECKOUT_SELECTOR) if self.extract_in_browser else None
+
+
+class DurhamLibrary(LibrarySystem):
+    """Base class for all libraries in Durham Region
+    Attributes:
+        - capture_gateway: True if snapshot reads the items from the JSON the pages are rendered from (see
+          gateway_capture). The driver must write a performance log.
+        - layout_table: the known layouts of the items' lines (see lib_layouts)
+        - skipped_items: the number of items skipped so far because their layout is unknown
+    """
+    HOLD_SELECTOR = "div.cp-batch-actions-list-item"
+    CHECKOUT_SELECTOR = "div.cp-batch-actions-list-item"
+    LOGIN_PAGE = DURHAM_LOGIN_PAGE
+
+    def __init__(self, driver=None, hours_cache=None, driver_pool=None, session_store=None, http_backend=None,
+                 capture_profile=None, account_url=None, site_url=None, extract_in_browser=False,
+                 capture_gateway=False, layout_table=None):
+        super().__init__(driver=driver, hours_cache=hours_cache, driver_pool=driver_pool, session_store=session_store,
+                         http_backend=http_backend, capture_profile=capture_profile, account_url=account_url,
+                         site_url=site_url, extract_in_browser=extract_in_browser)
+        self.capture_gateway = capture_gateway
+        self.layout_table = layout_table if layout_table is not None else default_table()
+        self.skipped_items = 0
         self.parsers = {"holds": {"DVD": DurhamHoldParser(
             DurhamDVDHoldRule(title=2, item_format=2, status_with_subtitle=8, status_without_subtitle=7,
                               item_date_with_subtitle=10, item_date_without_subtitle=9, branch_with_subtitle=9,
@@ -53,6 +278,55 @@ class DurhamLibrary:
                                                                       item_date_with_subtitle=9,
                                                                       item_date_without_subtitle=8))}}
 
+    @traced(category="parse")
+    def parse_snapshot(self, holds_source, checkouts_source):
+        """
+        Parses the items on a holds page and a checkouts page
+
+        Parameters
+        ----------
+        holds_source: str
+            Plain text html of the holds page
+        checkouts_source: str
+            Plain text html of the checkouts page
+        Returns
+        -------
+        dict
+            The Item[] of holds under "holds", the Item[] of checkouts under "checkouts" and the number of items
+            skipped because their layout is unknown under "skipped_items"
+        """
+        skipped_before = self.skipped_items
+        self.holds = self.parse_hold_data(self.hold_data(holds_source))
+        self.checkouts = self.parse_checkout_data(self.checkout_data(checkouts_source))
+        return {"holds": self.holds, "checkouts": self.checkouts, "skipped_items": self.skipped_items - skipped_before}
+
+    @traced(category="scrape")
+    def gateway_snapshot(self, capture, checkouts_url):
+        """
+        Reads the items of the holds page the driver has loaded and of the checkouts page from the gateway payloads
+        the pages are rendered from, without waiting for the pages to render them. The pages of results beyond the
+        first are fetched too. Raises gateway_capture.GatewayError if one can't be, rather than returning some items.
+
+        Parameters
+        ----------
+        capture: gateway_capture.GatewayCapture
+            The capture of the driver's performance log, created before the holds page was loaded
+        checkouts_url: str
+            The url of the checkouts page
+        Returns
+        -------
+        dict
+            The Item[] of holds under "holds" and the Item[] of checkouts under "checkouts"
+        """
+        WebDriverWait(driver=self.driver, timeout=10).until(capture.captured("holds"))
+        capture.fetch_missing_pages("holds")
+        traced_get(self.driver, checkouts_url)
+        WebDriverWait(driver=self.driver, timeout=10).until(capture.captured("checkouts"))
+        capture.fetch_missing_pages("checkouts")
+        self.holds = capture.items("holds")
+        self.checkouts = capture.items("checkouts")
+        return {"holds": self.holds, "checkouts": self.checkouts}
+
     @staticmethod
     def select_parser(item_format, parsers):
         """
@@ -79,6 +353,38 @@ class DurhamLibrary:
             parser = parsers["CD_and_Book"]
         return parser, generic_format
 
+    @classmethod
+    def stream_hold_data(cls, source):
+        """
+        Yields the textual data of each hold item on the holds page as soon as the item has been read from source
+
+        Parameters
+        ----------
+        source: str, bytes, file-like object or iterable of chunks
+            Html of a holds page
+        Returns
+        -------
+        generator of str[]
+        """
+        return iter_item_lines(source, cls.HOLD_SELECTOR)
+
+    @classmethod
+    def stream_checkout_data(cls, source):
+        """
+        Yields the textual data of each checkout item on the checkouts page as soon as the item has been read from
+        source
+
+        Parameters
+        ----------
+        source: str, bytes, file-like object or iterable of chunks
+            Html of a checkouts page
+        Returns
+        -------
+        generator of str[]
+        """
+        return iter_item_lines(source, cls.CHECKOUT_SELECTOR)
+
+    @traced(category="parse")
     def parse_hold_data(self, hold_data):
         """
         Parses the hold data and returns a list of corresponding Item objects
@@ -91,23 +397,36 @@ class DurhamLibrary:
         -------
         Item[]
         """
-        res = []
-        for lines in hold_data:
-            item_format = DurhamHoldParser.format(lines)
-            parser, generic_format = self.select_parser(item_format, self.parsers["holds"])
-            if parser:
+        return list(self.iter_parse_hold_data(hold_data))
 
-                has_subtitle = DurhamHoldParser.has_subtitle(lines, generic_format)
-                title, item_format, contributors, status, item_date, branch = parser.all(lines, generic_format,
-                                                                                         has_subtitle)
+    def iter_parse_hold_data(self, hold_data):
+        """
+        Parses the hold data and yields the corresponding Item objects one at a time
 
-                hold_item = Item(date_retrieved=date.today(), title=title, contributors=contributors,
+        Parameters
+        ----------
+        hold_data: iterable of str[]
+            Lists of strings which represent data from the holds page split by the newline character (e.g. the
+            generator returned by stream_hold_data)
+        Returns
+        -------
+        generator of Item
+        """
+        date_retrieved = date.today()
+        for lines in hold_data:
+            # items with an unknown layout are logged by the layout table and skipped rather than guessed at
+            fields = self.layout_table.hold(lines)
+            if fields is None:
+                self.skipped_items += 1
+            else:
+                title, item_format, contributors, status, item_date, branch = fields
+                hold_item = Item(date_retrieved=date_retrieved, title=title, contributors=contributors,
                                  item_format=item_format, is_hold=True, item_date=item_date, status=status,
                                  branch=branch, system='durham')
                 if hold_item.title:
-                    res.append(hold_item)
-        return res
+                    yield hold_item
 
+    @traced(category="parse")
     def parse_checkout_data(self, checkout_data):
         """
         Parses the checkout data and returns a list of corresponding Item objects
@@ -120,84 +439,76 @@ class DurhamLibrary:
         -------
         Item[]
         """
-        res = []
+        return list(self.iter_parse_checkout_data(checkout_data))
+
+    def iter_parse_checkout_data(self, checkout_data):
+        """
+        Parses the checkout data and yields the corresponding Item objects one at a time
+
+        Parameters
+        ----------
+        checkout_data: iterable of str[]
+            Lists of strings which represent data from the checkouts page split by the newline character (e.g. the
+            generator returned by stream_checkout_data)
+        Returns
+        -------
+        generator of Item
+        """
+        date_retrieved = date.today()
         for lines in checkout_data:
-            item_format = DurhamCheckoutParser.format(lines)
-            parser, generic_format = self.select_parser(item_format, self.parsers["checkouts"])
-            if parser:
-                has_subtitle = DurhamCheckoutParser.has_subtitle(lines, generic_format)
-                title, item_format, contributors, status, item_date = parser.all(lines, generic_format, has_subtitle)
-                hold_item = Item(date_retrieved=date.today(), title=title, contributors=contributors,
-                                 item_format=item_format, is_hold=False, item_date=item_date, status=status, branch='',
-                                 system='durham')
-                if hold_item.title:
-                    res.append(hold_item)
-        return res
+            fields = self.layout_table.checkout(lines)
+            if fields is None:
+                self.skipped_items += 1
+            else:
+                title, item_format, contributors, status, item_date = fields
+                checkout_item = Item(date_retrieved=date_retrieved, title=title, contributors=contributors,
+                                     item_format=item_format, is_hold=False, item_date=item_date, status=status,
+                                     branch='', system='durham')
+                if checkout_item.title:
+                    yield checkout_item
 
 
 class PPL(DurhamLibrary):
-    """Class for Pickering Public Library
-    Attributes:
-        - driver: an instance of a Selenium Chrome web driver
-    """
-
-    def __init__(self, driver=None):
-        super().__init__()
-        self.driver = driver
-        self.name = "Pickering Public Library"
+    """Class for Pickering Public Library (see LibrarySystem and DurhamLibrary for the attributes)"""
+    name = "Pickering Public Library"
+    ACCOUNT_URL = "https://pickering.bibliocommons.com"
+    SITE_URL = "https://pickeringlibrary.ca"
 
     @staticmethod
-    def hold_data(page_source):
+    def hold_data(page_source, engine=None):
         """
-        Logs into the holds page and returns a list of lists of textual data for each hold item
+        Returns a list of lists of textual data for each hold item on the holds page
 
         Parameters
         ----------
-        username: str
-            The username of the account that will be signed into
-        password: str
-            The password of the account that will be signed into
+        page_source: str
+            Plain text html of a holds page
+        engine: str
+            The name of the extraction engine to use ("soup", "lxml"). Uses the global default if not given.
         Returns
         -------
         str[][]
         """
-        res = []
-        soup = BeautifulSoup(page_source, "html.parser")
-        holds = soup.select("div.cp-batch-actions-list-item")
-        for item in holds:
-            plain_text = item.get_text('\n')
-            # print(plain_text)
-            lines = plain_text.split('\n')
-            # print(lines)
-            res.append(lines)
-        return res
+        return extract_item_lines(page_source, PPL.HOLD_SELECTOR, engine)
 
     @staticmethod
-    def checkout_data(page_source):
+    def checkout_data(page_source, engine=None):
         """
-        Logs into the checkouts page and returns a list of lists of textual data for each checkout item
+        Returns a list of lists of textual data for each checkout item on the checkouts page
 
         Parameters
         ----------
-        page_source: plain text html of a checkout page
-
+        page_source: str
+            Plain text html of a checkouts page
+        engine: str
+            The name of the extraction engine to use ("soup", "lxml"). Uses the global default if not given.
         Returns
         -------
         str[][]
         """
-        res = []
-        # save_output_as_html(self.driver.page_source, "ppl-checkouts")
-        soup = BeautifulSoup(page_source, "html.parser")
-        checkouts = soup.select("div.cp-batch-actions-list-item")
-
-        for item in checkouts:
-            plain_text = item.get_text('\n')
-            # print(plain_text)
-            lines = plain_text.split('\n')
-            # print(lines)
-            res.append(lines)
-        return res
+        return extract_item_lines(page_source, PPL.CHECKOUT_SELECTOR, engine)
 
+    @traced(category="scrape")
     def items_on_hold(self, username, password):
         """
         Scrapes and returns the items on hold for the user with the login credentials given
@@ -214,14 +525,16 @@ class PPL(DurhamLibrary):
         """
         # record datetime this data was scraped
         # scrape for items on hold only
-        self.login(username, password, url="https://pickering.bibliocommons.com/user/login?destination=%2Fv2%2Fholds")
+        self.login(username, password,
+                   url=self.account_url + "/user/login?destination=%2Fv2%2Fholds").raise_for_failure()
 
         WebDriverWait(driver=self.driver, timeout=10).until(
             EC.title_is("On Hold | Pickering Public Library | BiblioCommons")
         )
-        hold_data = self.hold_data(self.driver.page_source)
+        hold_data = self.hold_data(read_items(self.driver, self.HOLD_SELECTOR, self.extract_in_browser))
         return self.parse_hold_data(hold_data)
 
+    @traced(category="scrape")
     def items_checked_out(self, username, password):
         """
         Scrapes and returns the items checked out for the user with the login credentials given
@@ -236,14 +549,54 @@ class PPL(DurhamLibrary):
         -------
         Item[]
         """
-        self.login(username, password, url="https://pickering.bibliocommons.com/user/login?destination=%2Fcheckedout")
+        self.login(username, password,
+                   url=self.account_url + "/user/login?destination=%2Fcheckedout").raise_for_failure()
 
         WebDriverWait(driver=self.driver, timeout=10).until(
             EC.title_is("Checked Out | Pickering Public Library | BiblioCommons")
         )
-        checkout_data = self.checkout_data(self.driver.page_source)
+        checkout_data = self.checkout_data(read_items(self.driver, self.CHECKOUT_SELECTOR, self.extract_in_browser))
         return self.parse_checkout_data(checkout_data)
 
+    @traced(category="scrape")
+    def snapshot(self, username, password):
+        """
+        Signs in once and scrapes both the items on hold and the items checked out for the user with the login
+        credentials given. The checkouts page is loaded in a second tab while the holds page is loading. The stored
+        session of the user is reused instead of the login form when the library has a session store. The pages are
+        fetched over plain HTTP instead when the library has an http backend that succeeds.
+
+        Parameters
+        ----------
+        username: str
+            The username of the account that will be signed into
+        password: str
+            The password of the account that will be signed into
+        Returns
+        -------
+        dict
+            The Item[] of holds under "holds" and the Item[] of checkouts under "checkouts"
+        """
+        pages = http_snapshot_pages(self.http_backend, username, password)
+        if pages is not None:
+            return self.parse_snapshot(*pages)
+        capture = GatewayCapture(self.driver) if self.capture_gateway else None
+        if not resume_session(self.driver, self.session_store, "ppl", username,
+                              self.account_url + "/v2/holds", "/user/login"):
+            self.login(username, password,
+                       url=self.account_url + "/user/login?destination=%2Fv2%2Fholds").raise_for_failure()
+            WebDriverWait(driver=self.driver, timeout=10).until(url_excludes("/user/login"))
+            remember_session(self.driver, self.session_store, "ppl", username)
+        if capture is not None:
+            return self.gateway_snapshot(capture, self.account_url + "/checkedout")
+
+        holds_source, checkouts_source = load_snapshot_pages(
+            self.driver, EC.title_is("On Hold | Pickering Public Library | BiblioCommons"),
+            self.account_url + "/checkedout",
+            EC.title_is("Checked Out | Pickering Public Library | BiblioCommons"),
+            self.capture_profile, self.load_times, self.item_selectors())
+        return self.parse_snapshot(holds_source, checkouts_source)
+
     @staticmethod
     def _hours(page_source, full_branch_name):
         """
@@ -270,6 +623,26 @@ class PPL(DurhamLibrary):
         return full_branch_name + '\n'.join(lines[1:])
 
     def hours(self, branch, page_source=None):
+        """
+        Returns the hours of this branch. The hours are served from the hours cache when one was given and the cached
+        hours haven't expired, otherwise the website is scraped.
+
+        Parameters
+        ----------
+        branch: str
+            The branch of which hours will be retrieved
+        page_source: str
+            Plain text html of the branch's location page. The cache is bypassed if it is given.
+        Returns
+        -------
+        str
+        """
+        if self.hours_cache is None or page_source:
+            return self._scrape_hours(branch, page_source)
+        return self.hours_cache.hours("ppl", branch, lambda: self._scrape_hours(branch))
+
+    @traced(category="scrape")
+    def _scrape_hours(self, branch, page_source=None):
         """
         Scrapes the website for the hours of this branch
         
@@ -283,23 +656,24 @@ class PPL(DurhamLibrary):
         """
         full_branch_name = ""
         if "Central" in branch:
-            self.driver.get("https://pickeringlibrary.ca/locations/PC/")
+            traced_get(self.driver, self.site_url + "/locations/PC/")
             full_branch_name = 'Central Library Hours\n'
         elif "George Ashe" in branch:
-            self.driver.get("https://pickeringlibrary.ca/locations/PC/")
+            traced_get(self.driver, self.site_url + "/locations/PC/")
             full_branch_name = 'George Ashe Library Hours\n'
 
         elif "Claremont" in branch:
-            self.driver.get("https://pickeringlibrary.ca/locations/CL/")
+            traced_get(self.driver, self.site_url + "/locations/CL/")
             full_branch_name = 'Claremont Library Hours\n'
         else:
             raise NoSuchElementException(f"Hours for {branch} cannot be found because the branch does not exist")
         if not (page_source):
-            page_source = self.driver.page_source
+            page_source = traced_page_source(self.driver)
         return PPL._hours(page_source, full_branch_name)
 
+    @traced(category="scrape")
     def login(self, username, password,
-              url="https://pickering.bibliocommons.com/user/login?destination=https%3A%2F%2Fpickeringlibrary.ca"):
+              url=None):
         """
         Applies login credentials to the url given
 
@@ -310,99 +684,59 @@ class PPL(DurhamLibrary):
         password: str
             The password of the account that will be signed into
         url: str
-            The url which the login credentials will be applied to
-        """
-        self.driver.get(url)
-        try:
-            user_login = WebDriverWait(driver=self.driver, timeout=10).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "input[testid=field_username]"))
-            )
-            pass_login = WebDriverWait(driver=self.driver, timeout=10).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "input[testid=field_userpin]"))
-            )
-            submit_login = WebDriverWait(driver=self.driver, timeout=10).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "input[testid=button_login]"))
-            )
-            user_login.send_keys(username)
-            pass_login.send_keys(password)
-            submit_login.click()
-        except TimeoutException as e:
-            if not ('Pickering Public Library' in self.driver.title):
-                raise (e)
+            The url which the login credentials will be applied to. Defaults to the login page of account_url.
+        Returns
+        -------
+        login_outcome.LoginOutcome
+            How the site answered, as soon as it shows the outcome (see login_outcome.sign_in)
+        """
+        if url is None:
+            url = self.account_url + "/user/login?destination=" + quote(self.site_url, safe='')
+        traced_get(self.driver, url)
+        return sign_in(self.driver, self.LOGIN_PAGE, username, password)
 
 
 class WPL(DurhamLibrary):
-    """Class for Whitby Public Library
-    Attributes:
-        - driver: an instance of a Selenium Chrome web driver
-    """
-    
-    def __init__(self, driver=None):
-        super().__init__()
-        self.driver = driver
-        self.name = "Whitby Public Library"
+    """Class for Whitby Public Library (see LibrarySystem and DurhamLibrary for the attributes)"""
+    name = "Whitby Public Library"
+    ACCOUNT_URL = "https://whitby.bibliocommons.com"
+    SITE_URL = "https://www.whitbylibrary.ca"
 
     @staticmethod
-    def checkout_data(page_source):
+    def checkout_data(page_source, engine=None):
         """
-        Logs into the checkouts page and returns a list of lists of textual data for each checkout item
+        Returns a list of lists of textual data for each checkout item on the checkouts page
 
         Parameters
         ----------
-        username: str
-            The username of the account that will be signed into
-        password: str
-            The password of the account that will be signed into
+        page_source: str
+            Plain text html of a checkouts page
+        engine: str
+            The name of the extraction engine to use ("soup", "lxml"). Uses the global default if not given.
         Returns
         -------
         str[][]
         """
-        res = []
-        soup = BeautifulSoup(page_source, "html.parser")
-        checkouts = soup.find_all("div", class_="cp-batch-actions-list-item")
-        # locate the checkouts
-        # check_out_container = self.driver.find_element(By.CLASS_NAME, 'cp-item-list')
-        # checkouts = check_out_container.find_elements(By.CLASS_NAME, )
-
-        for item in checkouts:
-            plain_text = item.get_text('\n')
-            # print(plain_text)
-            lines = plain_text.split('\n')
-            # print(lines)
-            res.append(lines)
-
-        return res
+        return extract_item_lines(page_source, WPL.CHECKOUT_SELECTOR, engine)
 
     @staticmethod
-    def hold_data(page_source):
+    def hold_data(page_source, engine=None):
         """
-        Logs into the holds page and returns a list of lists of textual data for each hold item
+        Returns a list of lists of textual data for each hold item on the holds page
 
         Parameters
         ----------
-        username: str
-            The username of the account that will be signed into
-        password: str
-            The password of the account that will be signed into
+        page_source: str
+            Plain text html of a holds page
+        engine: str
+            The name of the extraction engine to use ("soup", "lxml"). Uses the global default if not given.
         Returns
         -------
         str[][]
         """
-        res = []
-        # locate the checkouts
-        # save_output_as_html(self.driver.page_source, "wpl-hold-data-library-py")
-        soup = BeautifulSoup(page_source, "html.parser")
-        holds = soup.find_all("div", class_='cp-batch-actions-list-item')
-
-        for item in holds:
-            plain_text = item.get_text('\n')
-            # print(plain_text)
-            lines = plain_text.split('\n')
-            # print(lines)
-            res.append(lines)
-        # print(res)
-        return res
+        return extract_item_lines(page_source, WPL.HOLD_SELECTOR, engine)
 
+    @traced(category="scrape")
     def items_on_hold(self, username, password):
         """
         Scrapes and returns the items on hold for the user with the login credentials given
@@ -417,14 +751,15 @@ class WPL(DurhamLibrary):
         -------
         Item[]
         """
-        self.login(username, password, url="https://whitby.bibliocommons.com/v2/holds")
+        self.login(username, password, url=self.account_url + "/v2/holds").raise_for_failure()
 
         WebDriverWait(driver=self.driver, timeout=10).until(
             EC.presence_of_element_located((By.CLASS_NAME, 'cp-item-list')))
         # scrape for items on hold only
-        hold_data = self.hold_data(self.driver.page_source)
+        hold_data = self.hold_data(read_items(self.driver, self.HOLD_SELECTOR, self.extract_in_browser))
         return self.parse_hold_data(hold_data)
 
+    @traced(category="scrape")
     def items_checked_out(self, username, password):
         """
         Scrapes and returns the items on checked for the user with the login credentials given
@@ -439,13 +774,51 @@ class WPL(DurhamLibrary):
         -------
         Item[]
         """
-        self.login(username, password, url="https://whitby.bibliocommons.com/v2/checkedout")
+        self.login(username, password, url=self.account_url + "/v2/checkedout").raise_for_failure()
 
         WebDriverWait(driver=self.driver, timeout=10).until(
             EC.presence_of_all_elements_located((By.CLASS_NAME, "cp-item-list")))
-        checkout_data = self.checkout_data(self.driver.page_source)
+        checkout_data = self.checkout_data(read_items(self.driver, self.CHECKOUT_SELECTOR, self.extract_in_browser))
         return self.parse_checkout_data(checkout_data)
 
+    @traced(category="scrape")
+    def snapshot(self, username, password):
+        """
+        Signs in once and scrapes both the items on hold and the items checked out for the user with the login
+        credentials given. The checkouts page is loaded in a second tab while the holds page is loading. The stored
+        session of the user is reused instead of the login form when the library has a session store. The pages are
+        fetched over plain HTTP instead when the library has an http backend that succeeds.
+
+        Parameters
+        ----------
+        username: str
+            The username of the account that will be signed into
+        password: str
+            The password of the account that will be signed into
+        Returns
+        -------
+        dict
+            The Item[] of holds under "holds" and the Item[] of checkouts under "checkouts"
+        """
+        pages = http_snapshot_pages(self.http_backend, username, password)
+        if pages is not None:
+            return self.parse_snapshot(*pages)
+        capture = GatewayCapture(self.driver) if self.capture_gateway else None
+        if not resume_session(self.driver, self.session_store, "wpl", username,
+                              self.account_url + "/v2/holds", "/user/login"):
+            self.login(username, password, url=self.account_url + "/v2/holds").raise_for_failure()
+            WebDriverWait(driver=self.driver, timeout=10).until(url_excludes("/user/login"))
+            remember_session(self.driver, self.session_store, "wpl", username)
+        if capture is not None:
+            return self.gateway_snapshot(capture, self.account_url + "/v2/checkedout")
+
+        holds_source, checkouts_source = load_snapshot_pages(
+            self.driver, EC.presence_of_element_located((By.CLASS_NAME, 'cp-item-list')),
+            self.account_url + "/v2/checkedout",
+            EC.presence_of_all_elements_located((By.CLASS_NAME, "cp-item-list")),
+            self.capture_profile, self.load_times, self.item_selectors())
+        return self.parse_snapshot(holds_source, checkouts_source)
+
     @staticmethod
     def _hours(page_source, branch):
         """
@@ -480,6 +853,24 @@ class WPL(DurhamLibrary):
             return ''
 
     def hours(self, branch):
+        """
+        Returns the hours of this branch. The hours are served from the hours cache when one was given and the cached
+        hours haven't expired, otherwise the website is scraped.
+
+        Parameters
+        ----------
+        branch: str
+            The branch of which hours will be retrieved
+        Returns
+        -------
+        str
+        """
+        if self.hours_cache is None:
+            return self._scrape_hours(branch)
+        return self.hours_cache.hours("wpl", branch, lambda: self._scrape_hours(branch))
+
+    @traced(category="scrape")
+    def _scrape_hours(self, branch):
         """
         Scrapes the website for the hours of this branch
         
@@ -492,11 +883,12 @@ class WPL(DurhamLibrary):
         str
         """
 
-        self.driver.get("https://www.whitbylibrary.ca/hours")
-        return WPL._hours(self.driver.page_source, branch)
+        traced_get(self.driver, self.site_url + "/hours")
+        return WPL._hours(traced_page_source(self.driver), branch)
 
+    @traced(category="scrape")
     def login(self, username, password,
-              url='https://whitby.bibliocommons.com/user/login?destination=%2Fuser_dashboard'):
+              url=None):
         """
         Applies login credentials to the url given
 
@@ -507,48 +899,38 @@ class WPL(DurhamLibrary):
         password: str
             The password of the account that will be signed into
         url: str
-            The url which the login credentials will be applied to
-        """
-        self.driver.get(url)
-        # if this instance of the library is connected to a particular user, log them in
-        try:
-            user_login = WebDriverWait(driver=self.driver, timeout=10).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "input[testid=field_username]"))
-            )
-            pass_login = WebDriverWait(driver=self.driver, timeout=10).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "input[testid=field_userpin]"))
-            )
-            submit_login = WebDriverWait(driver=self.driver, timeout=10).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "input[testid=button_login]"))
-            )
-            if user_login and pass_login and submit_login:
-                user_login.send_keys(username)
-                pass_login.send_keys(password)
-                submit_login.click()
-        except (TimeoutException, NoSuchElementException) as e:
-            if not ('Whitby Public Library' in self.driver.title):
-                raise e
-
-
-class TPL:
-    """Class for Toronto Public Library
-    Attributes:
-        - driver: an instance of a Selenium Chrome web driver
-    """
-
-    def __init__(self, driver=None):
-        self.driver = driver
-        self.name = "Toronto Public Library"
+            The url which the login credentials will be applied to. Defaults to the login page of account_url.
+        Returns
+        -------
+        login_outcome.LoginOutcome
+            How the site answered, as soon as it shows the outcome (see login_outcome.sign_in)
+        """
+        if url is None:
+            url = self.account_url + "/user/login?destination=%2Fuser_dashboard"
+        traced_get(self.driver, url)
+        return sign_in(self.driver, self.LOGIN_PAGE, username, password)
+
+
+class TPL(LibrarySystem):
+    """Class for Toronto Public Library (see LibrarySystem for the attributes)"""
+    name = "Toronto Public Library"
+    ACCOUNT_URL = "https://account.torontopubliclibrary.ca"
+    SITE_URL = "https://www.torontopubliclibrary.ca"
+    LOGIN_PAGE = TPL_LOGIN_PAGE
+    HOLD_SELECTOR = "#PageContent > div.holds-redux.ready-for-pickup > div > div > table > tbody"
+    CHECKOUT_SELECTOR = ".item-wrapper"
+    _branch_hours = None  # the hours of every branch, read from the branches page the first time they're needed
 
     @staticmethod
+    @traced("TPL.parse_hold_data", category="parse")
     def parse_hold_data(hold_data):
         parser = TorontoHoldParser(TorontoHoldParseRule(title=2, item_format=4, contributors=3, item_date=7, branch=5))
         title, item_format, contributors, item_date, status, branch = parser.all(hold_data)
-        print("in library.py:",title, item_format, contributors, item_date, status, branch)
         return Item(date_retrieved=date.today(), title=title, contributors=contributors, item_format=item_format,
                     is_hold=True, item_date=item_date, status=status, branch=branch, system='toronto')
 
     @staticmethod
+    @traced("TPL.parse_checkout_data", category="parse")
     def parse_checkout_data(checkout_data):
         parser = TorontoCheckoutParser(
             TorontoCheckoutParseRule(title=1, item_format=5, contributors=4, status=8, item_date=7))
@@ -573,63 +955,71 @@ class TPL:
                         is_hold=is_hold, item_date=data[4], status=status, branch='', system='toronto')
 
     @staticmethod
-    def hold_data(page_source):
+    def hold_data(page_source, engine=None):
         """
-        Logs into the holds page and returns a list of lists of textual data for each hold item
+        Returns a list of lists of textual data for each hold item on the holds page
 
         Parameters
         ----------
-        username: str
-            The username of the account that will be signed into
-        password: str
-            The password of the account that will be signed into
+        page_source: str
+            Plain text html of a holds page
+        engine: str
+            The name of the extraction engine to use ("soup", "lxml"). Uses the global default if not given.
         Returns
         -------
         str[][]
         """
-        res = []
-        soup = BeautifulSoup(page_source, "html.parser")
-        on_hold = soup.select("#PageContent > div.holds-redux.ready-for-pickup > div > div > table > tbody")
-        # on_hold = self.driver.find_elements(By.CSS_SELECTOR, "#PageContent > div.holds-redux.ready-for-pickup
-        # > div > div > table > tbody")
-        # save_output_as_html(self.driver.page_source, "tpl-holds-raw")
-        for item in on_hold:
-            plain_text = item.get_text('\n')
-            # print(plain_text)
-            lines = plain_text.split('\n')
-            # print(lines)
-            res.append(lines)
-
-        # save_output_as_txt(str(res), "tpl-hold-data-raw")
-        return res
+        return extract_item_lines(page_source, TPL.HOLD_SELECTOR, engine)
 
     @staticmethod
-    def checkout_data(page_source):
+    def checkout_data(page_source, engine=None):
         """
-        Logs into the checkouts page and returns a list of lists of textual data for each checkout item
+        Returns a list of lists of textual data for each checkout item on the checkouts page
 
         Parameters
         ----------
-        username: str
-            The username of the account that will be signed into
-        password: str
-            The password of the account that will be signed into
+        page_source: str
+            Plain text html of a checkouts page
+        engine: str
+            The name of the extraction engine to use ("soup", "lxml"). Uses the global default if not given.
         Returns
         -------
         str[][]
         """
-        res = []
-        soup = BeautifulSoup(page_source, "html.parser")
-        checkouts = soup.find_all(class_="item-wrapper")
-        for item in checkouts:
-            plain_text = item.get_text('\n')
-            # print(plain_text)
-            lines = plain_text.split('\n')
-            # print(lines)
-            res.append(lines)
-        # save_output_as_txt(str(res), 'tpl-checkouts-raw')
-        return res
+        return extract_item_lines(page_source, TPL.CHECKOUT_SELECTOR, engine)
+
+    @staticmethod
+    def stream_hold_data(source):
+        """
+        Yields the textual data of each hold item on the holds page as soon as the item has been read from source
+
+        Parameters
+        ----------
+        source: str, bytes, file-like object or iterable of chunks
+            Html of a holds page
+        Returns
+        -------
+        generator of str[]
+        """
+        return iter_item_lines(source, TPL.HOLD_SELECTOR)
+
+    @staticmethod
+    def stream_checkout_data(source):
+        """
+        Yields the textual data of each checkout item on the checkouts page as soon as the item has been read from
+        source
 
+        Parameters
+        ----------
+        source: str, bytes, file-like object or iterable of chunks
+            Html of a checkouts page
+        Returns
+        -------
+        generator of str[]
+        """
+        return iter_item_lines(source, TPL.CHECKOUT_SELECTOR)
+
+    @traced(category="scrape")
     def items_on_hold(self, username, password):
         """
         Scrapes and returns the items on hold for the user with the login credentials given
@@ -646,14 +1036,15 @@ class TPL:
         """
         res = []
    
-        holds_url = "https://account.torontopubliclibrary.ca/signin?redirect=%2Fholds"
-        self.login(username, password, url=holds_url, expected_title='Holds : Toronto Public Library')
+        holds_url = self.account_url + "/signin?redirect=%2Fholds"
+        self.login(username, password, url=holds_url,
+                   expected_title='Holds : Toronto Public Library').raise_for_failure()
 
         WebDriverWait(driver=self.driver, timeout=10).until(
             EC.visibility_of_any_elements_located(
                 (By.CSS_SELECTOR, "#PageContent > div.holds-redux.ready-for-pickup"))
         )
-        hold_data = TPL.hold_data(self.driver.page_source)
+        hold_data = TPL.hold_data(read_items(self.driver, self.HOLD_SELECTOR, self.extract_in_browser))
         #print(hold_data)
         res = []
         if hold_data:
@@ -662,6 +1053,7 @@ class TPL:
                 res.append(hold_item)
         return res
 
+    @traced(category="scrape")
     def items_checked_out(self, username, password):
         """
         Scrapes and returns the items on checked for the user with the login credentials given
@@ -677,14 +1069,15 @@ class TPL:
         Item[]
         """
         res = []
-        checkout_url = "https://account.torontopubliclibrary.ca/signin?redirect=%2Fcheckouts"
-        self.login(username, password, url=checkout_url, expected_title='Checkouts : Toronto Public Library')
+        checkout_url = self.account_url + "/signin?redirect=%2Fcheckouts"
+        self.login(username, password, url=checkout_url,
+                   expected_title='Checkouts : Toronto Public Library').raise_for_failure()
 
         WebDriverWait(driver=self.driver, timeout=10).until(
             EC.visibility_of_all_elements_located((By.CLASS_NAME, "item-wrapper"))
         )
 
-        checkout_data = self.checkout_data(self.driver.page_source)
+        checkout_data = self.checkout_data(read_items(self.driver, self.CHECKOUT_SELECTOR, self.extract_in_browser))
         # print(checkout_data)
         for lines in checkout_data:
             checkout_item = self.parse_checkout_data(lines)
@@ -694,42 +1087,144 @@ class TPL:
         # print(res)
         return res
 
+    @traced(category="scrape")
+    def snapshot(self, username, password):
+        """
+        Signs in once and scrapes both the items on hold and the items checked out for the user with the login
+        credentials given. The checkouts page is loaded in a second tab while the holds page is loading. The stored
+        session of the user is reused instead of the login form when the library has a session store. The pages are
+        fetched over plain HTTP instead when the library has an http backend that succeeds.
+
+        Parameters
+        ----------
+        username: str
+            The username of the account that will be signed into
+        password: str
+            The password of the account that will be signed into
+        Returns
+        -------
+        dict
+            The Item[] of holds under "holds" and the Item[] of checkouts under "checkouts"
+        """
+        pages = http_snapshot_pages(self.http_backend, username, password)
+        if pages is not None:
+            return self.parse_snapshot(*pages)
+        if not resume_session(self.driver, self.session_store, "tpl", username,
+                              self.account_url + "/holds", "/signin"):
+            holds_url = self.account_url + "/signin?redirect=%2Fholds"
+            self.login(username, password, url=holds_url,
+                       expected_title='Holds : Toronto Public Library').raise_for_failure()
+            WebDriverWait(driver=self.driver, timeout=10).until(url_excludes("/signin"))
+            remember_session(self.driver, self.session_store, "tpl", username)
+
+        holds_source, checkouts_source = load_snapshot_pages(
+            self.driver,
+            EC.visibility_of_any_elements_located((By.CSS_SELECTOR, "#PageContent > div.holds-redux.ready-for-pickup")),
+            self.account_url + "/checkouts",
+            EC.visibility_of_all_elements_located((By.CLASS_NAME, "item-wrapper")),
+            self.capture_profile, self.load_times, self.item_selectors())
+        return self.parse_snapshot(holds_source, checkouts_source)
+
+    @traced(category="parse")
+    def parse_snapshot(self, holds_source, checkouts_source):
+        """
+        Parses the items on a holds page and a checkouts page
+
+        Parameters
+        ----------
+        holds_source: str
+            Plain text html of the holds page
+        checkouts_source: str
+            Plain text html of the checkouts page
+        Returns
+        -------
+        dict
+            The Item[] of holds under "holds" and the Item[] of checkouts under "checkouts"
+        """
+        self.holds = [TPL.parse_hold_data(lines) for lines in TPL.hold_data(holds_source)]
+        self.checkouts = [TPL.parse_checkout_data(lines) for lines in TPL.checkout_data(checkouts_source)]
+        return {"holds": self.holds, "checkouts": self.checkouts}
+
     @staticmethod
-    def _hours(branch, page_source):
+    def branch_hours_index(page_source):
+        """
+        Walks the branches page once and maps the name of every branch to its hours. The branches are listed in
+        alphabetical groups, each starting at an "alphaIndex-<letter>" anchor followed by one ".row" per branch.
+
+        Parameters
+        ----------
+        page_source: str
+            Plain text html of the branches page
+        Returns
+        -------
+        dict
+            The normalized hours block (the branch's lines without indentation or blank lines) of each branch keyed by
+            the branch's name, in the order the branches are listed
+        """
         soup = BeautifulSoup(page_source, "html.parser")
-        first_letter = branch[0]
-        alpha_selector = "alphaIndex-" + first_letter
-        end_of_branches = False
-        curr_selector = "a[name=" + alpha_selector + "]"
-        branch_element = ""
-        while not end_of_branches:
-            curr_selector = curr_selector + "+.row"
-            try:
-                branch_element = soup.select(curr_selector)
-                # print(type(branch_element), len(branch_element))
-                lines = None
-
-                for item in branch_element:
-                    lines = item.get_text()
-
-                # print("lines:\n",lines)
-                if branch in lines:
-                    lines = lines.split('\n')
-                    lines = list(filter(lambda item: not (item.isspace()) and (item != ''), lines))
-                    lines = [x.lstrip() for x in lines]
-                    # print(lines)
-                    return '\n'.join(lines)
-            except NoSuchElementException as e:
-                end_of_branches = True
-
-        if end_of_branches:
-            raise NoSuchElementException(f"Hours for {branch} cannot be found because the branch does not exist")
-        return ""
+        index = {}
+        for anchor in soup.select('a[name^="alphaIndex-"]'):
+            row = anchor.find_next_sibling()
+            while row is not None and "row" in (row.get("class") or []):
+                lines = [line.lstrip() for line in row.get_text().split('\n') if line and not line.isspace()]
+                if lines:
+                    index.setdefault(lines[0], '\n'.join(lines))
+                row = row.find_next_sibling()
+        return index
+
+    @staticmethod
+    def lookup_hours(index, branch):
+        """
+        Looks up the hours of a branch in a branch hours index. The branch's name is matched exactly first, then as
+        part of the hours block of a branch in the same alphabetical group.
+
+        Parameters
+        ----------
+        index: dict
+            The index returned by branch_hours_index
+        branch: str
+            The branch of which hours will be retrieved
+        Returns
+        -------
+        str
+        """
+        hours = index.get(branch)
+        if hours is not None:
+            return hours
+        for name, hours in index.items():
+            if name[:1] == branch[:1] and branch in hours:
+                return hours
+        raise NoSuchElementException(f"Hours for {branch} cannot be found because the branch does not exist")
+
+    @staticmethod
+    def _hours(branch, page_source):
+        return TPL.lookup_hours(TPL.branch_hours_index(page_source), branch)
+
+    @traced(category="scrape")
+    def all_hours(self, refresh=False):
+        """
+        Scrapes the branches page once for the hours of every branch. The result is reused by later calls to hours and
+        all_hours unless refresh is True.
+
+        Parameters
+        ----------
+        refresh: bool
+            True if the branches page should be loaded again
+        Returns
+        -------
+        dict
+            The hours of each branch keyed by the branch's name
+        """
+        if self._branch_hours is None or refresh:
+            traced_get(self.driver, self.site_url + "/branches/")
+            self._branch_hours = TPL.branch_hours_index(traced_page_source(self.driver))
+        return dict(self._branch_hours)
 
     def hours(self, branch):
         """
-        Scrapes the website for the hours of this branch
-        
+        Returns the hours of this branch. The hours are served from the hours cache when one was given and the cached
+        hours haven't expired, otherwise the website is scraped.
+
         Parameters
         ----------
         branch: str
@@ -738,12 +1233,29 @@ class TPL:
         -------
         str
         """
+        if self.hours_cache is None:
+            return self._scrape_hours(branch)
+        return self.hours_cache.hours("tpl", branch, lambda: self._scrape_hours(branch))
 
-        self.driver.get("https://www.torontopubliclibrary.ca/branches/")
-        page_source = self.driver.page_source
-        return self._hours(branch, page_source)
+    @traced(category="scrape")
+    def _scrape_hours(self, branch):
+        """
+        Looks up the hours of this branch in the index of the branches page, which is scraped on first use
+        
+        Parameters
+        ----------
+        branch: str
+            The branch of which hours will be retrieved
+        Returns
+        -------
+        str
+        """
+        if self._branch_hours is None:
+            self.all_hours()
+        return TPL.lookup_hours(self._branch_hours, branch)
 
-    def login(self, username, password, url='https://account.torontopubliclibrary.ca/login', expected_title=None):
+    @traced(category="scrape")
+    def login(self, username, password, url=None, expected_title=None):
         """
         Applies login credentials to the url given
 
@@ -754,17 +1266,18 @@ class TPL:
         password: str
             The password of the account that will be signed into
         url: str
-            The url which the login credentials will be applied to
+            The url which the login credentials will be applied to. Defaults to the login page of account_url.
+        Returns
+        -------
+        login_outcome.LoginOutcome
+            How the site answered, as soon as it shows the outcome (see login_outcome.sign_in)
         """
+        if url is None:
+            url = self.account_url + "/login"
         
 
-        self.driver.get(url)
+        traced_get(self.driver, url)
         if expected_title:
             if expected_title == self.driver.title:
-                return
-        user_login = self.driver.find_element_by_id("userID")
-        pass_login = self.driver.find_element_by_id("password")
-        submit_login = self.driver.find_element_by_css_selector("#form_signin > div > button")
-        user_login.send_keys(username)
-        pass_login.send_keys(password)
-        submit_login.click()
+                return LoginOutcome(LoginOutcome.SIGNED_IN, expected_title, self.driver.current_url)
+        return sign_in(self.driver, self.LOGIN_PAGE, username, password)
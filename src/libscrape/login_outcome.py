@@ -0,0 +1,222 @@
+"""
+Library for telling the outcome of a login as soon as the site shows it. After the login form is submitted, the
+success page, the known error banners (bad credentials, a locked account, a maintenance page) and a re-render of the
+form are watched for all at once, so a rejected login ends after one page load instead of a full WebDriverWait timeout.
+
+Usage:
+    outcome = sign_in(driver, DURHAM_LOGIN_PAGE, username, password)
+    outcome.raise_for_failure()
+"""
+
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException
+from selenium.webdriver.support import expected_conditions as EC
+
+from tracing import WebDriverWait
+
+
+class LoginOutcome:
+    """
+    The outcome of a login
+
+    Attributes:
+      - kind: SIGNED_IN, BAD_CREDENTIALS, LOCKED, MAINTENANCE or REJECTED (the form was shown again without a known
+        error banner)
+      - message: the text of the error banner or the title of the page that told the outcome
+      - url: the url of the page that told the outcome
+    """
+
+    SIGNED_IN = "signed in"
+    BAD_CREDENTIALS = "bad credentials"
+    LOCKED = "locked"
+    MAINTENANCE = "maintenance"
+    REJECTED = "rejected"
+
+    def __init__(self, kind, message="", url=""):
+        self.kind = kind
+        self.message = message
+        self.url = url
+
+    @property
+    def signed_in(self):
+        return self.kind == LoginOutcome.SIGNED_IN
+
+    def raise_for_failure(self):
+        """
+        Raises MaintenanceError if the site is down for maintenance or LoginError if the login failed. Returns the
+        outcome otherwise.
+        """
+        if self.kind == LoginOutcome.MAINTENANCE:
+            raise MaintenanceError(self)
+        if not self.signed_in:
+            raise LoginError(self)
+        return self
+
+    def __repr__(self):
+        return f"LoginOutcome({self.kind!r}, {self.message!r})"
+
+
+class LoginError(Exception):
+    """
+    Raised when a login failed
+
+    Attributes:
+      - outcome: the LoginOutcome of the login
+    """
+
+    def __init__(self, outcome):
+        message = f": {outcome.message}" if outcome.message else ""
+        super().__init__(f"The login failed ({outcome.kind}){message}")
+        self.outcome = outcome
+
+    def __reduce__(self):
+        return type(self), (self.outcome,)
+
+
+class MaintenanceError(LoginError):
+    """
+    Raised when a site couldn't be signed in to because it is down for maintenance, which unlike a rejected login is
+    worth retrying later
+    """
+
+
+class LoginPage:
+    """
+    The markup of a library system's login page and of the outcomes of submitting it
+
+    Attributes:
+      - login_paths: the parts of a url that show the browser is still on the login page
+      - username_selector: the CSS selector of the username input
+      - password_selector: the CSS selector of the password input
+      - submit_selector: the CSS selector of the submit button
+      - error_selector: the CSS selector of the error banners
+      - error_phrases: (kind, phrases) pairs. A banner containing one of the phrases (in lowercase) gives the kind.
+      - maintenance_phrases: phrases of the title of a maintenance page, in lowercase
+    """
+
+    def __init__(self, login_paths, username_selector, password_selector, submit_selector, error_selector,
+                 error_phrases, maintenance_phrases):
+        self.login_paths = login_paths
+        self.username_selector = username_selector
+        self.password_selector = password_selector
+        self.submit_selector = submit_selector
+        self.error_selector = error_selector
+        self.error_phrases = error_phrases
+        self.maintenance_phrases = maintenance_phrases
+
+    def on_login_page(self, driver):
+        return any(path in driver.current_url for path in self.login_paths)
+
+    def maintenance(self, driver):
+        """
+        An expectation that the site shows a maintenance page
+        """
+        title = driver.title
+        if any(phrase in title.lower() for phrase in self.maintenance_phrases):
+            return LoginOutcome(LoginOutcome.MAINTENANCE, title, driver.current_url)
+        return False
+
+    def signed_in(self, driver):
+        """
+        An expectation that the browser has left the login page
+        """
+        if self.on_login_page(driver):
+            return False
+        return LoginOutcome(LoginOutcome.SIGNED_IN, driver.title, driver.current_url)
+
+    def error(self, driver):
+        """
+        An expectation that the login page shows a known error banner
+        """
+        for banner in driver.find_elements_by_css_selector(self.error_selector):
+            text = banner.text.strip()
+            for kind, phrases in self.error_phrases:
+                if any(phrase in text.lower() for phrase in phrases):
+                    return LoginOutcome(kind, text, driver.current_url)
+        return False
+
+    def form(self, driver):
+        """
+        An expectation that the login form is present, whose value is its username input, password input and submit
+        button
+        """
+        elements = []
+        for selector in (self.username_selector, self.password_selector, self.submit_selector):
+            found = driver.find_elements_by_css_selector(selector)
+            if not found:
+                return False
+            elements.append(found[0])
+        return elements
+
+    def rerendered(self, submitted):
+        """
+        Returns an expectation that the page the form was submitted from has been replaced by a new login form
+        """
+        def rerendered(driver):
+            if not self.on_login_page(driver) or not EC.staleness_of(submitted)(driver) or not self.form(driver):
+                return False
+            return LoginOutcome(LoginOutcome.REJECTED, driver.title, driver.current_url)
+        return rerendered
+
+
+ERROR_PHRASES = [
+    (LoginOutcome.LOCKED, ("locked", "blocked", "too many")),
+    (LoginOutcome.MAINTENANCE, ("maintenance", "temporarily unavailable")),
+    (LoginOutcome.BAD_CREDENTIALS, ("incorrect", "invalid", "not recognized", "not valid", "does not match",
+                                    "doesn't match", "try again")),
+]
+MAINTENANCE_PHRASES = ("maintenance", "temporarily unavailable", "service unavailable")
+
+DURHAM_LOGIN_PAGE = LoginPage(("/user/login",), "input[testid=field_username]", "input[testid=field_userpin]",
+                              "input[testid=button_login]", ".cp-alert, .alert, [role=alert], .cp-error-message",
+                              ERROR_PHRASES, MAINTENANCE_PHRASES)
+TPL_LOGIN_PAGE = LoginPage(("/signin", "/login"), "#userID", "#password", "#form_signin > div > button",
+                           ".alert, .error, [role=alert], .errorMessage", ERROR_PHRASES, MAINTENANCE_PHRASES)
+
+
+def any_of(*conditions):
+    """
+    An expectation that is met as soon as one of the conditions is, whose value is the value of the first condition
+    met. A condition that raises because the page changed while it was checked counts as not met.
+    """
+    def any_of(driver):
+        for condition in conditions:
+            try:
+                value = condition(driver)
+            except (NoSuchElementException, StaleElementReferenceException):
+                continue
+            if value:
+                return value
+        return False
+    return any_of
+
+
+def sign_in(driver, login_page, username, password, timeout=10):
+    """
+    Fills in and submits the login form of the page the driver has loaded, then waits for the outcome
+
+    Parameters
+    ----------
+    driver: selenium.webdriver.Chrome
+        A web driver that has loaded a login page (or a page that redirects to one)
+    login_page: LoginPage
+        The markup of the library system's login page
+    username: str
+    password: str
+    timeout: float
+        The number of seconds to wait for the form and then for the outcome
+    Returns
+    -------
+    LoginOutcome
+        SIGNED_IN without submitting the form if the driver is already signed in. Raises TimeoutException if neither
+        the form nor an outcome appears in time.
+    """
+    found = WebDriverWait(driver=driver, timeout=timeout).until(
+        any_of(login_page.maintenance, login_page.signed_in, login_page.form))
+    if isinstance(found, LoginOutcome):
+        return found
+    user_login, pass_login, submit_login = found
+    user_login.send_keys(username)
+    pass_login.send_keys(password)
+    submit_login.click()
+    return WebDriverWait(driver=driver, timeout=timeout).until(
+        any_of(login_page.maintenance, login_page.error, login_page.rerendered(submit_login), login_page.signed_in))
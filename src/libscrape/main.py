@@ -1,58 +1,154 @@
 #!/Users/cherise/Desktop/Code/Projects/LibraryScraper/env/bin/python3
 from library import TPL, WPL, PPL
-from selenium import webdriver
-from lib_assets import Messenger
+from lib_assets import MessagingSession
+from runner import run_jobs
+from resilience import BreakerRegistry, RetryPolicy
+from driver_pool import DriverPool, headless_chrome as create_driver
+from session_store import SESSION_KEY_VARIABLE, SessionStore
+from capture_profile import LEAN_PROFILE
+from outbox import DEFAULT_OUTBOX_PATH, BackgroundDelivery, Outbox
+from snapshot_store import DEFAULT_SNAPSHOT_PATH, SnapshotStore, add_account_snapshot
+import tracing
 from dotenv import load_dotenv
+from functools import partial
+import argparse
 import os
 
-def send_tpl_checkouts_and_holds_sms(phone_number, username, password):
-    options = webdriver.ChromeOptions()
-    options.add_argument('--no-sandbox')
-    options.add_argument('--window-size=1920,1080')
-    options.add_argument('--headless')
-    options.add_argument('--disable-gpu')
-    driver = webdriver.Chrome(options=options)
-    tpl = TPL(driver)
-    messenger = Messenger(tpl.name)
-    messenger.send_checkouts_text(phone_number, tpl.items_checked_out(username, password), "plain")
-    messenger.send_holds_text(phone_number, tpl.items_on_hold(username, password), "plain")
-    tpl.driver.close()
-
-def send_wpl_checkouts_and_holds_sms(phone_number, username, password):
-    options = webdriver.ChromeOptions()
-    options.add_argument('--no-sandbox')
-    options.add_argument('--window-size=1920,1080')
-    options.add_argument('--headless')
-    options.add_argument('--disable-gpu')
-    driver = webdriver.Chrome(options=options)
-    wpl = WPL(driver)
-    messenger = Messenger(wpl.name)
-    messenger.send_checkouts_text(phone_number, wpl.items_checked_out(username, password), "plain")
-    messenger.send_holds_text(phone_number, wpl.items_on_hold(username, password), "plain")
-    wpl.driver.close()
-
-def send_ppl_checkouts_and_holds_sms(phone_number, username, password):
-    options = webdriver.ChromeOptions()
-    options.add_argument('--no-sandbox')
-    options.add_argument('--window-size=1920,1080')
-    options.add_argument('--headless')
-    options.add_argument('--disable-gpu')
-    driver = webdriver.Chrome(options=options)
-    ppl = PPL(driver)
-    messenger = Messenger(ppl.name)
-    messenger.send_checkouts_text(phone_number, ppl.items_checked_out(username, password), "plain")
-    messenger.send_holds_text(phone_number, ppl.items_on_hold(username, password), "plain")
-    ppl.driver.close()
+
+def send_checkouts_and_holds_sms(library_obj, phone_number, username, password, messaging_session=None,
+                                 snapshot_store=None):
+    """
+    Snapshots an account and adds its checkouts and holds to the recipient's consolidated text in messaging_session,
+    or texts them at once without a session. With a snapshot_store, only what changed since the account's last
+    snapshot is added.
+    """
+    items = library_obj.snapshot(username, password)
+    session = messaging_session or MessagingSession()
+    add_account_snapshot(session, phone_number, library_obj.name, items, snapshot_store,
+                         type(library_obj).__name__.lower(), username)
+    if messaging_session is None:
+        session.send()
+    return items
+
+
+def send_tpl_checkouts_and_holds_sms(phone_number, username, password, driver=None, session_store=None,
+                                     capture_profile=None, messaging_session=None, snapshot_store=None):
+    tpl = TPL(driver or create_driver(capture_profile), session_store=session_store, capture_profile=capture_profile)
+    try:
+        return send_checkouts_and_holds_sms(tpl, phone_number, username, password, messaging_session,
+                                            snapshot_store)
+    finally:
+        if driver is None:
+            # quits the driver and the browser it started instead of only closing its window
+            tpl.close()
+
+
+def send_wpl_checkouts_and_holds_sms(phone_number, username, password, driver=None, session_store=None,
+                                     capture_profile=None, messaging_session=None, snapshot_store=None):
+    wpl = WPL(driver or create_driver(capture_profile), session_store=session_store, capture_profile=capture_profile)
+    try:
+        return send_checkouts_and_holds_sms(wpl, phone_number, username, password, messaging_session,
+                                            snapshot_store)
+    finally:
+        if driver is None:
+            wpl.close()
+
+
+def send_ppl_checkouts_and_holds_sms(phone_number, username, password, driver=None, session_store=None,
+                                     capture_profile=None, messaging_session=None, snapshot_store=None):
+    ppl = PPL(driver or create_driver(capture_profile), session_store=session_store, capture_profile=capture_profile)
+    try:
+        return send_checkouts_and_holds_sms(ppl, phone_number, username, password, messaging_session,
+                                            snapshot_store)
+    finally:
+        if driver is None:
+            ppl.close()
+
+
+SENDERS = {
+    "ppl": send_ppl_checkouts_and_holds_sms,
+    "wpl": send_wpl_checkouts_and_holds_sms,
+    "tpl": send_tpl_checkouts_and_holds_sms,
+}
+
+LIBRARY_CLASSES = {"ppl": PPL, "wpl": WPL, "tpl": TPL}
+
+
+def library_jobs(phone_number, systems=tuple(SENDERS), session_store=None, capture_profile=None,
+                 messaging_session=None, snapshot_store=None):
+    """
+    Returns the jobs that send the checkouts and holds of each library system, using the credentials in the
+    <SYSTEM>_USER and <SYSTEM>_PASS environment variables. The browsers skip the resources of capture_profile if given.
+    With a messaging_session, the jobs add the items to it instead of texting them, and the caller sends it. With a
+    snapshot_store, only the changes since the last run are added.
+    """
+    jobs = {}
+    for system in systems:
+        username = os.environ[system.upper() + '_USER']
+        password = os.environ[system.upper() + '_PASS']
+        jobs[system] = partial(SENDERS[system], phone_number, username, password, session_store=session_store,
+                               capture_profile=capture_profile, messaging_session=messaging_session,
+                               snapshot_store=snapshot_store)
+    return jobs
+
 
 if __name__ == "__main__":
     load_dotenv()
+    arg_parser = argparse.ArgumentParser(description="Text the checkouts and holds of every library account")
+    arg_parser.add_argument("--workers", type=int, default=int(os.environ.get('LIBSCRAPE_WORKERS', 3)),
+                            help="the number of libraries scraped at the same time")
+    arg_parser.add_argument("--lean", action="store_true", default=bool(os.environ.get('LIBSCRAPE_LEAN')),
+                            help="skip images, fonts and third-party scripts while loading pages")
+    arg_parser.add_argument("--trace", default=os.environ.get('LIBSCRAPE_TRACE'),
+                            help="write a Chrome trace of every phase of the run to this json file and print the time "
+                                 "spent in each phase")
+    arg_parser.add_argument("--outbox", default=os.environ.get('LIBSCRAPE_OUTBOX', DEFAULT_OUTBOX_PATH),
+                            help="the database the texts are queued in until they have been sent")
+    arg_parser.add_argument("--snapshots", default=os.environ.get('LIBSCRAPE_SNAPSHOTS', DEFAULT_SNAPSHOT_PATH),
+                            help="the json file of the last snapshot of every account, which changes are found with")
+    arg_parser.add_argument("--full", action="store_true", default=bool(os.environ.get('LIBSCRAPE_FULL_TEXTS')),
+                            help="text the full checkouts and holds instead of only what changed since the last run")
+    args = arg_parser.parse_args()
+    tracer = tracing.enable() if args.trace else None
+    profile = LEAN_PROFILE if args.lean else None
     receiving_phone_number = os.environ['PHONE_TO']
-    username = os.environ['PPL_USER']
-    password = os.environ['PPL_PASS']
-    send_ppl_checkouts_and_holds_sms(receiving_phone_number, username, password)
-    username = os.environ['WPL_USER']
-    password = os.environ['WPL_PASS']
-    send_wpl_checkouts_and_holds_sms(receiving_phone_number, username, password)
-    username = os.environ['TPL_USER']
-    password = os.environ['TPL_PASS']
-    send_tpl_checkouts_and_holds_sms(receiving_phone_number, username, password)
\ No newline at end of file
+    # signed in sessions are reused across runs when a session key is configured
+    sessions = SessionStore() if os.environ.get(SESSION_KEY_VARIABLE) else None
+    # the drivers are started once, in parallel, and lent to the jobs
+    # timeouts are retried with backoff, and a library that keeps timing out is reported once instead of retried
+    breakers = BreakerRegistry.for_sites()
+    # the items of every library and the outage notices are texted together at the end, through the outbox so that a
+    # slow or failing SMS API doesn't fail the run and texts that couldn't be sent are resumed by the next one
+    messaging = MessagingSession()
+    # only what changed since the last run is texted, and nothing if nothing changed
+    snapshots = None if args.full else SnapshotStore(args.snapshots)
+    with Outbox(args.outbox) as outbox:
+        # texts left over by an earlier run are sent while the libraries are scraped
+        delivery = BackgroundDelivery(outbox).start()
+        try:
+            with DriverPool(size=args.workers, driver_factory=partial(create_driver, profile),
+                            capture_profile=profile) as pool:
+                report = run_jobs(library_jobs(receiving_phone_number, session_store=sessions,
+                                               capture_profile=profile, messaging_session=messaging,
+                                               snapshot_store=snapshots),
+                                  workers=args.workers, driver_pool=pool, breakers=breakers, retry_policy=RetryPolicy())
+            print(report.summary())
+            if report.skipped_items:
+                print(f"{report.skipped_items} items were skipped because their layout is unknown, learn it from a "
+                      "saved page with lib_layouts.py")
+            for system, state in breakers.states().items():
+                if state != "closed" and breakers.notify_once(system, receiving_phone_number):
+                    library_name = LIBRARY_CLASSES[system].name
+                    messaging.add_text(receiving_phone_number, f"{library_name} isn't responding, your checkouts and "
+                                                               "holds will be sent on the next run.")
+        finally:
+            messaging.enqueue(outbox)
+            # the snapshots are only stored once their changes are queued, so a run that fails before reports them again
+            if snapshots is not None:
+                snapshots.save()
+            print(f"\nTexts: {delivery.finish().summary()}")
+    for failed in report.failed:
+        print(f"\n{failed.name} failed:\n{failed.traceback}")
+    if tracer is not None:
+        tracer.export_chrome_trace(args.trace)
+        print(f"\n{tracer.summary()}\n\nTrace written to {args.trace}")
@@ -0,0 +1,109 @@
+"""
+Library for sending texts through Twilio with as few connections and API calls as possible.
+
+- twilio_client returns one Twilio client per process and set of credentials. Its HTTP session keeps the connection to
+  the API open between messages, instead of every text opening a new client and connection.
+- pack_bodies packs the sections of a consolidated text into as few message bodies of at most MAX_BODY_LENGTH
+  characters as possible
+
+Set TWILIO_API_URL to send the messages to another server than the Twilio API (e.g. a twilio_stub.TwilioStub).
+"""
+
+import os
+import re
+import threading
+
+from twilio.http.http_client import TwilioHttpClient
+from twilio.rest import Client
+
+# the longest body the Messages API accepts
+MAX_BODY_LENGTH = 1600
+API_URL_VARIABLE = 'TWILIO_API_URL'
+TWILIO_URL = re.compile(r'^https://[a-z0-9.-]+\.twilio\.com')
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class RebasedHttpClient(TwilioHttpClient):
+    """
+    A pooled Twilio HTTP client that sends the requests meant for the Twilio API to another server
+
+    Attributes:
+      - base_url: the scheme, host and port of the server (e.g. "http://127.0.0.1:8001")
+    """
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(pool_connections=True, **kwargs)
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, url, *args, **kwargs):
+        return super().request(method, TWILIO_URL.sub(self.base_url, url), *args, **kwargs)
+
+
+def twilio_client(account_sid=None, auth_token=None, api_url=None):
+    """
+    Returns the Twilio client of this process, created the first time it is asked for. The credentials and the url
+    of the API default to the TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN and TWILIO_API_URL environment variables.
+
+    Returns
+    -------
+    twilio.rest.Client
+        A client whose connections to the API are kept open and shared by the threads of the process. A process
+        started with fork creates its own instead of sharing the connections of its parent.
+    """
+    account_sid = account_sid or os.environ['TWILIO_ACCOUNT_SID']
+    auth_token = auth_token or os.environ['TWILIO_AUTH_TOKEN']
+    api_url = api_url or os.environ.get(API_URL_VARIABLE)
+    key = (os.getpid(), account_sid, auth_token, api_url)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            http_client = RebasedHttpClient(api_url) if api_url else TwilioHttpClient(pool_connections=True)
+            client = _clients[key] = Client(account_sid, auth_token, http_client=http_client)
+    return client
+
+
+def pack_bodies(sections, limit=MAX_BODY_LENGTH, separator='\n\n'):
+    """
+    Packs the sections of a text into as few message bodies as possible, in order
+
+    Parameters
+    ----------
+    sections: str[]
+        The parts of the text (e.g. the checkouts of a library). A section is only split across bodies if it doesn't
+        fit in a body of its own, in which case it fills the bodies line by line (and a line longer than limit
+        character by character).
+    limit: int
+        The maximum number of characters of a body
+    separator: str
+        The text between two sections of a body
+    Returns
+    -------
+    str[]
+    """
+    bodies, body = [], ''
+    for section in sections:
+        section = section.strip('\n')
+        if not section:
+            continue
+        if len(section) <= limit:
+            if body and len(body) + len(separator) + len(section) <= limit:
+                body = f"{body}{separator}{section}"
+            else:
+                if body:
+                    bodies.append(body)
+                body = section
+            continue
+        joiner = separator
+        for line in section.split('\n'):
+            for part in [line[i:i + limit] for i in range(0, len(line), limit)] or ['']:
+                if body and len(body) + len(joiner) + len(part) > limit:
+                    bodies.append(body)
+                    body = part
+                else:
+                    body = f"{body}{joiner}{part}" if body else part
+                joiner = '\n'
+    if body:
+        bodies.append(body)
+    return bodies
@@ -0,0 +1,472 @@
+"""
+Library for delivering texts through a durable outbox, so that scraping doesn't wait for the SMS API and a crash
+doesn't lose a message. The scrape jobs enqueue rendered messages in a SQLite database. deliver drains it with a
+bounded pool of async senders, spaced by a rate limit per provider:
+
+- a message is claimed before it is sent, for a lease of a number of seconds. A message whose sender crashed is
+  claimed again once its lease has expired, so a restart resumes the sends that were pending or in flight.
+- transient errors (timeouts, refused connections, 429 and 5xx answers) are retried with the backoff of a
+  resilience.RetryPolicy. Other errors, and messages that run out of attempts, are marked failed.
+- every message has an idempotency key (by default a hash of its provider, recipient, body and the day it was
+  enqueued), so enqueueing the same message again, e.g. when a run is repeated after a crash, doesn't send it twice.
+  Delivery is at least once: a message whose sender crashed after the provider accepted it but before it was marked
+  sent is sent again.
+
+Usage:
+    outbox = Outbox()
+    outbox.enqueue("+15551234567", "Pickering Public Library CHECKOUTS ...")
+    stats = asyncio.run(deliver(outbox))
+
+    python outbox.py status
+    python outbox.py deliver --workers 4
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import requests
+from twilio.base.exceptions import TwilioRestException
+
+from messaging import twilio_client
+from resilience import RetryPolicy
+
+curr_path = os.path.dirname(__file__)
+# runtime state, kept out of the source tree with the -wal and -shm files SQLite writes next to it (see .gitignore)
+DEFAULT_OUTBOX_PATH = os.path.join(curr_path, 'state', 'outbox.sqlite3')
+DEFAULT_LEASE = 120  # seconds
+DEFAULT_WORKERS = 4
+# the number of messages per minute of each provider (a Twilio long code sends about one message a second)
+DEFAULT_RATES = {"twilio": 60}
+DEFAULT_RETRY_POLICY = RetryPolicy(attempts=5, base_delay=5.0, max_delay=300.0)
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    provider TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    claimed_until REAL,
+    provider_id TEXT,
+    last_error TEXT,
+    created REAL NOT NULL,
+    sent REAL
+);
+CREATE INDEX IF NOT EXISTS messages_due ON messages (status, next_attempt);
+"""
+
+
+def message_key(provider, recipient, body, day):
+    """
+    Returns the default idempotency key of a message enqueued on a day (a datetime.date), so that the same text is
+    sent at most once a day
+    """
+    return hashlib.sha256(f"{provider}\n{recipient}\n{day.isoformat()}\n{body}".encode('utf-8')).hexdigest()
+
+
+class OutboxMessage:
+    """
+    A message of the outbox
+
+    Attributes:
+      - id: the row id of the message
+      - key: the idempotency key of the message
+      - provider: the name of the provider that sends it (e.g. "twilio")
+      - recipient: the phone number it is sent to
+      - body: the text of the message
+      - status: PENDING, SENDING, SENT or FAILED
+      - attempts: the number of times it has been claimed for sending
+      - provider_id: the id the provider gave the message once it was sent (e.g. a Twilio message sid)
+      - last_error: the error of the last failed attempt
+    """
+
+    def __init__(self, id, key, provider, recipient, body, status, attempts=0, provider_id=None, last_error=None):
+        self.id = id
+        self.key = key
+        self.provider = provider
+        self.recipient = recipient
+        self.body = body
+        self.status = status
+        self.attempts = attempts
+        self.provider_id = provider_id
+        self.last_error = last_error
+
+    def __repr__(self):
+        return f"OutboxMessage({self.id}, {self.provider}, {self.recipient}, {self.status}, {self.attempts} attempts)"
+
+
+class Outbox:
+    """
+    A SQLite table of the messages to send. It can be shared by the threads of a process and by several processes.
+
+    Attributes:
+      - path: the path of the database file
+      - lease: the number of seconds a claimed message is reserved for its sender before it can be claimed again
+    """
+
+    COLUMNS = "id, idempotency_key, provider, recipient, body, status, attempts, provider_id, last_error"
+
+    def __init__(self, path=DEFAULT_OUTBOX_PATH, lease=DEFAULT_LEASE, clock=time.time):
+        self.path = path
+        self.lease = lease
+        self.clock = clock
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # transactions are begun explicitly, so that a claim reads and updates its message atomically
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def _execute(self, sql, parameters=()):
+        """
+        Runs a statement and returns the number of rows it changed
+        """
+        with self._lock:
+            return self._connection.execute(sql, parameters).rowcount
+
+    def _fetch(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def enqueue(self, recipient, body, provider="twilio", key=None):
+        """
+        Adds a message to the outbox unless a message with the same idempotency key is already in it
+
+        Parameters
+        ----------
+        recipient: str
+            The phone number of the recipient, starting with "+" and the country calling code
+        body: str
+            The text of the message
+        provider: str
+            The name of the provider that sends it, a key of the senders given to deliver
+        key: str
+            The idempotency key of the message. Defaults to message_key(provider, recipient, body, <today>).
+        Returns
+        -------
+        bool
+            True if the message was added, False if it was already in the outbox
+        """
+        now = self.clock()
+        key = key or message_key(provider, recipient, body, date.fromtimestamp(now))
+        added = self._execute("INSERT OR IGNORE INTO messages (idempotency_key, provider, recipient, body, status, "
+                              "next_attempt, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (key, provider, recipient, body, PENDING, now, now))
+        return added == 1
+
+    def claim(self):
+        """
+        Reserves the next message that is due for sending for the lease and counts the attempt
+
+        Returns
+        -------
+        OutboxMessage
+            The message, or None if no message is due
+        """
+        now = self.clock()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._connection.execute(
+                    f"SELECT {self.COLUMNS} FROM messages WHERE (status = ? AND next_attempt <= ?) OR "
+                    "(status = ? AND claimed_until <= ?) ORDER BY next_attempt, id LIMIT 1",
+                    (PENDING, now, SENDING, now)).fetchone()
+                if row is not None:
+                    self._connection.execute("UPDATE messages SET status = ?, attempts = attempts + 1, "
+                                             "claimed_until = ? WHERE id = ?", (SENDING, now + self.lease, row[0]))
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        message = OutboxMessage(*row)
+        message.status = SENDING
+        message.attempts += 1
+        return message
+
+    def mark_sent(self, message_id, provider_id=None):
+        self._execute("UPDATE messages SET status = ?, provider_id = ?, sent = ?, claimed_until = NULL WHERE id = ?",
+                      (SENT, provider_id, self.clock(), message_id))
+
+    def retry(self, message_id, error, delay):
+        """
+        Returns a claimed message to the outbox, to be sent again after delay seconds
+        """
+        self._execute("UPDATE messages SET status = ?, next_attempt = ?, last_error = ?, claimed_until = NULL "
+                      "WHERE id = ?", (PENDING, self.clock() + delay, repr(error), message_id))
+
+    def mark_failed(self, message_id, error):
+        self._execute("UPDATE messages SET status = ?, last_error = ?, claimed_until = NULL WHERE id = ?",
+                      (FAILED, repr(error), message_id))
+
+    def due_in(self):
+        """
+        Returns the number of seconds until the next unsent message is due (0 if one is due now), or None if every
+        message has been sent or has failed. A message in flight is due when its lease expires.
+        """
+        due = self._fetch("SELECT MIN(CASE WHEN status = ? THEN next_attempt ELSE claimed_until END) FROM messages "
+                          "WHERE status IN (?, ?)", (PENDING, PENDING, SENDING))[0][0]
+        if due is None:
+            return None
+        return max(0.0, due - self.clock())
+
+    def counts(self):
+        """
+        Returns the number of messages of each status, keyed by status
+        """
+        counts = {PENDING: 0, SENDING: 0, SENT: 0, FAILED: 0}
+        counts.update(self._fetch("SELECT status, COUNT(*) FROM messages GROUP BY status"))
+        return counts
+
+    def messages(self, status=None):
+        """
+        Returns the messages of a status, or every message, in the order they were enqueued
+        """
+        if status is None:
+            rows = self._fetch(f"SELECT {self.COLUMNS} FROM messages ORDER BY id")
+        else:
+            rows = self._fetch(f"SELECT {self.COLUMNS} FROM messages WHERE status = ? ORDER BY id", (status,))
+        return [OutboxMessage(*row) for row in rows]
+
+
+class TwilioSender:
+    """
+    Sends outbox messages with the pooled Twilio client of the process
+
+    Attributes:
+      - client: the Twilio client (defaults to messaging.twilio_client())
+      - from_: the phone number the messages are sent from (defaults to the PHONE_FROM environment variable)
+    """
+
+    def __init__(self, client=None, from_=None):
+        self.client = client
+        self.from_ = from_
+
+    def __call__(self, message):
+        """
+        Sends a message and returns the sid Twilio gave it
+        """
+        client = self.client or twilio_client()
+        return client.messages.create(body=message.body, from_=self.from_ or os.environ['PHONE_FROM'],
+                                      to=message.recipient).sid
+
+
+def transient(error):
+    """
+    Returns True if sending a message again later may succeed where it failed with error
+    """
+    if isinstance(error, TwilioRestException):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError))
+
+
+class ProviderRateLimiter:
+    """
+    Spaces the sends of each provider evenly to its number of messages per minute. Each call to wait reserves the next
+    free slot of its provider, like batch.RateLimiter does for sign-ins.
+
+    Attributes:
+      - rates: dict of the number of messages per minute keyed by provider
+      - rate: the number of messages per minute of a provider that isn't in rates, or None for no limit
+    """
+
+    def __init__(self, rates=None, rate=None):
+        self.rates = dict(DEFAULT_RATES if rates is None else rates)
+        self.rate = rate
+        self._slots = {}
+
+    async def wait(self, provider):
+        """
+        Waits for the provider's next free slot and returns the number of seconds waited
+        """
+        rate = self.rates.get(provider, self.rate)
+        if not rate:
+            return 0.0
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._slots.get(provider, 0.0))
+        self._slots[provider] = slot + 60.0 / rate
+        delay = slot - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+
+class DeliveryStats:
+    """
+    The outcome of draining an outbox
+
+    Attributes:
+      - sent: the number of messages sent
+      - retried: the number of failed attempts that were returned to the outbox to be retried
+      - failed: the number of messages marked failed
+      - seconds: the wall-clock time of the drain
+    """
+
+    def __init__(self):
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.seconds = 0.0
+
+    def summary(self):
+        return f"{self.sent} sent, {self.retried} retried, {self.failed} failed in {self.seconds:.2f}s"
+
+
+async def deliver(outbox, senders=None, workers=DEFAULT_WORKERS, rates=None, retry_policy=DEFAULT_RETRY_POLICY,
+                  until=None, poll_interval=1.0):
+    """
+    Sends the messages of an outbox with a bounded pool of async senders
+
+    Parameters
+    ----------
+    outbox: Outbox
+    senders: dict
+        The function that sends a message of each provider, keyed by provider. It is given the OutboxMessage, runs on
+        a worker thread and returns the id the provider gave the message. Defaults to a TwilioSender for "twilio".
+    workers: int
+        The maximum number of messages sent at the same time
+    rates: dict
+        The number of messages per minute of each provider (defaults to DEFAULT_RATES)
+    retry_policy: resilience.RetryPolicy
+        The number of attempts of a message and the backoff between them
+    until: threading.Event
+        Without an event, deliver returns once every message has been sent or has failed. With one, it keeps waiting
+        for new messages until the event is set and then returns once every message has been sent or has failed.
+    poll_interval: float
+        The maximum number of seconds a sender sleeps before looking for due messages again
+    Returns
+    -------
+    DeliveryStats
+    """
+    senders = senders if senders is not None else {"twilio": TwilioSender()}
+    limiter = ProviderRateLimiter(rates)
+    stats = DeliveryStats()
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+
+    async def sender(executor):
+        while True:
+            message = outbox.claim()
+            if message is None:
+                due_in = outbox.due_in()
+                if due_in is None and (until is None or until.is_set()):
+                    return
+                await asyncio.sleep(min(poll_interval, due_in) if due_in is not None else poll_interval)
+                continue
+            try:
+                send = senders[message.provider]
+                await limiter.wait(message.provider)
+                provider_id = await loop.run_in_executor(executor, send, message)
+            except Exception as error:
+                if transient(error) and message.attempts < retry_policy.attempts:
+                    outbox.retry(message.id, error, retry_policy.delay(message.attempts - 1))
+                    stats.retried += 1
+                else:
+                    outbox.mark_failed(message.id, error)
+                    stats.failed += 1
+            else:
+                outbox.mark_sent(message.id, provider_id)
+                stats.sent += 1
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="libscrape-outbox") as executor:
+        await asyncio.gather(*(sender(executor) for _ in range(workers)))
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+class BackgroundDelivery:
+    """
+    Runs deliver on a thread of its own while the caller keeps enqueueing messages, e.g. during a batch of scrapes
+
+    Usage:
+        with BackgroundDelivery(outbox) as delivery:
+            ...  # enqueue messages
+        print(delivery.stats.summary())
+
+    Attributes:
+      - outbox: the Outbox drained
+      - stats: the DeliveryStats of the drain once it has finished, None before
+    """
+
+    def __init__(self, outbox, **deliver_kwargs):
+        self.outbox = outbox
+        self.stats = None
+        self._deliver_kwargs = deliver_kwargs
+        self._done = threading.Event()
+        self._error = None
+        self._thread = None
+
+    def _run(self):
+        try:
+            self.stats = asyncio.run(deliver(self.outbox, until=self._done, **self._deliver_kwargs))
+        except BaseException as error:
+            self._error = error
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="libscrape-delivery", daemon=True)
+        self._thread.start()
+        return self
+
+    def finish(self):
+        """
+        Waits for every message enqueued so far to be sent or to fail, stops the senders and returns the DeliveryStats
+        """
+        self._done.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self.stats
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.finish()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("command", choices=("status", "deliver"))
+    arg_parser.add_argument("--path", default=DEFAULT_OUTBOX_PATH, help="the outbox database")
+    arg_parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                            help="the number of messages sent at the same time")
+    arg_parser.add_argument("--rate", type=float, default=DEFAULT_RATES["twilio"],
+                            help="the number of Twilio messages per minute")
+    args = arg_parser.parse_args()
+
+    with Outbox(args.path) as cli_outbox:
+        if args.command == "deliver":
+            from dotenv import load_dotenv
+            load_dotenv()
+            print(asyncio.run(deliver(cli_outbox, workers=args.workers, rates={"twilio": args.rate})).summary())
+        for status, count in cli_outbox.counts().items():
+            print(f"{status:<10}{count:>6}")
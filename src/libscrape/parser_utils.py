@@ -3,11 +3,14 @@ Library containing utility functions for logging data from web scraping activiti
 aid in debugging and testing.
 """
 
-from datetime import date
+from datetime import date, datetime
 import os
+import re
 
 curr_path = os.path.dirname(__file__)
 
+SAVED_PAGE_NAME = re.compile(r'^(?P<library>[a-z]+)-(?P<page>.+)-(?P<date>[A-Z][a-z]{2}-\d{2}-\d{4})\.(html|txt)$')
+
 
 def save_output_as_html(contents, title):
     """
@@ -41,3 +44,24 @@ def save_output_as_txt(contents, title):
     f = open(full_path, 'w', encoding='utf-8')
     f.write(contents)
     f.close()
+
+
+def parse_saved_page_name(file_name):
+    """
+    Splits the name of a file saved by save_output_as_html or save_output_as_txt into the library, the page and the
+    date it was saved on. For example, "wpl-holds-Jan-05-2022.html" is split into ("wpl", "holds", date(2022, 1, 5)).
+
+    Parameters
+    ----------
+    file_name: the name of the saved file
+
+    Returns
+    -------
+    A tuple of the library (str), the page (str) and the date (datetime.date) or None if the name wasn't generated by
+    save_output_as_html or save_output_as_txt
+    """
+    match = SAVED_PAGE_NAME.match(file_name)
+    if not match:
+        return None
+    saved_on = datetime.strptime(match.group('date'), "%b-%d-%Y").date()
+    return match.group('library'), match.group('page'), saved_on
@@ -0,0 +1,197 @@
+"""
+Re-parses an archive of saved holds and checkouts pages (see parser_utils.save_output_as_html) into Item records.
+Pages are parsed in parallel across a pool of processes and the items are streamed to a json lines file as each page
+finishes, one json object per item.
+
+Usage:
+    python reparse.py sample_pages/ --output items.jsonl [--workers 8] [--engine lxml]
+"""
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+
+from lib_extractor import set_default_engine
+from library import PPL, WPL, TPL
+from parser_utils import parse_saved_page_name
+
+LIBRARY_CLASSES = {"ppl": PPL, "wpl": WPL, "tpl": TPL}
+SYSTEMS = {"ppl": "durham", "wpl": "durham", "tpl": "toronto"}
+PAGES = ("holds", "checkouts")
+
+# text that identifies the library a page was saved from when its file name doesn't
+LIBRARY_MARKERS = (
+    ("pickering.bibliocommons.com", "ppl"),
+    ("whitby.bibliocommons.com", "wpl"),
+    ("torontopubliclibrary.ca", "tpl"),
+)
+# text that identifies a holds page (the first marker found wins)
+HOLDS_MARKERS = {
+    "ppl": ("Pick up at", "Cancel hold"),
+    "wpl": ("Pick up at", "Cancel hold"),
+    "tpl": ("holds-redux",),
+}
+
+# Durham Region libraries in the current worker process, created on first use since their layout tables are loaded
+# from disk
+_libraries = {}
+
+
+def detect_page(path, page_source):
+    """
+    Detects the library, the page and the date of a saved page. The file name is used if it was generated by
+    save_output_as_html, otherwise the page's content and modification time are used.
+
+    Parameters
+    ----------
+    path: str
+        The path of the saved page
+    page_source: str
+        Plain text html of the saved page
+    Returns
+    -------
+    (str, str, datetime.date)
+        The library ("ppl", "wpl", "tpl"), the page ("holds", "checkouts") and the date the page was saved on or None if
+        the page isn't a saved holds or checkouts page
+    """
+    page_info = parse_saved_page_name(os.path.basename(path))
+    if page_info is not None:
+        return page_info if page_info[0] in LIBRARY_CLASSES and page_info[1] in PAGES else None
+
+    library = next((library for marker, library in LIBRARY_MARKERS if marker in page_source), None)
+    if library is None:
+        return None
+    page = "holds" if any(marker in page_source for marker in HOLDS_MARKERS[library]) else "checkouts"
+    return library, page, date.fromtimestamp(os.path.getmtime(path))
+
+
+def parse_items(library, page, page_source):
+    """
+    Parses every item on a saved page
+
+    Parameters
+    ----------
+    library: str
+        The library the page was saved from ("ppl", "wpl", "tpl")
+    page: str
+        The kind of page ("holds", "checkouts")
+    page_source: str
+        Plain text html of the saved page
+    Returns
+    -------
+    Item[]
+    """
+    library_class = LIBRARY_CLASSES[library]
+    if library == "tpl":
+        if page == "holds":
+            return [TPL.parse_hold_data(lines) for lines in TPL.hold_data(page_source)]
+        return [TPL.parse_checkout_data(lines) for lines in TPL.checkout_data(page_source)]
+
+    library_obj = _libraries.get(library)
+    if library_obj is None:
+        library_obj = _libraries[library] = library_class()
+    if page == "holds":
+        return library_obj.parse_hold_data(library_class.hold_data(page_source))
+    return library_obj.parse_checkout_data(library_class.checkout_data(page_source))
+
+
+def reparse_page(path):
+    """
+    Parses a saved page into json serializable item records. Runs in the worker processes.
+
+    Parameters
+    ----------
+    path: str
+        The path of the saved page
+    Returns
+    -------
+    (str, dict[], str)
+        The path, the item records and an error message (None if the page was parsed). The records of a page that
+        isn't a saved holds or checkouts page are None.
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            page_source = f.read()
+        page_info = detect_page(path, page_source)
+        if page_info is None:
+            return path, None, None
+        library, page, saved_on = page_info
+        records = []
+        for item in parse_items(library, page, page_source):
+            # the items were retrieved on the day the page was saved, not today
+            item.date_retrieved = saved_on
+            record = item.to_dict()
+            record["library"] = library
+            record["page"] = os.path.basename(path)
+            records.append(record)
+        return path, records, None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def saved_pages(page_dir):
+    """
+    Returns the paths of every html file in page_dir and its subdirectories, sorted by path
+    """
+    paths = []
+    for dir_path, _, file_names in os.walk(page_dir):
+        paths.extend(os.path.join(dir_path, file_name) for file_name in file_names if file_name.endswith('.html'))
+    return sorted(paths)
+
+
+def reparse(page_dir, output, workers=None, engine=None):
+    """
+    Re-parses every saved page in page_dir across a pool of processes and writes the items to output as json lines
+    in the order the pages finish
+
+    Parameters
+    ----------
+    page_dir: str
+        The directory of saved pages
+    output: file-like object
+        The text stream the json lines are written to
+    workers: int
+        The number of worker processes. Defaults to the number of CPUs.
+    engine: str
+        The name of the extraction engine the workers use ("soup", "lxml"). Uses the global default if not given.
+    Returns
+    -------
+    dict
+        The number of "pages" parsed, "items" written and pages "skipped", and the "errors" of each page that failed
+        keyed by path
+    """
+    summary = {"pages": 0, "items": 0, "skipped": 0, "errors": {}}
+    initializer, initargs = (set_default_engine, (engine,)) if engine else (None, ())
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        futures = [executor.submit(reparse_page, path) for path in saved_pages(page_dir)]
+        for future in as_completed(futures):
+            path, records, error = future.result()
+            if error is not None:
+                summary["errors"][path] = error
+            elif records is None:
+                summary["skipped"] += 1
+            else:
+                summary["pages"] += 1
+                summary["items"] += len(records)
+                for record in records:
+                    output.write(json.dumps(record) + '\n')
+    return summary
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("page_dir", help="the directory of saved pages")
+    arg_parser.add_argument("--output", default="items.jsonl", help="the json lines file the items are written to")
+    arg_parser.add_argument("--workers", type=int, default=None, help="the number of worker processes")
+    arg_parser.add_argument("--engine", default=None, help="the extraction engine to use (soup, lxml)")
+    args = arg_parser.parse_args()
+
+    with open(args.output, 'w', encoding='utf-8') as out:
+        result = reparse(args.page_dir, out, args.workers, args.engine)
+    for failed_path, message in sorted(result["errors"].items()):
+        print(f"{failed_path}: {message}", file=sys.stderr)
+    print(f"{result['items']} items from {result['pages']} pages written to {args.output} "
+          f"({result['skipped']} skipped, {len(result['errors'])} failed)")
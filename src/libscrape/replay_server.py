@@ -0,0 +1,411 @@
+"""
+A local stand-in for the account and hours pages of a library system, for testing the scrapers offline. The server
+serves a login form with the same inputs as the live site, signs in its configured accounts with a session cookie and
+replays saved holds and checkouts pages (see parser_utils.save_output_as_html) to signed in clients. It also serves the
+hours pages the hours scrapers load. Pages that haven't been saved are generated from built-in items.
+
+Every response can be delayed (latency) and a share of them can be answered with a server error (error_rate), so that
+load tests can measure accounts per minute and how failures are handled. Point the HTTP backend at the server with
+HttpBackend(server.site), or the Selenium flow with PPL(driver, account_url=server.base_url, site_url=server.base_url).
+
+Usage:
+    python replay_server.py ppl --port 8000 --page-dir sample_pages --username patron --password secret
+    python replay_server.py ppl --load-test 50 --workers 4 --latency 0.2 --error-rate 0.05
+"""
+
+import argparse
+import glob
+import os
+import random
+import re
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+
+from http_backend import SITES, HttpBackend
+from library import PPL, TPL, WPL
+from runner import run_jobs
+from synthetic_pages import SAMPLE_PAGES, built_in_page, find_fixture
+
+LOGIN_FORMS = {
+    "durham": '<html><head><title>Log In | {library} | BiblioCommons</title></head><body>'
+              '{error}<form id="loginForm" action="{action}" method="post">'
+              '<input type="hidden" name="authenticity_token" value="{token}">'
+              '<input type="text" testid="field_username" name="name">'
+              '<input type="password" testid="field_userpin" name="user_pin">'
+              '<input type="submit" testid="button_login" value="Log In">'
+              '</form></body></html>',
+    "tpl": '<html><head><title>Sign In : {library}</title></head><body>'
+           '{error}<form id="form_signin" action="{action}" method="post">'
+           '<input type="hidden" name="csrfToken" value="{token}">'
+           '<input type="text" id="userID" name="userId">'
+           '<input type="password" id="password" name="password">'
+           '<div><button type="submit">Sign In</button></div>'
+           '</form></body></html>',
+}
+LIBRARY_NAMES = {"ppl": "Pickering Public Library", "wpl": "Whitby Public Library", "tpl": "Toronto Public Library"}
+# the banners shown above a login form that was submitted with a wrong password
+LOGIN_ERRORS = {
+    "durham": '<div class="cp-alert" role="alert">The username or PIN you entered is incorrect.</div>',
+    "tpl": '<div class="alert alert-danger">The card number or PIN you entered is invalid.</div>',
+}
+# the titles the scrapers wait for, keyed by (system, page)
+PAGE_TITLES = {
+    ("ppl", "holds"): "On Hold | Pickering Public Library | BiblioCommons",
+    ("ppl", "checkouts"): "Checked Out | Pickering Public Library | BiblioCommons",
+    ("wpl", "holds"): "On Hold | Whitby Public Library | BiblioCommons",
+    ("wpl", "checkouts"): "Checked Out | Whitby Public Library | BiblioCommons",
+    ("tpl", "holds"): "Holds : Toronto Public Library",
+    ("tpl", "checkouts"): "Checkouts : Toronto Public Library",
+}
+# the paths the library classes load besides the ones of their HttpSite, keyed by system
+EXTRA_PAGE_PATHS = {"ppl": {"/checkedout": "checkouts"}, "wpl": {}, "tpl": {}}
+EXTRA_LOGIN_PATHS = {"ppl": (), "wpl": (), "tpl": ("/login",)}
+HOURS_PATHS = {"ppl": ("/locations/PC/", "/locations/CL/"), "wpl": ("/hours",), "tpl": ("/branches/",)}
+# the query parameter the login page redirects to after signing in
+DESTINATION_PARAMS = {"ppl": "destination", "wpl": "destination", "tpl": "redirect"}
+
+BUILT_IN_HOURS = {
+    "ppl": '<html><head><title>Central Library | Pickering Public Library</title></head><body>'
+           '<div class="c-hours-and-info__hours-wrapper">\nHours\n\nMonday \n9:30AM - 9:00PM\n\nTuesday \n'
+           '9:30AM - 9:00PM\n\nWednesday \n9:30AM - 9:00PM\n\nThursday \n9:30AM - 9:00PM\n\nFriday \n9:30AM - 9:00PM'
+           '\n\nSaturday \n9:30AM - 4:30PM\n\nSunday \nClosed\n</div></body></html>',
+    "wpl": '<html><head><title>Hours | Whitby Public Library</title></head><body><div class="content clearfix">\n'
+           'Hours\nCentral Library\n405 Dundas Street West, Whitby, ON, L1N 6A1\n905-668-6531\n'
+           'Monday–Thursday 9:30 a.m.–9:00 p.m.\nFriday 9:30 a.m.–6:00 p.m.\nSaturday 9:00 a.m.–5:00 p.m.\n'
+           'Sunday Closed\n\nBrooklin Branch\n8 Vipond Road, Brooklin, ON, L1M 1B3\n905-655-3191\n'
+           'Monday–Thursday 9:30 a.m.–8:30 p.m.\nFriday 9:30 a.m.–6:00 p.m.\nSaturday 9:00 a.m.–5:00 p.m.\n'
+           'Sunday Closed\nRossland Branch\n701 Rossland Road East, Whitby, ON, L1N 8Y9\n'
+           'Monday–Thursday 9:30 a.m.–8:30 p.m.\nFriday 9:30 a.m.–6:00 p.m.\nSaturday 9:00 a.m.–5:00 p.m.\n'
+           'Sunday Closed\n</div></body></html>',
+    "tpl": '<html><head><title>Branches : Toronto Public Library</title></head><body><div class="branches">'
+           '<a name="alphaIndex-A"></a><div class="row"><h2>Agincourt</h2>\n<p>155 Bonis Ave.</p>\n'
+           '<p>Monday</p>\n<p>9:00 am</p>\n<p>to</p>\n<p>8:30 pm</p>\n</div>'
+           '<a name="alphaIndex-M"></a><div class="row"><h2>Malvern</h2>\n<p>30 Sewells Road</p>\n'
+           '<p>Monday</p>\n<p>9:00 am</p>\n<p>to</p>\n<p>8:30 pm</p>\n</div></div></body></html>',
+}
+SESSION_COOKIE = "replay_session"
+LIBRARY_CLASSES = {"ppl": PPL, "wpl": WPL, "tpl": TPL}
+
+
+def saved_pages(system, page_dir=SAMPLE_PAGES, num_items=5):
+    """
+    Returns the html of the holds, checkouts and hours pages to replay for a library system: the most recently saved
+    page of each kind in page_dir, or a built-in page (with num_items items on the holds and checkouts pages) if none
+    was saved
+
+    Returns
+    -------
+    dict
+        The html of the holds page under "holds", of the checkouts page under "checkouts" and of the hours page under
+        "hours"
+    """
+    pages = {}
+    for page in ("holds", "checkouts"):
+        fixture_path = find_fixture(system, page, page_dir) if page_dir else None
+        if fixture_path:
+            with open(fixture_path, encoding='utf-8') as f:
+                pages[page] = f.read()
+        else:
+            pages[page] = built_in_page(system, page, num_items)
+    # the hours pages are saved as e.g. "ppl-cn-hours-Jan-13-2022.html"
+    hours_paths = glob.glob(os.path.join(page_dir, f"{system}-*hours-*.html")) if page_dir else []
+    if hours_paths:
+        with open(max(hours_paths, key=os.path.getmtime), encoding='utf-8') as f:
+            pages["hours"] = f.read()
+    else:
+        pages["hours"] = BUILT_IN_HOURS[system]
+    return pages
+
+
+def with_title(page_source, title):
+    """
+    Returns the page with its title replaced, so that replayed pages have the title the scrapers wait for
+    """
+    return re.sub(r"<title>.*?</title>", lambda _: f"<title>{title}</title>", page_source, count=1,
+                  flags=re.S | re.I)
+
+
+class ReplayServer:
+    """
+    A local server that stands in for the account and hours pages of a library system
+
+    Attributes:
+      - site: the HttpSite of the library system, rebased onto this server once it has started
+      - accounts: dict of the password of every account keyed by username
+      - pages: the html of the "holds", "checkouts" and "hours" pages
+      - latency: the number of seconds every response is delayed, or the (min, max) of a random delay
+      - error_rate: the share of requests that are answered with error_status instead of their page
+      - error_status: the HTTP status of an injected error
+      - requests: the (method, path) of every request served
+      - errors: the number of errors injected
+      - connections: the number of connections clients opened
+    """
+
+    def __init__(self, system, username="patron", password="secret", pages=None, host="127.0.0.1", port=0,
+                 accounts=None, latency=0, error_rate=0.0, error_status=503, seed=None):
+        self.site = SITES[system]
+        self.accounts = dict(accounts or {})
+        self.accounts[username] = password
+        self.pages = pages if pages is not None else saved_pages(system)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = []
+        self.errors = 0
+        self.connections = 0
+        self._rng = random.Random(seed)
+        self._token = secrets.token_hex(16)
+        self._sessions = set()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="replay-server", daemon=True)
+        self._thread.start()
+        self.site = self.site.rebased(self.base_url)
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.stop()
+
+    def _delay(self):
+        """
+        Returns the number of seconds to delay a response and whether to answer it with an injected error
+        """
+        with self._lock:
+            latency = self._rng.uniform(*self.latency) if isinstance(self.latency, tuple) else self.latency
+            failed = self.error_rate > 0 and self._rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        return latency, failed
+
+    def _login_form(self, action, rejected=False):
+        kind = "tpl" if self.site.system == "tpl" else "durham"
+        return LOGIN_FORMS[kind].format(library=LIBRARY_NAMES[self.site.system], action=action, token=self._token,
+                                        error=LOGIN_ERRORS[kind] if rejected else "")
+
+    def _page(self, page):
+        title = PAGE_TITLES.get((self.site.system, page))
+        return with_title(self.pages[page], title) if title else self.pages[page]
+
+    def _sign_in(self, form):
+        username_field, password_field = ("userId", "password") if self.site.system == "tpl" else ("name", "user_pin")
+        token_field = "csrfToken" if self.site.system == "tpl" else "authenticity_token"
+        username = form.get(username_field)
+        if form.get(token_field) != self._token or username not in self.accounts or \
+                form.get(password_field) != self.accounts[username]:
+            return None
+        session = secrets.token_hex(16)
+        with self._lock:
+            self._sessions.add(session)
+        return session
+
+    def _destination(self, query):
+        """
+        Returns the local path the login page redirects to after signing in, which is the holds page unless the query
+        string names another page of this server
+        """
+        values = parse_qs(query).get(DESTINATION_PARAMS[self.site.system])
+        destination = values[0] if values else ""
+        if destination.startswith("/") and not destination.startswith("//"):
+            return destination
+        return self.site.holds_path
+
+    def _handler_class(self):
+        server = self
+        system = self.site.system
+        login_paths = (urlsplit(self.site.login_path).path,) + EXTRA_LOGIN_PATHS[system]
+        page_paths = {self.site.holds_path: "holds", self.site.checkouts_path: "checkouts"}
+        page_paths.update(EXTRA_PAGE_PATHS[system])
+        hours_paths = HOURS_PATHS[system]
+
+        class ReplayHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keeps connections alive between requests
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def signed_in(self):
+                for cookie in self.headers.get("Cookie", "").split(";"):
+                    name, _, value = cookie.strip().partition("=")
+                    if name == SESSION_COOKIE and value in server._sessions:
+                        return True
+                return False
+
+            def send(self, status, body="", headers=()):
+                payload = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def redirect(self, location, headers=()):
+                self.send(302, headers=[("Location", location)] + list(headers))
+
+            def injected(self, method, path):
+                """
+                Records the request, delays it and answers it with an error if one is injected
+                """
+                server.requests.append((method, path))
+                latency, failed = server._delay()
+                if latency:
+                    time.sleep(latency)
+                if failed:
+                    self.send(server.error_status, "Service unavailable")
+                return failed
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if self.injected("GET", url.path):
+                    return
+                if url.path in login_paths:
+                    if self.signed_in():
+                        self.redirect(server._destination(url.query))
+                    else:
+                        self.send(200, server._login_form(self.path))
+                elif url.path in page_paths:
+                    if self.signed_in():
+                        self.send(200, server._page(page_paths[url.path]))
+                    else:
+                        self.redirect(f"{login_paths[0]}?{DESTINATION_PARAMS[system]}={quote(url.path, safe='')}")
+                elif url.path in hours_paths:
+                    self.send(200, server.pages["hours"])
+                else:
+                    self.send(404, "Not found")
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode('utf-8')
+                if self.injected("POST", url.path):
+                    return
+                if url.path not in login_paths:
+                    self.send(404, "Not found")
+                    return
+                form = {name: values[0] for name, values in parse_qs(body, keep_blank_values=True).items()}
+                session = server._sign_in(form)
+                if session is None:
+                    self.send(200, server._login_form(self.path, rejected=True))
+                else:
+                    self.redirect(server._destination(url.query),
+                                  [("Set-Cookie", f"{SESSION_COOKIE}={session}; Path=/; HttpOnly")])
+
+        return ReplayHandler
+
+
+def load_test(server, num_accounts, workers=4, driver_factory=None, driver_pool=None):
+    """
+    Takes a snapshot of num_accounts accounts of a running replay server concurrently. The accounts are added to the
+    server as "patron0", "patron1", ... with the password "secret".
+
+    Parameters
+    ----------
+    server: ReplayServer
+        A started server
+    num_accounts: int
+        The number of accounts to snapshot
+    workers: int
+        The maximum number of snapshots taken at the same time
+    driver_factory: function
+        A function without arguments that returns a new WebDriver, to run the Selenium flow of the library class
+        against the server. The pages are fetched with an HttpBackend if neither it nor driver_pool is given.
+    driver_pool: driver_pool.DriverPool
+        A pool the drivers of the Selenium flow are borrowed from instead
+    Returns
+    -------
+    runner.RunReport
+        The report of every snapshot keyed by username
+    """
+    library_class = LIBRARY_CLASSES[server.site.system]
+    selenium = driver_factory is not None or driver_pool is not None
+
+    def snapshot(username):
+        def job(driver):
+            if selenium:
+                library = library_class(driver, account_url=server.base_url, site_url=server.base_url)
+                return library.snapshot(username, "secret")
+            backend = HttpBackend(server.site)
+            try:
+                return library_class().parse_snapshot(*backend.snapshot_pages(username, "secret"))
+            finally:
+                backend.close()
+        return job
+
+    usernames = [f"patron{i}" for i in range(num_accounts)]
+    server.accounts.update({username: "secret" for username in usernames})
+    return run_jobs({username: snapshot(username) for username in usernames}, workers, driver_factory, driver_pool)
+
+
+def accounts_per_minute(report):
+    """
+    Returns the number of accounts a load test snapshotted successfully per minute
+    """
+    succeeded = len(report.results) - len(report.failed)
+    return succeeded / report.seconds * 60 if report.seconds else 0.0
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("system", choices=sorted(SITES))
+    arg_parser.add_argument("--port", type=int, default=8000)
+    arg_parser.add_argument("--page-dir", default=SAMPLE_PAGES, help="the directory of saved pages to replay")
+    arg_parser.add_argument("--username", default="patron")
+    arg_parser.add_argument("--password", default="secret")
+    arg_parser.add_argument("--latency", type=float, nargs='+', default=[0.0],
+                            help="the seconds every response is delayed, or the min and max of a random delay")
+    arg_parser.add_argument("--error-rate", type=float, default=0.0,
+                            help="the share of requests answered with a 503 error")
+    arg_parser.add_argument("--seed", type=int, help="the seed of the random latency and errors")
+    arg_parser.add_argument("--load-test", type=int, metavar="ACCOUNTS",
+                            help="snapshot this many accounts against the server and report accounts per minute")
+    arg_parser.add_argument("--workers", type=int, default=4, help="the number of concurrent snapshots of a load test")
+    arg_parser.add_argument("--selenium", action="store_true",
+                            help="run the load test through headless Chrome instead of the HTTP backend")
+    args = arg_parser.parse_args()
+
+    latency = args.latency[0] if len(args.latency) == 1 else tuple(args.latency[:2])
+    replay = ReplayServer(args.system, args.username, args.password, saved_pages(args.system, args.page_dir),
+                          port=0 if args.load_test else args.port, latency=latency, error_rate=args.error_rate,
+                          seed=args.seed)
+    if args.load_test:
+        factory = None
+        if args.selenium:
+            from driver_pool import headless_chrome
+            factory = headless_chrome
+        with replay:
+            load_report = load_test(replay, args.load_test, args.workers, driver_factory=factory)
+        print(load_report.summary())
+        print(f"{accounts_per_minute(load_report):.1f} accounts/min, {replay.errors} errors injected, "
+              f"{len(replay.requests)} requests")
+    else:
+        print(f"Replaying {args.system} at {replay.base_url} (Ctrl+C to stop)")
+        try:
+            replay._server.serve_forever()
+        except KeyboardInterrupt:
+            replay._server.server_close()
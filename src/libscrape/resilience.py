@@ -0,0 +1,274 @@
+"""
+Library for retrying transient failures and failing fast while a library site is down.
+
+- RetryPolicy retries transient errors (timeouts, refused connections) with exponential backoff and full jitter, so
+  the accounts of a batch don't retry a struggling site in lockstep
+- a CircuitBreaker per library system opens after a number of consecutive transient failures. While it is open, calls
+  fail at once with CircuitOpenError instead of waiting out their WebDriverWait timeouts. Once reset_timeout has
+  passed, the site is probed (with a cheap HTTP request if the breaker has a probe, or by letting one call through)
+  and the circuit closes again if the probe succeeds
+- BreakerRegistry holds the breakers of every system. Its state can be shared with worker processes through a
+  multiprocessing Manager and read by the runners to skip a library that is down and to notify users about it once
+"""
+
+import random
+import threading
+import time
+
+import requests
+from selenium.common.exceptions import TimeoutException
+
+from http_backend import SITES
+from login_outcome import MaintenanceError
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# errors that are expected to go away when the request is repeated later
+TRANSIENT_ERRORS = (TimeoutException, requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError,
+                    MaintenanceError)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a library system whose circuit is open
+
+    Attributes:
+      - system: the library system (e.g. "ppl")
+      - retry_at: the time.time() at which the system will be probed again
+    """
+
+    def __init__(self, system, retry_at):
+        retry_time = time.strftime('%H:%M:%S', time.localtime(retry_at))
+        super().__init__(f"{system} is failing, calls are skipped until it is probed again at {retry_time}")
+        self.system = system
+        self.retry_at = retry_at
+
+    def __reduce__(self):
+        return CircuitOpenError, (self.system, self.retry_at)
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: the delay before retry n is a random number of seconds between 0 and
+    min(max_delay, base_delay * multiplier ** n)
+
+    Attributes:
+      - attempts: the maximum number of calls, including the first
+      - base_delay: the upper bound in seconds of the delay before the first retry
+      - max_delay: the upper bound in seconds of every delay
+      - multiplier: the factor the upper bound grows by after every retry
+      - transient_errors: the exception types that are retried. Other errors are raised at once.
+    """
+
+    def __init__(self, attempts=3, base_delay=1.0, max_delay=30.0, multiplier=2.0, transient_errors=TRANSIENT_ERRORS,
+                 sleep=time.sleep, rng=None):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.transient_errors = transient_errors
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+
+    def delay(self, retry):
+        """
+        Returns a random number of seconds to wait before a retry, where retry is 0 for the first retry
+        """
+        return self.rng.uniform(0, min(self.max_delay, self.base_delay * self.multiplier ** retry))
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls func until it succeeds, raises an error that isn't transient or runs out of attempts
+        """
+        for attempt in range(self.attempts):
+            try:
+                return func(*args, **kwargs)
+            except self.transient_errors:
+                if attempt + 1 >= self.attempts:
+                    raise
+            self.sleep(self.delay(attempt))
+
+
+NO_RETRIES = RetryPolicy(attempts=1)
+
+
+class HttpProbe:
+    """
+    A probe that succeeds if a url answers without a server error
+
+    Attributes:
+      - url: the url requested
+      - timeout: the number of seconds to wait for the answer
+    """
+
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+
+    def __call__(self):
+        response = requests.head(self.url, timeout=self.timeout, allow_redirects=True)
+        return response.status_code < 500
+
+
+class CircuitBreaker:
+    """
+    The circuit of one library system. Use BreakerRegistry.breaker to create one.
+
+    Attributes:
+      - system: the library system (e.g. "ppl")
+      - failure_threshold: the number of consecutive transient failures that open the circuit
+      - reset_timeout: the number of seconds the circuit stays open before the system is probed
+      - probe: a function without arguments that returns True if the system is up again, or None to probe it by
+        letting the next call through
+    """
+
+    def __init__(self, system, registry, failure_threshold, reset_timeout, probe=None):
+        self.system = system
+        self.registry = registry
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe = probe
+
+    def _get(self):
+        return self.registry._states.get(self.system, (CLOSED, 0, 0.0))
+
+    def _set(self, state, failures, opened_at):
+        self.registry._states[self.system] = (state, failures, opened_at)
+
+    @property
+    def state(self):
+        return self._get()[0]
+
+    @property
+    def retry_at(self):
+        state, _, opened_at = self._get()
+        return opened_at + self.reset_timeout if state != CLOSED else None
+
+    def rejecting(self):
+        """
+        Returns True if the circuit is open and won't be probed yet, without changing its state
+        """
+        state, _, opened_at = self._get()
+        return state != CLOSED and self.registry.clock() < opened_at + self.reset_timeout
+
+    def allow(self):
+        """
+        Returns True if a call may be made now. An open circuit is probed once reset_timeout has passed: it closes if
+        the probe succeeds and stays open for another reset_timeout if it fails. Without a probe, one call is let
+        through (half-open) and its outcome decides. If that call hasn't reported its outcome within reset_timeout
+        (e.g. its process was killed), another call is let through in its place.
+        """
+        with self.registry._lock:
+            state, failures, opened_at = self._get()
+            if state == CLOSED:
+                return True
+            now = self.registry.clock()
+            if now < opened_at + self.reset_timeout:
+                return False
+            if self.probe is None:
+                # opened_at of a half-open circuit is when its trial call was let through, so a trial that is still
+                # running has been refused above
+                self._set(HALF_OPEN, failures, now)
+                return True
+            # claim the probe so that other callers keep failing fast while it runs
+            self._set(OPEN, failures, now)
+        try:
+            up = self.probe()
+        except Exception:
+            up = False
+        if up:
+            self.record_success()
+        return up
+
+    def record_success(self):
+        with self.registry._lock:
+            self._set(CLOSED, 0, 0.0)
+            for key in [key for key in self.registry._states.keys() if key.startswith(f"notified:{self.system}:")]:
+                self.registry._states.pop(key, None)
+
+    def record_failure(self):
+        with self.registry._lock:
+            state, failures, opened_at = self._get()
+            failures += 1
+            if state == HALF_OPEN or failures >= self.failure_threshold:
+                self._set(OPEN, failures, self.registry.clock())
+            else:
+                self._set(state, failures, opened_at)
+
+    def call(self, func, *args, retry_policy=NO_RETRIES, **kwargs):
+        """
+        Calls func through the circuit, retrying transient errors with retry_policy. Raises CircuitOpenError without
+        calling func if the circuit is open, including between retries.
+        """
+        for attempt in range(retry_policy.attempts):
+            if not self.allow():
+                raise CircuitOpenError(self.system, self.retry_at)
+            try:
+                result = func(*args, **kwargs)
+            except retry_policy.transient_errors:
+                self.record_failure()
+                if attempt + 1 >= retry_policy.attempts:
+                    raise
+            except Exception:
+                # the site answered, so the error says nothing about whether it is up
+                self.record_success()
+                raise
+            else:
+                self.record_success()
+                return result
+            retry_policy.sleep(retry_policy.delay(attempt))
+
+
+class BreakerRegistry:
+    """
+    The circuit breakers of every library system
+
+    Attributes:
+      - failure_threshold: the number of consecutive transient failures that open a circuit
+      - reset_timeout: the number of seconds a circuit stays open before its system is probed
+      - probes: dict of the probe of each library system (see CircuitBreaker.probe)
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=300, probes=None, manager=None, clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probes = dict(probes or {})
+        self.clock = clock
+        # (state, consecutive failures, time opened) keyed by system, shared with other processes through the manager
+        self._states = manager.dict() if manager is not None else {}
+        self._lock = manager.Lock() if manager is not None else threading.RLock()
+
+    @classmethod
+    def for_sites(cls, failure_threshold=3, reset_timeout=300, manager=None):
+        """
+        Returns a registry that probes each library system with an HTTP request to its account site
+        """
+        probes = {system: HttpProbe(site.base_url) for system, site in SITES.items()}
+        return cls(failure_threshold, reset_timeout, probes, manager)
+
+    def breaker(self, system):
+        return CircuitBreaker(system, self, self.failure_threshold, self.reset_timeout, self.probes.get(system))
+
+    def call(self, system, func, *args, retry_policy=NO_RETRIES, **kwargs):
+        return self.breaker(system).call(func, *args, retry_policy=retry_policy, **kwargs)
+
+    def states(self):
+        """
+        Returns the state ("closed", "open" or "half-open") of every system that has been called, keyed by system
+        """
+        with self._lock:
+            return {system: value[0] for system, value in self._states.items() if not system.startswith("notified:")}
+
+    def notify_once(self, system, recipient=""):
+        """
+        Returns True the first time it is called for a system whose circuit is open and a recipient, so that each user
+        is told about an outage once rather than once per account or run. Resets when the circuit closes.
+        """
+        key = f"notified:{system}:{recipient}"
+        with self._lock:
+            if self.breaker(system).state == CLOSED or self._states.get(key):
+                return False
+            self._states[key] = True
+            return True
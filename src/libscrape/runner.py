@@ -0,0 +1,169 @@
+"""
+Library for running scraping jobs for several libraries concurrently. Every job runs on a worker thread with its own
+WebDriver, which is created when the job starts and quit when it ends (or borrowed from a driver pool and returned with
+a cleared session), so the jobs never share browser state. A job that fails is recorded with its error and does not
+stop the other jobs. Transient errors can be retried and a library that is down can be skipped with the circuit
+breakers of resilience.py.
+"""
+
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from resilience import NO_RETRIES
+
+
+class JobResult:
+    """
+    The outcome of a single job
+
+    Attributes:
+      - name: the name of the job (e.g. "ppl")
+      - value: the value returned by the job, or None if it failed
+      - error: the exception raised by the job, or None if it succeeded
+      - traceback: the formatted traceback of the error, or None if the job succeeded
+      - seconds: the wall-clock time the job took, including starting and quitting its driver
+      - skipped_items: the number of items the job's snapshot skipped because their layout is unknown (see
+        lib_layouts), 0 if the job didn't return a snapshot
+    """
+
+    def __init__(self, name, value=None, error=None, traceback=None, seconds=0.0):
+        self.name = name
+        self.value = value
+        self.error = error
+        self.traceback = traceback
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def skipped_items(self):
+        return self.value.get("skipped_items", 0) if isinstance(self.value, dict) else 0
+
+    def __repr__(self):
+        status = "ok" if self.ok else f"failed: {self.error!r}"
+        return f"JobResult({self.name}, {status}, {self.seconds:.2f}s)"
+
+
+class RunReport:
+    """
+    The outcome of a run of jobs
+
+    Attributes:
+      - results: dict of JobResult keyed by job name, in the order the jobs were given
+      - seconds: the wall-clock time of the whole run
+    """
+
+    def __init__(self, results, seconds):
+        self.results = results
+        self.seconds = seconds
+
+    @property
+    def failed(self):
+        return [result for result in self.results.values() if not result.ok]
+
+    @property
+    def skipped_items(self):
+        return sum(result.skipped_items for result in self.results.values())
+
+    def summary(self):
+        """
+        Returns a plain text table of the time, the number of skipped items and the outcome of every job followed by
+        the totals of the run
+        """
+        lines = [f"{'job':<12}{'time (s)':>10}{'skipped':>9}  status"]
+        for result in self.results.values():
+            status = "ok" if result.ok else f"failed: {type(result.error).__name__}: {result.error}"
+            lines.append(f"{result.name:<12}{result.seconds:>10.2f}{result.skipped_items:>9}  {status}")
+        lines.append(f"{'total':<12}{self.seconds:>10.2f}{self.skipped_items:>9}  "
+                     f"{len(self.results) - len(self.failed)}/{len(self.results)} jobs succeeded")
+        return '\n'.join(lines)
+
+
+def run_job(name, job, driver_factory, driver_pool=None, breakers=None, retry_policy=NO_RETRIES):
+    """
+    Runs a job with a driver of its own and records its outcome
+
+    Parameters
+    ----------
+    name: str
+        The name of the job, which is also the library system its circuit breaker is looked up by
+    job: function
+        A function that takes a WebDriver (or None if there is no driver_factory) and does the job's work
+    driver_factory: function
+        A function without arguments that returns a new WebDriver, or None if the job doesn't need a driver
+    driver_pool: driver_pool.DriverPool
+        A pool the job's driver is borrowed from instead of starting one with driver_factory
+    breakers: resilience.BreakerRegistry
+        The circuit breakers the job runs through. A job whose library is down fails at once with CircuitOpenError,
+        without starting a driver.
+    retry_policy: resilience.RetryPolicy
+        How transient errors are retried. Every attempt gets a fresh (or freshly cleared) driver.
+    Returns
+    -------
+    JobResult
+    """
+    start = time.perf_counter()
+    result = JobResult(name)
+
+    def attempt():
+        driver = None
+        try:
+            if driver_pool is not None:
+                driver = driver_pool.acquire()
+            elif driver_factory is not None:
+                driver = driver_factory()
+            return job(driver)
+        finally:
+            try:
+                if driver is not None and driver_pool is not None:
+                    driver_pool.release(driver)
+                elif driver is not None:
+                    driver.quit()
+            except Exception:
+                pass
+
+    try:
+        if breakers is not None:
+            result.value = breakers.call(name, attempt, retry_policy=retry_policy)
+        else:
+            result.value = retry_policy.call(attempt)
+    except Exception as e:
+        result.error = e
+        result.traceback = traceback.format_exc()
+    finally:
+        result.seconds = time.perf_counter() - start
+    return result
+
+
+def run_jobs(jobs, workers=None, driver_factory=None, driver_pool=None, breakers=None, retry_policy=NO_RETRIES):
+    """
+    Runs the jobs concurrently, each with its own WebDriver
+
+    Parameters
+    ----------
+    jobs: dict
+        Functions that take a WebDriver keyed by the name of the job (e.g. {"ppl": ..., "wpl": ..., "tpl": ...})
+    workers: int
+        The maximum number of jobs that run at the same time. Defaults to one worker per job.
+    driver_factory: function
+        A function without arguments that returns a new WebDriver (e.g. main.create_driver). Each job gets its own.
+    driver_pool: driver_pool.DriverPool
+        A pool each job borrows its driver from instead of starting one with driver_factory
+    breakers: resilience.BreakerRegistry
+        The circuit breakers of the library systems, looked up by job name
+    retry_policy: resilience.RetryPolicy
+        How the transient errors of each job are retried
+    Returns
+    -------
+    RunReport
+    """
+    start = time.perf_counter()
+    workers = workers or max(len(jobs), 1)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="libscrape-job") as executor:
+        futures = {name: executor.submit(run_job, name, job, driver_factory, driver_pool, breakers, retry_policy)
+                   for name, job in jobs.items()}
+        results = {name: future.result() for name, future in futures.items()}
+    return RunReport(results, time.perf_counter() - start)
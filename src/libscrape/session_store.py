@@ -0,0 +1,176 @@
+"""
+Library for persisting authenticated browser sessions across runs. After a successful login the cookies of the session
+are encrypted with Fernet and stored on disk per (system, account). The next run injects them into a fresh driver and
+only falls back to the login form when the stored session has expired.
+
+The encryption key is read from the LIBSCRAPE_SESSION_KEY environment variable. A new key is printed by:
+
+    python session_store.py generate-key
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+from cryptography.fernet import Fernet, InvalidToken
+
+curr_path = os.path.dirname(__file__)
+# runtime state, kept out of the source tree (see .gitignore)
+DEFAULT_SESSION_DIR = os.path.join(curr_path, 'state', 'sessions')
+SESSION_KEY_VARIABLE = 'LIBSCRAPE_SESSION_KEY'
+DEFAULT_MAX_AGE = 24 * 60 * 60  # one day in seconds
+
+
+class SessionStore:
+    """
+    An encrypted on-disk store of browser cookies keyed by (system, account)
+
+    Attributes:
+      - directory: the directory the sessions are stored in, one encrypted file per (system, account)
+      - max_age: the number of seconds a stored session is trusted before the login form is used again
+    """
+
+    def __init__(self, directory=DEFAULT_SESSION_DIR, key=None, max_age=DEFAULT_MAX_AGE, clock=time.time):
+        key = key or os.environ.get(SESSION_KEY_VARIABLE)
+        if not key:
+            raise ValueError(f"Set {SESSION_KEY_VARIABLE} to a key from 'python session_store.py generate-key' to "
+                             "store sessions")
+        self.directory = directory
+        self.max_age = max_age
+        self.clock = clock
+        self._fernet = Fernet(key)
+
+    @staticmethod
+    def generate_key():
+        return Fernet.generate_key().decode('ascii')
+
+    def _path(self, system, account):
+        # the account name is hashed so that it doesn't appear in the file name
+        digest = hashlib.sha256(f"{system}/{account}".encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{system}-{digest[:32]}.session")
+
+    def save(self, system, account, cookies):
+        """
+        Encrypts and stores the cookies of a signed in session
+
+        Parameters
+        ----------
+        system: str
+            The library system the account belongs to (e.g. "ppl", "wpl", "tpl")
+        account: str
+            The username of the account
+        cookies: dict[]
+            The cookies of the session (see all_cookies)
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        token = self._fernet.encrypt(json.dumps({"saved": self.clock(), "cookies": cookies}).encode('utf-8'))
+        path = self._path(system, account)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(token)
+        os.replace(tmp_path, path)
+
+    def load(self, system, account):
+        """
+        Returns the stored cookies of an account, or None if there is no stored session, it is older than max_age or it
+        can't be decrypted with the current key. Cookies that have expired are left out.
+
+        Parameters
+        ----------
+        system: str
+            The library system the account belongs to (e.g. "ppl", "wpl", "tpl")
+        account: str
+            The username of the account
+        Returns
+        -------
+        dict[]
+        """
+        try:
+            with open(self._path(system, account), 'rb') as f:
+                session = json.loads(self._fernet.decrypt(f.read()))
+        except (OSError, InvalidToken, ValueError):
+            return None
+        now = self.clock()
+        if now - session["saved"] >= self.max_age:
+            return None
+        cookies = [cookie for cookie in session["cookies"] if cookie.get("expiry", now + 1) > now]
+        return cookies or None
+
+    def discard(self, system, account):
+        """
+        Deletes the stored session of an account (e.g. after the site rejected it)
+        """
+        try:
+            os.remove(self._path(system, account))
+        except FileNotFoundError:
+            pass
+
+
+def all_cookies(driver):
+    """
+    Returns the cookies of every domain the driver has visited. Uses the Chrome DevTools Protocol, since
+    driver.get_cookies only returns the cookies of the current domain, and falls back to it for other drivers.
+
+    Parameters
+    ----------
+    driver: selenium.webdriver.Chrome
+    Returns
+    -------
+    dict[]
+        Cookies in the format of driver.get_cookies
+    """
+    try:
+        cdp_cookies = driver.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]
+    except Exception:
+        return driver.get_cookies()
+    cookies = []
+    for cdp_cookie in cdp_cookies:
+        cookie = {"name": cdp_cookie["name"], "value": cdp_cookie["value"], "domain": cdp_cookie["domain"],
+                  "path": cdp_cookie.get("path", "/"), "secure": cdp_cookie.get("secure", False),
+                  "httpOnly": cdp_cookie.get("httpOnly", False)}
+        if not cdp_cookie.get("session") and cdp_cookie.get("expires", -1) > 0:
+            cookie["expiry"] = int(cdp_cookie["expires"])
+        if cdp_cookie.get("sameSite"):
+            cookie["sameSite"] = cdp_cookie["sameSite"]
+        cookies.append(cookie)
+    return cookies
+
+
+def inject_cookies(driver, cookies):
+    """
+    Adds cookies to a driver without loading their sites first. Uses the Chrome DevTools Protocol and falls back to
+    loading each cookie's domain and calling driver.add_cookie for other drivers.
+
+    Parameters
+    ----------
+    driver: selenium.webdriver.Chrome
+    cookies: dict[]
+        Cookies in the format of driver.get_cookies
+    """
+    cdp_cookies = []
+    for cookie in cookies:
+        cdp_cookie = {"name": cookie["name"], "value": cookie["value"], "domain": cookie["domain"],
+                      "path": cookie.get("path", "/"), "secure": cookie.get("secure", False),
+                      "httpOnly": cookie.get("httpOnly", False)}
+        if "expiry" in cookie:
+            cdp_cookie["expires"] = cookie["expiry"]
+        if "sameSite" in cookie:
+            cdp_cookie["sameSite"] = cookie["sameSite"]
+        cdp_cookies.append(cdp_cookie)
+    try:
+        driver.execute_cdp_cmd("Network.setCookies", {"cookies": cdp_cookies})
+    except Exception:
+        for domain in sorted({cookie["domain"] for cookie in cookies}):
+            driver.get("https://" + domain.lstrip('.') + "/")
+            for cookie in cookies:
+                if cookie["domain"] == domain:
+                    driver.add_cookie(cookie)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["generate-key"]:
+        print(SessionStore.generate_key())
+    else:
+        print(__doc__)
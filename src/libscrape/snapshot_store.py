@@ -0,0 +1,344 @@
+"""
+Library for texting only what changed in an account since its last run. The items of each (system, account) are kept
+in a json file with a hash per item. A new snapshot is diffed against the stored one in linear time and classified
+into changes: holds placed, ready or removed, items checked out, renewed or returned, due dates moved and checkouts
+that became due soon or overdue. An account whose items haven't changed gets no text at all.
+
+Items have no ids on the account pages, so an item is identified by whether it is a hold, its title, format and
+contributors. Several copies of the same item are matched in the order they are listed.
+
+A snapshot that loses all or most of the items of the last one is more likely a page that didn't load than an account
+that returned everything at once. It isn't stored or texted until a second run in a row sees the same drop. Likewise,
+the items missing from a snapshot that skipped some items (see lib_layouts) aren't taken for returned or removed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from lib_assets import Item
+
+curr_path = os.path.dirname(__file__)
+# runtime state, kept out of the source tree (see .gitignore)
+DEFAULT_SNAPSHOT_PATH = os.path.join(curr_path, 'state', 'snapshots.json')
+
+logger = logging.getLogger(__name__)
+
+# the kinds of changes, in the order they are listed in a text
+HOLD_READY = "ready for pickup"
+NOW_OVERDUE = "overdue"
+NOW_DUE_SOON = "due soon"
+DUE_DATE_MOVED = "due date moved"
+RENEWED = "renewed"
+CHECKED_OUT = "checked out"
+RETURNED = "returned"
+HOLD_PLACED = "hold placed"
+HOLD_REMOVED = "hold removed"
+HOLD_UPDATED = "hold updated"
+CHANGE_KINDS = (HOLD_READY, NOW_OVERDUE, NOW_DUE_SOON, DUE_DATE_MOVED, RENEWED, CHECKED_OUT, RETURNED, HOLD_PLACED,
+                HOLD_REMOVED, HOLD_UPDATED)
+# the changes worth a text. A hold that changed without becoming ready (e.g. its expiry date) isn't.
+NOTIFY_KINDS = frozenset(CHANGE_KINDS) - {HOLD_UPDATED}
+
+DUE_SOON_STATUSES = ("Due Soon", "Due Today", "Due Tomorrow")
+DATE_FORMATS = ("%b. %d, %Y", "%b %d, %Y", "%B %d, %Y", "%a %d %b", "%d %b")
+RELATIVE_DAYS = {"yesterday": -1, "today": 0, "tomorrow": 1}
+
+# a snapshot with fewer than this share of the items of an account of at least MIN_DROP_ITEMS items is a sharp drop
+MIN_KEPT_FRACTION = 0.5
+MIN_DROP_ITEMS = 4
+# the number of runs in a row that must see a sharp drop before it is taken for real
+CONFIRM_DROP_RUNS = 2
+
+
+def item_identity(item):
+    return item.is_hold, item.title, item.item_format, item.contributors
+
+
+def item_hash(item):
+    """
+    Returns the sha256 hex digest of the fields of an item, without the date it was retrieved
+    """
+    fields = item.to_dict()
+    fields.pop("date_retrieved")
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def item_from_dict(fields):
+    """
+    Returns the Item of a dict written by Item.to_dict
+    """
+    fields = dict(fields)
+    if fields.get("system") == 'toronto' and (fields.get("contributors") or "").startswith("by "):
+        fields["contributors"] = fields["contributors"][3:]  # Item adds the "by " of Toronto items again
+    if isinstance(fields.get("date_retrieved"), str):
+        try:
+            fields["date_retrieved"] = date.fromisoformat(fields["date_retrieved"])
+        except ValueError:
+            pass
+    return Item(**fields)
+
+
+def is_ready(status):
+    status = (status or "").lower()
+    return "ready" in status and "not ready" not in status
+
+
+def parse_item_date(text, date_retrieved=None):
+    """
+    Returns the date of an item date as the pages show it ("Jan. 13, 2024", "Sat 16 Oct", "Tomorrow"), or None if it
+    can't be read. Dates without a year are taken to be in the year they were retrieved.
+    """
+    text = (text or "").strip()
+    today = date_retrieved if isinstance(date_retrieved, date) else date.today()
+    if text.lower() in RELATIVE_DAYS:
+        return today + timedelta(days=RELATIVE_DAYS[text.lower()])
+    for date_format in DATE_FORMATS:
+        try:
+            parsed = datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+        if "%Y" not in date_format:
+            parsed = parsed.replace(year=today.year)
+        return parsed.date()
+    return None
+
+
+class Change:
+    """
+    A change of an account since its last snapshot
+
+    Attributes:
+      - kind: one of CHANGE_KINDS
+      - item: the item as it is now, or as it was for RETURNED and HOLD_REMOVED
+      - previous: the item as it was, or None for items that are new or gone
+    """
+
+    def __init__(self, kind, item, previous=None):
+        self.kind = kind
+        self.item = item
+        self.previous = previous
+
+    def __repr__(self):
+        return f"Change({self.kind!r}, {self.item.title!r})"
+
+
+def classify(item, previous):
+    """
+    Returns the kind of change of an item that is in both snapshots but whose hash changed
+    """
+    if item.is_hold:
+        return HOLD_READY if is_ready(item.status) and not is_ready(previous.status) else HOLD_UPDATED
+    if item.status == "Overdue" and previous.status != "Overdue":
+        return NOW_OVERDUE
+    if item.item_date != previous.item_date:
+        due = parse_item_date(item.item_date, item.date_retrieved)
+        previous_due = parse_item_date(previous.item_date, previous.date_retrieved)
+        if due is not None and previous_due is not None and due == previous_due:
+            pass  # the same date written relative to another day (e.g. "Tomorrow", then "Today")
+        elif due is not None and previous_due is not None and due > previous_due:
+            return RENEWED
+        else:
+            return DUE_DATE_MOVED
+    if item.status in DUE_SOON_STATUSES and previous.status not in DUE_SOON_STATUSES:
+        return NOW_DUE_SOON
+    return None
+
+
+def diff_items(previous, current, previous_hashes=None):
+    """
+    Returns the changes between two snapshots of an account, in linear time
+
+    Parameters
+    ----------
+    previous: Item[]
+        The items of the last snapshot
+    current: Item[]
+        The items of the new snapshot
+    previous_hashes: str[]
+        The item_hash of every item of previous, if they are stored
+    Returns
+    -------
+    Change[]
+        Sorted by the order of CHANGE_KINDS, then by the order of the items
+    """
+    previous_hashes = previous_hashes or [item_hash(item) for item in previous]
+    unmatched = {}
+    for item, digest in zip(previous, previous_hashes):
+        unmatched.setdefault(item_identity(item), []).append((item, digest))
+    changes = []
+    for item in current:
+        matches = unmatched.get(item_identity(item))
+        if not matches:
+            changes.append(Change(HOLD_PLACED if item.is_hold else CHECKED_OUT, item))
+            continue
+        previous_item, digest = matches.pop(0)
+        if digest == item_hash(item):
+            continue
+        kind = classify(item, previous_item)
+        if kind is not None:
+            changes.append(Change(kind, item, previous_item))
+    for matches in unmatched.values():
+        for previous_item, _ in matches:
+            changes.append(Change(HOLD_REMOVED if previous_item.is_hold else RETURNED, previous_item))
+    order = {kind: i for i, kind in enumerate(CHANGE_KINDS)}
+    return sorted(changes, key=lambda change: order[change.kind])
+
+
+def is_sharp_drop(previous_count, current_count):
+    """
+    Returns True if a snapshot of current_count items lost all of the previous_count items of the last snapshot, or
+    most of them
+    """
+    if previous_count and not current_count:
+        return True
+    return previous_count >= MIN_DROP_ITEMS and current_count < previous_count * MIN_KEPT_FRACTION
+
+
+def notable(changes, kinds=NOTIFY_KINDS):
+    """
+    Returns the changes worth a text
+    """
+    return [change for change in changes if change.kind in kinds]
+
+
+class SnapshotStore:
+    """
+    A persistent store of the last snapshot of every account keyed by (system, account)
+
+    Attributes:
+      - path: the path of the json file the snapshots are stored in
+      - clock: a function that returns the current time in seconds since the epoch
+      - entries: dict of entries keyed by "system/<hash of the account>". Each entry holds the "items" of the
+        snapshot (see Item.to_dict), their "hashes", the time it was "updated" and, while newer snapshots are held
+        back as sharp drops, how many runs in a row have seen one ("drops").
+    """
+
+    def __init__(self, path=DEFAULT_SNAPSHOT_PATH, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self.entries = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def key(system, account):
+        # the account name is hashed so that library card numbers aren't stored in the file
+        return f"{system}/{hashlib.sha256(account.encode('utf-8')).hexdigest()[:32]}"
+
+    def get(self, system, account):
+        """
+        Returns the items of the last snapshot of an account, or None if it has none
+        """
+        entry = self.entries.get(self.key(system, account))
+        if entry is None:
+            return None
+        return [item_from_dict(fields) for fields in entry["items"]]
+
+    def update(self, system, account, items):
+        """
+        Stores the new snapshot of an account and returns its changes since the last one. The file isn't written
+        until save is called, so that a run that stops before its texts are queued reports the same changes again.
+
+        Parameters
+        ----------
+        system: str
+            The library system of the account (e.g. "ppl", "wpl", "tpl")
+        account: str
+            The username of the account
+        items: dict
+            The Item[] of holds under "holds", the Item[] of checkouts under "checkouts" and the number of items
+            skipped because their layout is unknown under "skipped_items" (see PPL.snapshot)
+        Returns
+        -------
+        Change[]
+            The changes, or None if the account had no snapshot yet. A sharp drop in the number of items (see
+            is_sharp_drop) has no changes and the last snapshot is kept, unless the last CONFIRM_DROP_RUNS runs all
+            saw it. A snapshot that skipped items has no returned or removed items: the items it is missing are kept
+            until a snapshot without skipped items.
+        """
+        current = list(items["holds"]) + list(items["checkouts"])
+        hashes = [item_hash(item) for item in current]
+        changes = None
+        with self._lock:
+            entry = self.entries.get(self.key(system, account))
+            if entry is not None and items.get("skipped_items"):
+                # an item skipped because its layout is unknown isn't gone, so the items missing from the snapshot
+                # are kept as they were instead of being reported returned or removed
+                changes = diff_items([item_from_dict(fields) for fields in entry["items"]], current, entry["hashes"])
+                gone = [change.item for change in changes if change.kind in (RETURNED, HOLD_REMOVED)]
+                changes = [change for change in changes if change.kind not in (RETURNED, HOLD_REMOVED)]
+                current += gone
+                hashes += [item_hash(item) for item in gone]
+                logger.info("Keeping %d items of a %s account that are missing from a snapshot that skipped %d items",
+                            len(gone), system, items["skipped_items"])
+            elif entry is not None and is_sharp_drop(len(entry["items"]), len(current)) and \
+                    entry.get("drops", 0) + 1 < CONFIRM_DROP_RUNS:
+                entry["drops"] = entry.get("drops", 0) + 1
+                logger.warning("Holding back the snapshot of a %s account with %d of its %d items until the next run",
+                               system, len(current), len(entry["items"]))
+                return []
+            self.entries[self.key(system, account)] = {"items": [item.to_dict() for item in current],
+                                                       "hashes": hashes, "updated": self.clock()}
+        if entry is None:
+            return None
+        if changes is not None:
+            return changes
+        return diff_items([item_from_dict(fields) for fields in entry["items"]], current, entry["hashes"])
+
+    def save(self):
+        """
+        Writes the store to its json file. The file is replaced atomically so that a crash never leaves it half
+        written.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+                f.write('\n')
+            os.replace(tmp_path, self.path)
+
+
+def add_account_snapshot(messaging_session, phone_number, region, items, snapshot_store=None, system=None,
+                         account=None):
+    """
+    Adds a new snapshot of an account to a recipient's next message in a lib_assets.MessagingSession: only its notable
+    changes if the snapshot store has an earlier snapshot of the account (nothing if none), its full checkouts and
+    holds otherwise
+
+    Parameters
+    ----------
+    messaging_session: lib_assets.MessagingSession
+    phone_number: str
+        The phone number of the recipient, starting with "+" and the country calling code
+    region: str
+        The name of the library (e.g. "Pickering Public Library")
+    items: dict
+        The Item[] of holds under "holds" and the Item[] of checkouts under "checkouts" (see PPL.snapshot)
+    snapshot_store: SnapshotStore
+        The store of the last snapshots, or None to always add the full lists
+    system: str
+        The library system of the account (e.g. "ppl", "wpl", "tpl")
+    account: str
+        The username of the account
+    Returns
+    -------
+    Change[]
+        The notable changes added, or None if the full lists were added
+    """
+    changes = snapshot_store.update(system, account, items) if snapshot_store is not None else None
+    if changes is None:
+        messaging_session.add_items(phone_number, region, items["checkouts"], items["holds"])
+        return None
+    changes = notable(changes)
+    messaging_session.add_changes(phone_number, region, changes)
+    return changes
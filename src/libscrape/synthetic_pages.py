@@ -0,0 +1,191 @@
+"""
+Library for generating synthetic holds and checkouts pages of any size for offline benchmarks. A synthetic page is
+grown from the items of a saved fixture page (e.g. sample_pages/wpl-holds-Jan-05-2022.html) when one exists, and
+otherwise from built-in items scraped from the live sites. The items are repeated until the page holds the requested
+number of items, so the extraction engines produce the same lines for every copy of an item.
+"""
+
+import copy
+import glob
+import html
+import os
+
+import lxml.html
+
+from library import PPL, WPL, TPL
+
+curr_path = os.path.dirname(__file__)
+SAMPLE_PAGES = os.path.join(curr_path, 'sample_pages')
+
+PAGE_SELECTORS = {
+    ("ppl", "holds"): PPL.HOLD_SELECTOR,
+    ("ppl", "checkouts"): PPL.CHECKOUT_SELECTOR,
+    ("wpl", "holds"): WPL.HOLD_SELECTOR,
+    ("wpl", "checkouts"): WPL.CHECKOUT_SELECTOR,
+    ("tpl", "holds"): TPL.HOLD_SELECTOR,
+    ("tpl", "checkouts"): TPL.CHECKOUT_SELECTOR,
+}
+
+DURHAM_HOLD_ITEMS = [
+    ['Select. Item 1. Why Do We Fight?.', 'Why Do We Fight?', 'Why Do We Fight?, Book', 'Conflict, War, and Peace',
+     'by ', 'Walker, Niki', 'Book', ' - ', '2013', 'Book, 2013. Language: English', '\xa0', 'View details',
+     'View details for Why Do We Fight?, Book, ', 'Not ready', '#1', ' on 1 copies', 'Pick up at ', 'Central Library',
+     'Expires on ', 'Jan. 13, 2024', 'Pause hold', 'Cancel hold', 'For Later', 'Placed on ', 'Jan. 13, 2022'],
+    ['Select. Item 2. France.', 'France', 'France, DVD', 'DVD', ' - ', '2002', 'DVD, 2002. Language: English', '\xa0',
+     'View details', 'View details for France, DVD, ', 'Not ready', '#1', ' on 1 copies', 'Pick up at ',
+     'Central Library', 'Expires on ', 'Oct. 09, 2022', 'Pause hold', 'Cancel hold', 'For Later', 'Placed on ',
+     'Jan. 12, 2022'],
+    ['Select. Item 3. Rated R.', 'Rated R', 'Rated R, Music CD', 'by ', 'Rihanna', 'Music CD', ' - ', '2009',
+     'Music CD, 2009. Language: English', '\xa0', 'View details', 'View details for Rated R, Music CD, ', 'Not ready',
+     '#1', ' on 1 copies', 'Pick up at ', 'Central Library', 'Expires on ', 'Oct. 09, 2022', 'Pause hold',
+     'Cancel hold', 'For Later', 'Placed on ', 'Jan. 12, 2022'],
+]
+DURHAM_CHECKOUT_ITEMS = [
+    ['Select. Item 1. My Life in Full.', 'My Life in Full', 'My Life in Full, Book', 'Work, Family, and Our Future',
+     'by ', 'Nooyi, Indra K.', 'Book', ' - ', '2021', 'Book, 2021. Language: English',
+     'You have not rated this title. Rate this title', 'Rate this', 'Due later', '6 days  remaining ', 'Due by ',
+     'Jan. 11, 2022', '2 people waiting', 'Renew', 'In Progress', 'Add ', 'My Life in Full', 'Book', ' ', 'by ',
+     'Nooyi, Indra K.', ' to your in progress shelf'],
+    ['Select. Item 2. This Is Glenn Gould - Story of A Genius.', 'This Is Glenn Gould - Story of A Genius',
+     'This Is Glenn Gould - Story of A Genius, Music CD', 'by ', 'Bach, Johann Sebastian', 'Music CD', ' - ', '2012',
+     'Music CD, 2012. Language: English', 'You have not rated this title. Rate this title', 'Rate this', 'Due later',
+     '21 days  remaining ', 'Due by ', 'Jan. 26, 2022', 'Renewed', ' ', '5 times', 'Renew'],
+]
+TPL_HOLD_ITEMS = [
+    [' ', ' ', 'Modern Java in action : lambda, streams, functional and reactive programming',
+     'Urma, Raoul-Gabriel, author.', 'Book', 'North York Central Library', 'Pick up by', 'Thu 6 Jan', '(',
+     '7 Days Left', ')', 'Cancel'],
+]
+TPL_CHECKOUT_ITEMS = [
+    [' ', 'How to win : 36 ancient strategies for success', ' ', 'How to win : 36 ancient strategies for success',
+     'Wong, Eva, author.', 'Book', '37131 214 228 918', 'Mon 24 Jan', '1', 'Renew'],
+    [' ', 'Hinduism', ' ', 'Hinduism', 'Sen, Kshitimohan, author.', 'Book', '37131 212 560 387', 'Tue 25 Jan', '2',
+     'Renew'],
+]
+
+# the markup around the item containers of each kind of page. {items} is replaced by the item containers.
+PAGE_TEMPLATES = {
+    "durham": '<html><head><title>Library</title></head><body><div class="cp-item-list">'
+              '<div class="cp-batch-actions-list">{items}</div></div></body></html>',
+    ("tpl", "holds"): '<html><head><title>Holds</title></head><body><div id="PageContent">'
+                      '<div class="holds-redux ready-for-pickup"><div><div><table>{items}</table></div></div></div>'
+                      '</div></body></html>',
+    ("tpl", "checkouts"): '<html><head><title>Checkouts</title></head><body><div id="PageContent">{items}</div>'
+                          '</body></html>',
+}
+ITEM_TEMPLATES = {
+    "durham": '<div class="cp-batch-actions-list-item">{lines}</div>',
+    ("tpl", "holds"): '<tbody><tr><td>{lines}</td></tr></tbody>',
+    ("tpl", "checkouts"): '<div class="item-wrapper">{lines}</div>',
+}
+BUILT_IN_ITEMS = {
+    ("ppl", "holds"): DURHAM_HOLD_ITEMS,
+    ("ppl", "checkouts"): DURHAM_CHECKOUT_ITEMS,
+    ("wpl", "holds"): DURHAM_HOLD_ITEMS,
+    ("wpl", "checkouts"): DURHAM_CHECKOUT_ITEMS,
+    ("tpl", "holds"): TPL_HOLD_ITEMS,
+    ("tpl", "checkouts"): TPL_CHECKOUT_ITEMS,
+}
+
+
+def find_fixture(library, page, page_dir=SAMPLE_PAGES):
+    """
+    Returns the path of the most recently saved fixture page of a library, or None if there is none
+
+    Parameters
+    ----------
+    library: str
+        The library the page is from ("ppl", "wpl", "tpl")
+    page: str
+        The kind of page ("holds", "checkouts")
+    page_dir: str
+        The directory of saved pages
+    Returns
+    -------
+    str
+    """
+    paths = glob.glob(os.path.join(page_dir, f"{library}-{page}-*.html"))
+    return max(paths, key=os.path.getmtime) if paths else None
+
+
+def built_in_page(library, page, num_items):
+    """
+    Returns a page with num_items items repeated from the built-in items of a library
+
+    Parameters
+    ----------
+    library: str
+        The library the page is from ("ppl", "wpl", "tpl")
+    page: str
+        The kind of page ("holds", "checkouts")
+    num_items: int
+        The number of items on the page
+    Returns
+    -------
+    str
+    """
+    key = (library, page) if library == "tpl" else "durham"
+    templates = [ITEM_TEMPLATES[key].format(lines=''.join(f'<span>{html.escape(line)}</span>' for line in lines))
+                 for lines in BUILT_IN_ITEMS[(library, page)]]
+    items = ''.join(templates[i % len(templates)] for i in range(num_items))
+    return PAGE_TEMPLATES[key].format(items=items)
+
+
+def grown_page(fixture_path, selector, num_items):
+    """
+    Returns a fixture page with its item containers repeated until the page holds num_items items, or None if the
+    fixture has no items
+
+    Parameters
+    ----------
+    fixture_path: str
+        The path of the saved page
+    selector: str
+        The CSS selector of the item containers
+    num_items: int
+        The number of items on the page
+    Returns
+    -------
+    str
+    """
+    with open(fixture_path, encoding='utf-8') as f:
+        root = lxml.html.document_fromstring(f.read().encode('utf-8'))
+    items = root.cssselect(selector)
+    if not items:
+        return None
+    parent = items[0].getparent()
+    position = parent.index(items[0])
+    for item in items:
+        item.getparent().remove(item)
+    for i in range(num_items):
+        clone = copy.deepcopy(items[i % len(items)])
+        clone.tail = None
+        parent.insert(position + i, clone)
+    return lxml.html.tostring(root, encoding='unicode')
+
+
+def synthetic_page(library, page, num_items, page_dir=SAMPLE_PAGES):
+    """
+    Returns a holds or checkouts page with num_items items, grown from the library's most recent fixture page in
+    page_dir or from the built-in items when there is no fixture
+
+    Parameters
+    ----------
+    library: str
+        The library the page is from ("ppl", "wpl", "tpl")
+    page: str
+        The kind of page ("holds", "checkouts")
+    num_items: int
+        The number of items on the page
+    page_dir: str
+        The directory of saved pages
+    Returns
+    -------
+    str
+    """
+    fixture_path = find_fixture(library, page, page_dir) if page_dir and os.path.isdir(page_dir) else None
+    if fixture_path:
+        page_source = grown_page(fixture_path, PAGE_SELECTORS[(library, page)], num_items)
+        if page_source is not None:
+            return page_source
+    return built_in_page(library, page, num_items)
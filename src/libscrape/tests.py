@@ -7,11 +7,53 @@ from typing import List
 import unittest
 from library import WPL, PPL, TPL, DurhamLibrary, Item
 from parser_utils import *
+import requests
 from selenium import webdriver
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException, TimeoutException, \
+    WebDriverException
 from datetime import date
+import asyncio
+import base64
+import io
+import json
+import multiprocessing
+import pickle
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
 import os
 
-from lib_assets import Messenger
+from lib_assets import Messenger, MessagingSession
+from messaging import MAX_BODY_LENGTH, pack_bodies, twilio_client
+from twilio_stub import TwilioStub, sample_items
+from outbox import FAILED, PENDING, SENDING, SENT, BackgroundDelivery, Outbox, ProviderRateLimiter, \
+    TwilioSender, deliver
+from twilio.base.exceptions import TwilioRestException
+from snapshot_store import CHECKED_OUT, DUE_DATE_MOVED, HOLD_READY, HOLD_REMOVED, HOLD_UPDATED, NOW_OVERDUE, \
+    RENEWED, RETURNED, SnapshotStore, add_account_snapshot, diff_items
+from lib_layouts import LayoutTable, fingerprint
+from reparse import reparse
+from synthetic_pages import BUILT_IN_ITEMS, PAGE_SELECTORS, synthetic_page
+from benchmarks import benchmark_durham_parsing, benchmark_extraction, benchmark_suite
+from hours_cache import HoursCache
+from runner import run_jobs
+from driver_pool import DriverPool, headless_chrome, process_tree_rss
+from session_store import SessionStore
+from library import read_items, resume_session, url_excludes
+import tracing
+from http_backend import HttpBackend, HttpBackendError, http_snapshot_pages
+from replay_server import ReplayServer, accounts_per_minute, load_test
+from login_outcome import DURHAM_LOGIN_PAGE, LoginError, LoginOutcome, MaintenanceError, sign_in
+from batch import BatchStats, RateLimiter, percentile, read_accounts, run_batch
+from capture_profile import LEAN_PROFILE, CaptureProfile
+from resilience import BreakerRegistry, CircuitOpenError, RetryPolicy
+from async_library import AsyncLibrary, LibraryLimits, snapshot_all
+from gateway_capture import GatewayCapture, GatewayError, display_date, items_from_payloads, load_sample
+from lib_extractor import ITEM_LINES_SCRIPT, BrowserItems, available_engines, extract_in_browser, extract_item_lines, \
+    iter_chunks, iter_item_lines, set_default_engine
 
 from parser_utils import save_output_as_html
 
@@ -448,3 +490,1448 @@ class Library(unittest.TestCase):
         # print(text)
         # print(exp_text)
         self.assertEqual(text, exp_text)
+
+
+class ExtractionEngines(unittest.TestCase):
+    page_source = """<html><head><title>On Hold</title><script>var item = "<div>";</script></head><body>
+        <div class="cp-item-list"><div class="cp-batch-actions-list-item">
+        <span>Select. Item 1. France.</span><!-- react-text: 5 --><h2><a>France</a></h2>
+        <span>France, DVD</span><span>DVD</span> - <span>2002</span>&nbsp;<style>.cp {}</style>
+        <p>Not ready<br/>#1<span> on 1 copies</span></p><pre>  </pre>Pick up at <b>Central Library</b></div>
+        <div class="cp-batch-actions-list-item"><span>Rated R</span>
+
+        <span>by </span><a>Rihanna</a></div></div>
+        <div id="PageContent"><div class="holds-redux ready-for-pickup"><div><div><table><tbody>
+        <tr><td> </td><td>Modern Java in action</td><td>Book</td></tr></tbody></table></div></div></div></div>
+        <div class="item-wrapper"> <a>The bully-proof workplace</a> <span>Dean, Peter J., 1946- author.</span></div>
+        </body></html>"""
+
+    def test_engines_match_reference_output(self):
+        for page_data in (PPL.hold_data, WPL.checkout_data, TPL.hold_data, TPL.checkout_data):
+            exp_res = page_data(self.page_source, engine="soup")
+            self.assertTrue(exp_res)
+            for engine in available_engines():
+                self.assertListEqual(page_data(self.page_source, engine=engine), exp_res)
+
+    def test_default_engine_can_be_set_globally(self):
+        exp_res = PPL.hold_data(self.page_source)
+        set_default_engine("lxml")
+        try:
+            self.assertListEqual(PPL.hold_data(self.page_source), exp_res)
+        finally:
+            set_default_engine("soup")
+        self.assertRaises(ValueError, set_default_engine, "regex")
+
+    def test_streamed_items_match_reference_output(self):
+        for page_data, stream_data in ((PPL.hold_data, PPL.stream_hold_data), (TPL.hold_data, TPL.stream_hold_data),
+                                       (TPL.checkout_data, TPL.stream_checkout_data)):
+            chunks = iter_chunks(self.page_source, chunk_size=7)
+            self.assertListEqual(list(stream_data(chunks)), page_data(self.page_source))
+
+    def test_nested_items_are_streamed_in_document_order(self):
+        page_source = '<div class="item">outer<div class="item">inner</div>tail</div><div class="item">last</div>'
+        self.assertListEqual(list(iter_item_lines(io.StringIO(page_source), ".item", chunk_size=5)),
+                             extract_item_lines(page_source, ".item", "soup"))
+
+
+class DurhamLayouts(unittest.TestCase):
+    hold_data = [
+        ['Select. Item 1. France.', 'France', 'France, DVD', 'DVD', ' - ', '2002', 'DVD, 2002. Language: English',
+         '\xa0', 'View details', 'View details for France, DVD, ', 'Not ready', '#1', ' on 1 copies', 'Pick up at ',
+         'Central Library', 'Expires on ', 'Oct. 09, 2022', 'Pause hold', 'Cancel hold', 'For Later', 'Placed on ',
+         'Jan. 12, 2022'],
+        ['Select. Item 2. Rated R.', 'Rated R', 'Rated R, Music CD', 'by ', 'Rihanna', 'Music CD', ' - ', '2009',
+         'Music CD, 2009. Language: English', '\xa0', 'View details', 'View details for Rated R, Music CD, ',
+         'Not ready', '#1', ' on 1 copies', 'Pick up at ', 'Central Library', 'Expires on ', 'Oct. 09, 2022',
+         'Pause hold', 'Cancel hold', 'For Later', 'Placed on ', 'Jan. 12, 2022'],
+        ['Select. Item 3. Neon Genesis Evangelion.', 'Neon Genesis Evangelion', 'Neon Genesis Evangelion, Book',
+         'Volume One', 'by ', 'Sadamoto, Yoshiyuki', 'Book', ' - ', '2004', 'Book, 2004. Language: English', '\xa0',
+         'View details', 'View details for Neon Genesis Evangelion, Book, ', 'Not ready', '#1', ' on 1 copies',
+         'Pick up at ', 'Central Library', 'Expires on ', 'Oct. 09, 2022', 'Pause hold', 'Cancel hold', 'For Later',
+         'Placed on ', 'Jan. 12, 2022'],
+        ['Select. Item 4. Sky.', 'Sky', 'Sky, Blu-ray Disc', 'Blu-ray Disc', ' - ', '2002']]
+    checkout_data = [
+        ['Select. Item 1. My Life in Full.', 'My Life in Full', 'My Life in Full, Book', 'Work, Family, and Our Future',
+         'by ', 'Nooyi, Indra K.', 'Book', ' - ', '2021', 'Book, 2021. Language: English',
+         'You have not rated this title. Rate this title', 'Rate this', 'Due later', '6 days  remaining ', 'Due by ',
+         'Jan. 11, 2022', '2 people waiting', 'Renew'],
+        ['Select. Item 1. This Is Glenn Gould - Story of A Genius.', 'This Is Glenn Gould - Story of A Genius',
+         'This Is Glenn Gould - Story of A Genius, Music CD', 'by ', 'Bach, Johann Sebastian', 'Music CD', ' - ',
+         '2012', 'Music CD, 2012. Language: English', 'You have not rated this title. Rate this title', 'Rate this',
+         'Due later', '21 days  remaining ', 'Due by ', 'Jan. 26, 2022', 'Renewed', ' ', '5 times', 'Renew'],
+        ['Select. Item 2. Nature.', 'Nature', 'Nature, DVD', 'DVD', ' - ', '2015', 'DVD, 2015. Language: English',
+         'Due soon', '2 days  remaining ', 'Due by ', 'Oct. 20, 2021', 'Renew', 'In Progress', 'Add ', 'Nature']]
+
+    def test_known_layouts_locate_fields(self):
+        table = LayoutTable.load()
+        self.assertEqual(table.hold(self.hold_data[0]),
+                         ("France", "DVD", "", "Not Ready", "Oct. 09, 2022", "Central Library"))
+        self.assertEqual(table.hold(self.hold_data[1]),
+                         ("Rated R", "Music CD", "Rihanna", "Not Ready", "Oct. 09, 2022", "Central Library"))
+        self.assertEqual(table.checkout(self.checkout_data[0]),
+                         ("My Life in Full", "Book", "Nooyi, Indra K.", "Due Later", "Jan. 11, 2022"))
+
+    @staticmethod
+    def item_lines(item_format, is_hold, subtitle=None, contributors=None):
+        # the lines of an item as scraped, in the form of the samples above
+        lines = ['Select. Item 1. Sky.', 'Sky', f'Sky, {item_format}'] + ([subtitle] if subtitle else [])
+        lines += (['by ', contributors] if contributors else []) + [item_format, ' - ', '2002',
+                                                                     f'{item_format}, 2002. Language: English']
+        if is_hold:
+            return lines + ['\xa0', 'View details', f'View details for Sky, {item_format}, ', 'Not ready', '#1',
+                            ' on 1 copies', 'Pick up at ', 'Central Library', 'Expires on ', 'Oct. 09, 2022',
+                            'Pause hold', 'Cancel hold', 'For Later', 'Placed on ', 'Jan. 12, 2022']
+        if contributors:
+            lines += ['You have not rated this title. Rate this title', 'Rate this']
+        return lines + ['Due later', '6 days  remaining ', 'Due by ', 'Jan. 11, 2022', 'Renew']
+
+    def test_every_format_and_subtitle_layout_is_known(self):
+        table = LayoutTable.load()
+        for item_format, contributors in (("DVD", None), ("Book", "Nooyi, Indra K."), ("Music CD", "Rihanna")):
+            for subtitle in (None, "A Road Movie"):
+                with self.subTest(item_format=item_format, subtitle=subtitle):
+                    self.assertEqual(table.hold(self.item_lines(item_format, True, subtitle, contributors)),
+                                     ("Sky", item_format, contributors or "", "Not Ready", "Oct. 09, 2022",
+                                      "Central Library"))
+                    self.assertEqual(table.checkout(self.item_lines(item_format, False, subtitle, contributors)),
+                                     ("Sky", item_format, contributors or "", "Due Later", "Jan. 11, 2022"))
+
+    def test_unknown_layout_is_reported_once_and_skipped(self):
+        table = LayoutTable()
+        table.learn(self.hold_data[0], True)
+        library_obj = PPL(layout_table=table)
+        with self.assertLogs("lib_layouts", level="WARNING") as logs:
+            items = library_obj.parse_hold_data([self.hold_data[2], self.hold_data[0], self.hold_data[2]])
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn("Neon Genesis Evangelion", logs.output[0])
+        self.assertEqual([item.title for item in items], ["France"])
+        self.assertEqual(library_obj.skipped_items, 2)
+        checkouts = ArchiveReparse.saved_page(self.checkout_data[:1])
+        snapshot = library_obj.parse_snapshot(ArchiveReparse.saved_page(self.hold_data[:3]), checkouts)
+        self.assertEqual((len(snapshot["holds"]), snapshot["skipped_items"]), (1, 3))
+        self.assertEqual(library_obj.skipped_items, 5)
+
+    def test_incidental_lines_are_left_out_of_fingerprints(self):
+        ready = [line for line in self.hold_data[0] if line not in ('#1', ' on 1 copies')]
+        ready[ready.index('Not ready')] = 'Ready for pickup'
+        self.assertEqual(fingerprint(ready), fingerprint(self.hold_data[0]))
+        renewed = self.checkout_data[1]
+        waiting = renewed[:renewed.index('Renewed')] + ['2 people waiting', 'Renew']
+        self.assertEqual(fingerprint(waiting), fingerprint(renewed))
+        self.assertEqual(LayoutTable.load().hold(ready)[3], "Ready")
+
+    def test_learned_layouts_survive_a_round_trip(self):
+        table = LayoutTable()
+        self.assertTrue(table.learn(self.checkout_data[1], False))
+        self.assertFalse(table.learn(self.hold_data[3], True))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "layouts.json")
+            table.save(path)
+            loaded = LayoutTable.load(path)
+        self.assertEqual(loaded.checkout(self.checkout_data[1]), table.checkout(self.checkout_data[1]))
+        self.assertEqual(loaded.checkout(self.checkout_data[1])[2], "Bach, Johann Sebastian")
+
+
+class ArchiveReparse(unittest.TestCase):
+    @staticmethod
+    def saved_page(item_data, header=''):
+        items = ''.join('<div class="cp-batch-actions-list-item">' + ''.join(f'<span>{line}</span>' for line in lines)
+                        + '</div>' for lines in item_data)
+        return f'<html><body>{header}{items}</body></html>'
+
+    def test_saved_pages_are_reparsed_into_items(self):
+        hold_data = DurhamLayouts.hold_data[:2]
+        checkout_data = DurhamLayouts.checkout_data[:1]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, "ppl-holds-Jan-12-2022.html"), 'w', encoding='utf-8') as f:
+                f.write(self.saved_page(hold_data))
+            # a page saved under another name is recognized by its content
+            with open(os.path.join(tmp_dir, "export.html"), 'w', encoding='utf-8') as f:
+                f.write(self.saved_page(checkout_data, '<a href="https://whitby.bibliocommons.com/">Whitby</a>'))
+            with open(os.path.join(tmp_dir, "notes.html"), 'w', encoding='utf-8') as f:
+                f.write('<html><body>Not a library page</body></html>')
+            output = io.StringIO()
+            summary = reparse(tmp_dir, output, workers=2)
+
+        self.assertEqual((summary["pages"], summary["items"], summary["skipped"], summary["errors"]), (2, 3, 1, {}))
+        records = {record["title"]: record for record in map(json.loads, output.getvalue().splitlines())}
+        self.assertEqual(records["Rated R"]["contributors"], "Rihanna")
+        self.assertEqual(records["Rated R"]["date_retrieved"], "2022-01-12")
+        self.assertEqual((records["My Life in Full"]["library"], records["My Life in Full"]["is_hold"]), ("wpl", False))
+
+
+class SyntheticPages(unittest.TestCase):
+    def test_synthetic_pages_hold_the_requested_items(self):
+        for (library, page), items in BUILT_IN_ITEMS.items():
+            page_source = synthetic_page(library, page, 5, page_dir=None)
+            library_class = {"ppl": PPL, "wpl": WPL, "tpl": TPL}[library]
+            item_data = library_class.hold_data(page_source) if page == "holds" else library_class.checkout_data(
+                page_source)
+            self.assertEqual(item_data, [items[i % len(items)] for i in range(5)])
+
+    def test_suite_times_every_stage(self):
+        results = benchmark_suite(sizes=(10,), repeat=1, page_dir=None)
+        self.assertEqual(len(results), 4 * 4)
+        self.assertTrue(all(row["seconds"] > 0 and row["peak_memory_bytes"] > 0 for row in results))
+
+    def test_saved_page_benchmarks_fall_back_to_synthetic_pages(self):
+        with tempfile.TemporaryDirectory() as page_dir:
+            missing_dir = os.path.join(page_dir, "sample_pages")
+            extraction = benchmark_extraction(missing_dir, repeat=1)
+            parsing = benchmark_durham_parsing(missing_dir, repeat=1)
+        self.assertEqual(len(extraction), 6)
+        self.assertTrue(all(row["items"] > 0 for row in extraction))
+        self.assertEqual([row["page"][:3] for row in parsing], ["ppl", "ppl", "wpl", "wpl"])
+
+
+class TorontoBranchHours(unittest.TestCase):
+    page_source = """<html><body><div class="branches">
+        <a name="alphaIndex-A"></a>
+        <div class="row"><h2>Agincourt</h2>
+            <p>155 Bonis Ave.</p>
+            <p>Monday</p>
+            <p>9:00 am</p>
+            <p>to</p>
+            <p>8:30 pm</p>
+        </div>
+        <div class="row"><h2>Albion</h2>
+            <p>1515 Albion Road</p>
+            <p>Monday</p>
+            <p>9:00 am</p>
+            <p>to</p>
+            <p>8:30 pm</p>
+        </div>
+        <a name="alphaIndex-M"></a>
+        <div class="row"><h2>Malvern</h2>
+            <p>30 Sewells Road</p>
+            <p>Monday</p>
+            <p>9:00 am</p>
+            <p>to</p>
+            <p>8:30 pm</p>
+        </div>
+        <div class="footer">Albion Road</div>
+        </div></body></html>"""
+
+    def test_index_maps_every_branch_to_its_hours(self):
+        index = TPL.branch_hours_index(self.page_source)
+        self.assertEqual(list(index), ["Agincourt", "Albion", "Malvern"])
+        self.assertEqual(index["Malvern"].split('\n'), ["Malvern", "30 Sewells Road", "Monday", "9:00 am", "to",
+                                                        "8:30 pm"])
+
+    def test_lookup_matches_within_the_alphabetical_group(self):
+        index = TPL.branch_hours_index(self.page_source)
+        self.assertEqual(TPL.lookup_hours(index, "Albion"), index["Albion"])
+        self.assertEqual(TPL.lookup_hours(index, "Albion Road"), index["Albion"])
+        self.assertRaises(NoSuchElementException, TPL.lookup_hours, index, "Sewells Road")
+        self.assertRaises(NoSuchElementException, TPL._hours, "Zzz", self.page_source)
+
+
+class BranchHoursCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "state", "hours.json")
+        self.now = 1000.0
+        self.scraped = []
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def cache(self, ttl=60):
+        return HoursCache(self.path, ttl=ttl, clock=lambda: self.now)
+
+    def scrape(self, hours):
+        self.scraped.append(hours)
+        return hours
+
+    def test_hits_are_served_without_scraping(self):
+        self.cache().hours("wpl", "Central", lambda: self.scrape("Monday 9-5"))
+        self.now += 30
+        # a new cache reads the entry back from disk
+        self.assertEqual(self.cache().hours("wpl", "Central", lambda: self.scrape("Monday 9-9")), "Monday 9-5")
+        self.assertEqual(self.scraped, ["Monday 9-5"])
+
+    def test_expired_entries_are_only_rewritten_when_the_hours_change(self):
+        cache = self.cache()
+        cache.hours("tpl", "Malvern", lambda: self.scrape("Monday 9-5"))
+        self.now += 60
+        self.assertEqual(cache.hours("tpl", "Malvern", lambda: self.scrape("Monday 9-5")), "Monday 9-5")
+        entry = self.cache().entries["tpl/Malvern"]
+        self.assertEqual((entry["changed"], entry["checked"]), (1000.0, 1060.0))
+        self.now += 60
+        self.assertEqual(cache.hours("tpl", "Malvern", lambda: self.scrape("Monday 9-9")), "Monday 9-9")
+        self.assertEqual(self.cache().entries["tpl/Malvern"]["changed"], 1120.0)
+        self.assertEqual(len(self.scraped), 3)
+
+    def test_libraries_use_the_cache(self):
+        library_obj = TPL(hours_cache=self.cache())
+        library_obj._branch_hours = TPL.branch_hours_index(TorontoBranchHours.page_source)
+        hours = library_obj.hours("Malvern")
+        library_obj._branch_hours = {}
+        self.assertEqual(library_obj.hours("Malvern"), hours)
+
+
+class ConcurrentRunner(unittest.TestCase):
+    class FakeDriver:
+        def __init__(self):
+            self.quit_called = False
+
+        def quit(self):
+            self.quit_called = True
+
+    def test_jobs_run_concurrently_with_isolated_drivers(self):
+        drivers = []
+
+        def driver_factory():
+            drivers.append(self.FakeDriver())
+            return drivers[-1]
+
+        # both jobs must be inside the barrier at the same time for either to pass it, which only happens if they
+        # overlap. Run one after the other, the first one breaks the barrier when it times out.
+        both_running = threading.Barrier(2, timeout=5)
+
+        def job(driver):
+            both_running.wait()
+            return driver
+
+        def failing_job(driver):
+            raise TimeoutException("login timed out")
+
+        report = run_jobs({"ppl": job, "wpl": failing_job, "tpl": job}, workers=3, driver_factory=driver_factory)
+        self.assertFalse(both_running.broken)
+        self.assertEqual([result.name for result in report.failed], ["wpl"])
+        self.assertIsInstance(report.results["wpl"].error, TimeoutException)
+        self.assertIsNot(report.results["ppl"].value, report.results["tpl"].value)
+        self.assertTrue(all(driver.quit_called for driver in drivers))
+        self.assertIn("total", report.summary())
+
+    def test_skipped_items_are_reported(self):
+        report = run_jobs({"ppl": lambda driver: {"holds": [], "checkouts": [], "skipped_items": 2},
+                           "tpl": lambda driver: {"holds": [], "checkouts": []}})
+        self.assertEqual((report.results["ppl"].skipped_items, report.results["tpl"].skipped_items), (2, 0))
+        self.assertEqual(report.skipped_items, 2)
+        self.assertIn("skipped", report.summary().splitlines()[0])
+
+
+class FakeDriver:
+    def __init__(self):
+        self.healthy = True
+        self.quit_called = False
+        self.commands = []
+        self.cleared_origins = []
+        self.blocked_urls = None
+        self.history = ["https://pickering.bibliocommons.com/user/login",
+                        "https://pickering.bibliocommons.com/v2/holds"]
+        self.cookies = [{"name": "session_id", "domain": ".bibliocommons.com", "secure": True}]
+        self.log = ["stale event"]
+        self.window_handles = ["holds"]
+        self.switch_to = self
+        self.current_url = self.history[-1]
+
+    def execute_script(self, script):
+        if not self.healthy:
+            raise WebDriverException("chrome not reachable")
+        if script == "return 1":
+            return 1
+        if script == "return window.location.origin":
+            return "https://pickering.bibliocommons.com"
+        self.commands.append(script)
+
+    def execute_cdp_cmd(self, cmd, cmd_args):
+        self.commands.append(cmd)
+        if cmd == "Page.getNavigationHistory":
+            return {"currentIndex": len(self.history) - 1, "entries": [{"url": url} for url in self.history]}
+        if cmd == "Network.getAllCookies":
+            return {"cookies": self.cookies}
+        if cmd == "Storage.clearDataForOrigin":
+            self.cleared_origins.append(cmd_args["origin"])
+        if cmd == "Network.setBlockedURLs":
+            self.blocked_urls = cmd_args["urls"]
+        if cmd == "Page.resetNavigationHistory":
+            self.history = [self.current_url]
+
+    def window(self, handle):
+        assert handle in self.window_handles
+
+    def close(self):
+        self.window_handles.pop()
+
+    def get_log(self, log_type):
+        log, self.log = self.log, []
+        return log
+
+    def get(self, url):
+        self.current_url = url
+        self.history.append(url)
+
+    def quit(self):
+        self.quit_called = True
+
+
+class DriverPools(unittest.TestCase):
+    def setUp(self):
+        self.started = []
+
+    def factory(self):
+        self.started.append(FakeDriver())
+        return self.started[-1]
+
+    def test_returned_drivers_are_cleared_and_reused(self):
+        with DriverPool(size=2, driver_factory=self.factory) as pool:
+            self.assertEqual(len(self.started), 2)
+            with pool.borrow() as driver:
+                pass
+            self.assertEqual(driver.current_url, "about:blank")
+            self.assertIn("Network.clearBrowserCookies", driver.commands)
+            self.assertIs(pool.acquire(), driver)
+        self.assertEqual(len(self.started), 2)
+
+    def test_returned_drivers_forget_every_site_they_visited(self):
+        with DriverPool(size=1, driver_factory=self.factory, capture_profile=LEAN_PROFILE) as pool:
+            with pool.borrow() as driver:
+                driver.get("https://pickering.bibliocommons.com/checkedout")
+                driver.get("https://pickeringlibrary.ca/locations/PC/")
+                driver.window_handles.append("checkouts")
+                driver.blocked_urls = ["*"]
+            self.assertEqual(sorted(driver.cleared_origins),
+                             ["http://bibliocommons.com", "https://bibliocommons.com",
+                              "https://pickering.bibliocommons.com", "https://pickeringlibrary.ca"])
+            self.assertEqual(driver.window_handles, ["holds"])
+            self.assertEqual(driver.blocked_urls, LEAN_PROFILE.blocked_urls())
+            self.assertEqual(driver.history, ["about:blank"])
+            self.assertEqual(driver.log, [])
+
+    def test_borrowers_wait_a_bounded_time_by_default(self):
+        pool = DriverPool(size=1, driver_factory=self.factory, acquire_timeout=0.01)
+        library_obj = WPL(driver_pool=pool)
+        self.assertRaises(TimeoutError, TPL, driver_pool=pool)
+        library_obj.close()
+        self.assertIs(pool.acquire(), self.started[0])
+        pool.close()
+
+    def test_unhealthy_and_worn_out_drivers_are_replaced(self):
+        pool = DriverPool(size=1, driver_factory=self.factory, max_sessions=2)
+        first = pool.acquire()
+        first.healthy = False
+        pool.release(first)
+        second = pool.acquire()
+        self.assertIsNot(second, first)
+        self.assertTrue(first.quit_called)
+        pool.release(second)
+        pool.release(pool.acquire())
+        self.assertTrue(second.quit_called)
+        self.assertEqual(len(self.started), 3)
+        pool.close()
+
+    def test_libraries_borrow_from_the_pool_until_closed(self):
+        pool = DriverPool(size=1, driver_factory=self.factory)
+        library_obj = TPL(driver_pool=pool)
+        self.assertIs(library_obj.driver, self.started[0])
+        self.assertRaises(TimeoutError, pool.acquire, 0.01)
+        library_obj.close()
+        self.assertIs(PPL(driver_pool=pool).driver, self.started[0])
+        self.assertFalse(self.started[0].quit_called)
+
+    def test_rss_of_a_process_tree(self):
+        self.assertGreater(process_tree_rss(os.getpid()), 0)
+
+
+class StoredSessions(unittest.TestCase):
+    cookies = [{"name": "session_id", "value": "secret-token", "domain": ".bibliocommons.com", "path": "/",
+                "secure": True, "httpOnly": True, "expiry": 5000}]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.now = 1000
+        self.store = SessionStore(self.tmp_dir.name, key=SessionStore.generate_key(), max_age=600,
+                                  clock=lambda: self.now)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_sessions_are_encrypted_per_account(self):
+        self.store.save("ppl", "patron", self.cookies)
+        self.assertEqual(self.store.load("ppl", "patron"), self.cookies)
+        self.assertIsNone(self.store.load("wpl", "patron"))
+        for file_name in os.listdir(self.tmp_dir.name):
+            with open(os.path.join(self.tmp_dir.name, file_name), 'rb') as f:
+                self.assertNotIn(b"secret-token", f.read())
+        other_key = SessionStore(self.tmp_dir.name, key=SessionStore.generate_key())
+        self.assertIsNone(other_key.load("ppl", "patron"))
+
+    def test_old_sessions_expire(self):
+        self.store.save("ppl", "patron", self.cookies)
+        self.now += 600
+        self.assertIsNone(self.store.load("ppl", "patron"))
+
+    def test_stored_session_skips_the_login_form(self):
+        self.store.save("ppl", "patron", self.cookies)
+        driver = FakeDriver()
+        self.assertTrue(resume_session(driver, self.store, "ppl", "patron",
+                                       "https://pickering.bibliocommons.com/v2/holds", "/user/login"))
+        self.assertEqual(driver.commands, ["Network.setCookies"])
+        self.assertEqual(driver.current_url, "https://pickering.bibliocommons.com/v2/holds")
+
+    def test_rejected_session_is_discarded(self):
+        self.store.save("ppl", "patron", self.cookies)
+        driver = FakeDriver()
+        driver.get = lambda url: setattr(driver, "current_url", "https://pickering.bibliocommons.com/user/login")
+        self.assertFalse(resume_session(driver, self.store, "ppl", "patron",
+                                        "https://pickering.bibliocommons.com/v2/holds", "/user/login"))
+        self.assertIsNone(self.store.load("ppl", "patron"))
+
+
+class HttpScraping(unittest.TestCase):
+    def test_snapshot_over_http_reuses_one_connection(self):
+        for library_class, system in ((PPL, "ppl"), (WPL, "wpl"), (TPL, "tpl")):
+            with ReplayServer(system) as server:
+                backend = HttpBackend(server.site)
+                items = library_class(http_backend=backend).snapshot("patron", "secret")
+                backend.close()
+            self.assertEqual((len(items["holds"]), len(items["checkouts"])), (5, 5))
+            self.assertTrue(all(item.title for item in items["holds"] + items["checkouts"]))
+            self.assertEqual(server.requests[:2], [("GET", "/signin" if system == "tpl" else "/user/login"),
+                                                   ("POST", "/signin" if system == "tpl" else "/user/login")])
+            self.assertEqual(server.connections, 1)
+
+    def test_rejected_login_falls_back_to_selenium(self):
+        with ReplayServer("ppl") as server:
+            with self.assertLogs("http_backend", level="WARNING"):
+                self.assertIsNone(http_snapshot_pages(HttpBackend(server.site), "patron", "wrong"))
+            self.assertRaises(HttpBackendError, HttpBackend(server.site).fetch_page, "/v2/holds", "cp-item-list")
+
+
+class SlowLibrary:
+    """
+    A stand-in for a library class whose blocking calls wait until they are let through. Libraries that share a tracker
+    count their running calls together.
+    """
+
+    def __init__(self, delay=0.05, tracker=None):
+        self.delay = delay
+        self.tracker = tracker or self
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+        self.gate = threading.Event()
+        self.gate.set()
+        self.lock = threading.Lock()
+
+    def snapshot(self, username, password):
+        tracker = self.tracker
+        with tracker.lock:
+            self.calls.append(username)
+            tracker.running += 1
+            tracker.max_running = max(tracker.max_running, tracker.running)
+        self.gate.wait()
+        sleep(self.delay)
+        with tracker.lock:
+            tracker.running -= 1
+        return {"holds": [username], "checkouts": []}
+
+    def close(self):
+        pass
+
+
+class AsyncLibraries(unittest.TestCase):
+    def test_calls_are_limited_per_system(self):
+        async def run():
+            ppl_tracker, tpl_tracker = SlowLibrary(), SlowLibrary()
+            limits = LibraryLimits({"ppl": 2, "tpl": 3})
+            accounts = {f"ppl{i}": (AsyncLibrary(SlowLibrary(tracker=ppl_tracker), "ppl", limits=limits), f"ppl{i}",
+                                    "pin") for i in range(5)}
+            shared = AsyncLibrary(SlowLibrary(tracker=tpl_tracker), "tpl", limits=limits)
+            accounts.update({f"tpl{i}": (shared, f"tpl{i}", "pin") for i in range(3)})
+            return ppl_tracker, tpl_tracker, await snapshot_all(accounts)
+
+        ppl_tracker, tpl_tracker, results = asyncio.run(run())
+        self.assertEqual(results["ppl4"], {"holds": ["ppl4"], "checkouts": []})
+        self.assertEqual(len(results), 8)
+        self.assertEqual(ppl_tracker.max_running, 2)
+        # the calls on one library instance share its driver, so they never overlap
+        self.assertEqual(tpl_tracker.max_running, 1)
+
+    def test_timed_out_calls_keep_the_library_until_they_return(self):
+        async def run():
+            library = SlowLibrary(delay=0)
+            library.gate.clear()
+            wrapper = AsyncLibrary(library, "ppl", limits=LibraryLimits())
+            with self.assertRaises(asyncio.TimeoutError):
+                await wrapper.snapshot("first", "pin", timeout=0.05)
+            queued = asyncio.ensure_future(wrapper.snapshot("cancelled", "pin"))
+            await asyncio.sleep(0.05)
+            queued.cancel()
+            following = asyncio.ensure_future(wrapper.snapshot("second", "pin"))
+            await asyncio.sleep(0.05)
+            self.assertEqual(library.calls, ["first"])
+            library.gate.set()
+            self.assertEqual(await following, {"holds": ["second"], "checkouts": []})
+            self.assertTrue(queued.cancelled())
+            return library.calls
+
+        self.assertEqual(asyncio.run(run()), ["first", "second"])
+
+
+def batch_scrape(system, username, password):
+    if password != "pin":
+        raise ValueError("The login was rejected")
+    return {"holds": [Item(date.today(), f"{username}'s hold", "Book", True, "Ready", "", "Pickering", system, [])],
+            "checkouts": []}
+
+
+class BatchAccounts(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.secret_path = os.path.join(self.dir.name, "secret")
+        with open(self.secret_path, 'w') as f:
+            f.write("pin\n")
+        os.environ["LIBSCRAPE_TEST_PIN"] = "pin"
+        self.accounts_path = os.path.join(self.dir.name, "accounts.csv")
+        with open(self.accounts_path, 'w') as f:
+            f.write("system,username,secret,phone\n"
+                    "ppl,ann,env:LIBSCRAPE_TEST_PIN,+15550100\n"
+                    "WPL,bob,file:" + self.secret_path + ",\n"
+                    "tpl,cy,env:LIBSCRAPE_TEST_MISSING,\n")
+
+    def tearDown(self):
+        os.environ.pop("LIBSCRAPE_TEST_PIN", None)
+        self.dir.cleanup()
+
+    def test_results_are_streamed_with_latency_stats(self):
+        accounts = read_accounts(self.accounts_path)
+        self.assertEqual([(account.system, account.phone) for account in accounts],
+                         [("ppl", "+15550100"), ("wpl", ""), ("tpl", "")])
+        stats = BatchStats()
+        results = {result.account.username: result
+                   for result in run_batch(accounts, workers=2, rate=6000, stats=stats, scrape=batch_scrape)}
+        self.assertEqual(results["ann"].items["holds"][0].title, "ann's hold")
+        self.assertEqual(results["bob"].to_dict()["holds"][0]["branch"], "Pickering")
+        self.assertEqual(results["bob"].to_dict()["skipped_items"], 0)
+        self.assertIn("LIBSCRAPE_TEST_MISSING", results["cy"].error)
+        self.assertEqual((len(stats.latencies), stats.failed), (3, 1))
+        self.assertIn("2/3 accounts succeeded", stats.summary())
+        self.assertEqual(percentile([4, 1, 3, 2], 0.5), 2)
+        self.assertEqual(percentile([4, 1, 3, 2], 0.99), 4)
+
+    def test_sign_ins_are_spread_per_host(self):
+        with multiprocessing.Manager() as manager:
+            limiter = RateLimiter(manager, rate=600)
+            waits = [limiter.wait("pickering"), limiter.wait("pickering"), limiter.wait("whitby")]
+        self.assertAlmostEqual(waits[0], 0, delta=0.02)
+        self.assertAlmostEqual(waits[1], 0.1, delta=0.05)
+        self.assertAlmostEqual(waits[2], 0, delta=0.02)
+
+
+class LeanCapture(unittest.TestCase):
+    def setUp(self):
+        self.profile = CaptureProfile({"font": ["*.woff2"]}, ["doubleclick.net", "cdn.bibliocommons.com"],
+                                      ["bibliocommons.com"])
+
+    def test_denied_hosts_are_blocked_unless_allowed(self):
+        self.assertEqual(self.profile.blocked_hosts(), ["doubleclick.net"])
+        self.assertEqual(self.profile.blocked_urls(), ["*.woff2", "*://doubleclick.net/*", "*://*.doubleclick.net/*"])
+        self.assertEqual(self.profile.host_resolver_rules(),
+                         "MAP doubleclick.net ~NOTFOUND, MAP *.doubleclick.net ~NOTFOUND")
+        options = self.profile.configure(webdriver.ChromeOptions())
+        self.assertIn("--host-resolver-rules=MAP doubleclick.net ~NOTFOUND, MAP *.doubleclick.net ~NOTFOUND",
+                      options.arguments)
+        self.assertEqual(options.to_capabilities()["pageLoadStrategy"], "eager")
+        self.assertIn("google-analytics.com", LEAN_PROFILE.blocked_hosts())
+        self.assertFalse(any("bibliocommons" in host for host in LEAN_PROFILE.blocked_hosts()))
+
+    def test_libraries_block_resources_in_their_driver(self):
+        driver = FakeDriver()
+        PPL(driver, capture_profile=self.profile)
+        self.assertEqual(driver.commands, ["Network.enable", "Network.setBlockedURLs"])
+
+
+class ScrapeTracing(unittest.TestCase):
+    def tearDown(self):
+        tracing.disable()
+
+    def test_phases_are_traced_and_exported(self):
+        driver = FakeDriver()
+        holds, checkouts = synthetic_page("ppl", "holds", 3), synthetic_page("ppl", "checkouts", 3)
+        tracing.traced_get(driver, "https://example.com")
+        self.assertIsNone(tracing.active_tracer())
+        tracer = tracing.enable()
+        tracing.traced_get(driver, "https://pickering.bibliocommons.com/v2/holds")
+        tracing.WebDriverWait(driver, 1).until(url_excludes("/user/login"))
+        PPL().parse_snapshot(holds, checkouts)
+        phases = tracer.phases()
+        self.assertEqual(phases["driver.get"][0], 1)
+        self.assertEqual(phases["wait: url_excludes"][0], 1)
+        self.assertEqual(phases["DurhamLibrary.parse_snapshot"][0], 1)
+        self.assertEqual(phases["extract: soup"][0], 2)
+        self.assertEqual(phases["LayoutTable.hold"][0], 3)
+        calls, total, self_seconds, _ = phases["DurhamLibrary.parse_snapshot"]
+        self.assertLess(self_seconds, total)
+        self.assertIn("LayoutTable.checkout", tracer.summary())
+
+        with tempfile.TemporaryDirectory() as trace_dir:
+            path = os.path.join(trace_dir, "trace.json")
+            tracer.export_chrome_trace(path)
+            with open(path) as f:
+                events = json.load(f)["traceEvents"]
+        spans = [event for event in events if event["ph"] == "X"]
+        self.assertEqual(len(spans), sum(phase[0] for phase in phases.values()))
+        self.assertEqual(spans[0]["args"], {"url": "https://pickering.bibliocommons.com/v2/holds"})
+        self.assertTrue(any(event["ph"] == "M" for event in events))
+
+
+class FlakySite:
+    """
+    A stand-in for a library site that times out a number of times before it answers
+    """
+
+    def __init__(self, timeouts):
+        self.timeouts = timeouts
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        if self.calls <= self.timeouts:
+            raise TimeoutException("the login form didn't load")
+        return "items"
+
+
+class CircuitBreakers(unittest.TestCase):
+    def setUp(self):
+        self.now = [1000.0]
+        self.delays = []
+        self.retries = RetryPolicy(attempts=3, base_delay=1, multiplier=2, sleep=self.delays.append,
+                                   rng=random.Random(7))
+
+    def test_transient_errors_are_retried_with_jittered_backoff(self):
+        site = FlakySite(timeouts=2)
+        self.assertEqual(self.retries.call(site), "items")
+        self.assertEqual(site.calls, 3)
+        self.assertEqual(len(self.delays), 2)
+        self.assertTrue(0 <= self.delays[0] <= 1 and 0 <= self.delays[1] <= 2)
+        self.assertRaises(ValueError, self.retries.call, int, "not a number")
+        self.assertEqual(len(self.delays), 2)
+
+    def test_circuit_opens_fails_fast_and_closes_after_a_probe(self):
+        probe_results = [False, True]
+        registry = BreakerRegistry(failure_threshold=3, reset_timeout=60, probes={"ppl": lambda: probe_results.pop(0)},
+                                   clock=lambda: self.now[0])
+        site = FlakySite(timeouts=10)
+        self.assertRaises(TimeoutException, registry.call, "ppl", site, retry_policy=self.retries)
+        self.assertEqual(registry.states(), {"ppl": "open"})
+        self.assertRaises(CircuitOpenError, registry.call, "ppl", site)
+        self.assertEqual(site.calls, 3)
+        self.assertTrue(registry.notify_once("ppl", "+15550100"))
+        self.assertFalse(registry.notify_once("ppl", "+15550100"))
+
+        self.now[0] += 61
+        self.assertRaises(CircuitOpenError, registry.call, "ppl", site)  # the first probe fails
+        self.now[0] += 61
+        site.timeouts = 0
+        self.assertEqual(registry.call("ppl", site), "items")
+        self.assertEqual(registry.states(), {"ppl": "closed"})
+        self.assertFalse(registry.notify_once("ppl", "+15550100"))
+
+    def test_a_trial_call_that_never_reports_is_replaced(self):
+        registry = BreakerRegistry(failure_threshold=1, reset_timeout=60, clock=lambda: self.now[0])
+        breaker = registry.breaker("wpl")
+        breaker.record_failure()
+        self.now[0] += 61
+        self.assertTrue(breaker.allow())  # the trial call, whose worker then dies without reporting
+        self.assertEqual(breaker.state, "half-open")
+        self.now[0] += 30
+        self.assertFalse(breaker.allow())
+        self.now[0] += 31
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(registry.states(), {"wpl": "closed"})
+
+    def test_runner_skips_a_library_that_is_down(self):
+        registry = BreakerRegistry(failure_threshold=1, reset_timeout=60, clock=lambda: self.now[0])
+        started = []
+        site = FlakySite(timeouts=10)
+        registry.call("ppl", lambda: None)
+        self.assertRaises(TimeoutException, registry.call, "tpl", site)
+        report = run_jobs({"ppl": lambda driver: "ppl items", "tpl": site},
+                          driver_factory=lambda: started.append(1) or FakeDriver(), breakers=registry)
+        self.assertEqual(report.results["ppl"].value, "ppl items")
+        self.assertIsInstance(report.results["tpl"].error, CircuitOpenError)
+        self.assertEqual((site.calls, len(started)), (1, 1))
+
+
+class RequestsDriver:
+    """
+    Loads pages with requests instead of a browser, for the flows that only read page sources
+    """
+
+    def __init__(self):
+        self.session = requests.Session()
+        self.page_source = ""
+
+    def get(self, url):
+        self.page_source = self.session.get(url, timeout=10).text
+
+
+class ReplayLoadTests(unittest.TestCase):
+    def test_hours_pages_are_scraped_from_the_base_url_given(self):
+        for library_class, system, branch, first_line in ((PPL, "ppl", "Central", "Central Library Hours"),
+                                                          (WPL, "wpl", "Brooklin", "Brooklin Branch"),
+                                                          (TPL, "tpl", "Malvern", "Malvern")):
+            with ReplayServer(system) as server:
+                library_obj = library_class(RequestsDriver(), account_url=server.base_url, site_url=server.base_url)
+                hours = library_obj.hours(branch)
+            self.assertEqual(hours.split('\n')[0], first_line)
+            self.assertIn(server.requests[0][1], ("/locations/PC/", "/hours", "/branches/"))
+        self.assertEqual(PPL(account_url="http://localhost:8000/").account_url, "http://localhost:8000")
+        self.assertEqual(TPL().site_url, "https://www.torontopubliclibrary.ca")
+
+    def test_signed_out_pages_redirect_through_the_login_form(self):
+        with ReplayServer("tpl") as server:
+            session = requests.Session()
+            login_page = session.get(server.base_url + "/checkouts", timeout=10)
+            self.assertTrue(login_page.url.endswith("/signin?redirect=%2Fcheckouts"))
+            self.assertIn('action="/signin?redirect=%2Fcheckouts"', login_page.text)
+            token = re.search(r'name="csrfToken" value="(\w+)"', login_page.text).group(1)
+            checkouts = session.post(login_page.url, data={"csrfToken": token, "userId": "patron",
+                                                           "password": "secret"}, timeout=10)
+        self.assertTrue(checkouts.url.endswith("/checkouts"))
+        self.assertIn("<title>Checkouts : Toronto Public Library</title>", checkouts.text)
+
+    def test_latency_and_errors_are_injected(self):
+        with ReplayServer("ppl", latency=0.05) as server:
+            start = time.perf_counter()
+            HttpBackend(server.site).snapshot_pages("patron", "secret")
+            self.assertGreaterEqual(time.perf_counter() - start, 0.05 * len(server.requests))
+            server.error_rate = 1.0
+            self.assertRaises(HttpBackendError, HttpBackend(server.site).snapshot_pages, "patron", "secret")
+            self.assertEqual(server.errors, 1)
+
+    def test_load_test_reports_the_failed_accounts(self):
+        with ReplayServer("wpl", error_rate=0.3, seed=3) as server:
+            report = load_test(server, 10, workers=4)
+        self.assertEqual(len(report.results), 10)
+        self.assertTrue(report.failed and len(report.failed) < 10)
+        self.assertTrue(all(isinstance(result.error, HttpBackendError) for result in report.failed))
+        self.assertTrue(all(len(result.value["holds"]) == 5 for result in report.results.values() if result.ok))
+        self.assertGreater(accounts_per_minute(report), 0)
+
+
+class LoginElement:
+    def __init__(self, driver, text=""):
+        self.driver = driver
+        self.page = driver.page
+        self.text = text
+
+    def is_enabled(self):
+        if self.driver.page != self.page:
+            raise StaleElementReferenceException("the page has been replaced")
+        return True
+
+    def send_keys(self, keys):
+        pass
+
+    def click(self):
+        self.driver.submit()
+
+
+class LoginDriver:
+    """
+    A login page whose submit button shows the outcome given
+    """
+
+    def __init__(self, outcome, login_url="https://pickering.bibliocommons.com/user/login?destination=%2Fv2%2Fholds"):
+        self.outcome = outcome
+        self.page = 0
+        self.current_url = login_url
+        self.title = "Log In | Pickering Public Library | BiblioCommons"
+        self.banner = ""
+        self.has_form = True
+
+    def get(self, url):
+        pass  # stays on the page it was created on, as a signed in driver is redirected away from the login page
+
+    def submit(self):
+        self.page += 1
+        if self.outcome == "signed in":
+            self.current_url = "https://pickering.bibliocommons.com/v2/holds"
+            self.title, self.has_form = "On Hold | Pickering Public Library | BiblioCommons", False
+        elif self.outcome == "maintenance":
+            self.title, self.has_form = "Down for maintenance", False
+        elif self.outcome != "rejected":
+            self.banner = self.outcome
+
+    def find_elements_by_css_selector(self, selector):
+        if selector == DURHAM_LOGIN_PAGE.error_selector:
+            return [LoginElement(self, self.banner)] if self.banner else []
+        return [LoginElement(self)] if self.has_form else []
+
+
+class LoginOutcomes(unittest.TestCase):
+    def test_each_outcome_is_told_without_waiting_for_a_timeout(self):
+        expected = {"signed in": LoginOutcome.SIGNED_IN, "rejected": LoginOutcome.REJECTED,
+                    "maintenance": LoginOutcome.MAINTENANCE,
+                    "The username or PIN you entered is incorrect.": LoginOutcome.BAD_CREDENTIALS,
+                    "Your account has been locked after too many attempts.": LoginOutcome.LOCKED}
+        for shown, kind in expected.items():
+            start = time.perf_counter()
+            outcome = sign_in(LoginDriver(shown), DURHAM_LOGIN_PAGE, "patron", "secret", timeout=5)
+            self.assertEqual(outcome.kind, kind)
+            self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(sign_in(LoginDriver("The username or PIN you entered is incorrect."), DURHAM_LOGIN_PAGE,
+                                 "patron", "wrong").message, "The username or PIN you entered is incorrect.")
+
+    def test_a_signed_in_driver_skips_the_form(self):
+        driver = LoginDriver("rejected", login_url="https://pickering.bibliocommons.com/v2/holds")
+        self.assertTrue(PPL(driver).login("patron", "secret").signed_in)
+        self.assertEqual(driver.page, 0)
+
+    def test_failed_logins_raise_typed_errors(self):
+        rejected = LoginOutcome(LoginOutcome.BAD_CREDENTIALS, "The PIN is incorrect")
+        self.assertRaises(LoginError, rejected.raise_for_failure)
+        self.assertRaises(MaintenanceError, LoginOutcome(LoginOutcome.MAINTENANCE).raise_for_failure)
+        error = pickle.loads(pickle.dumps(LoginError(rejected)))
+        self.assertEqual((error.outcome.kind, str(error)), (LoginOutcome.BAD_CREDENTIALS,
+                                                            "The login failed (bad credentials): The PIN is incorrect"))
+        attempts = []
+
+        def login():
+            attempts.append(1)
+            return LoginOutcome(LoginOutcome.MAINTENANCE if len(attempts) < 2 else LoginOutcome.SIGNED_IN) \
+                .raise_for_failure()
+        self.assertTrue(RetryPolicy(attempts=3, sleep=lambda seconds: None).call(login).signed_in)
+
+
+class BrowserPage:
+    """
+    A driver whose in-browser extraction script is stood in for by the soup engine. Reading its page source fails.
+    """
+
+    def __init__(self, page_source):
+        self.source = page_source
+        self.scripts = []
+
+    @property
+    def page_source(self):
+        raise AssertionError("the whole page source was read")
+
+    def execute_script(self, script, selector):
+        self.scripts.append(script)
+        return json.dumps(extract_item_lines(self.source, selector, "soup"))
+
+
+class BrowserExtraction(unittest.TestCase):
+    def test_items_extracted_in_the_browser_match_the_page_source(self):
+        for library_class, system in ((PPL, "ppl"), (WPL, "wpl"), (TPL, "tpl")):
+            holds_source = synthetic_page(system, "holds", 4)
+            checkouts_source = synthetic_page(system, "checkouts", 4)
+            driver = BrowserPage(holds_source)
+            holds = read_items(driver, library_class.HOLD_SELECTOR, in_browser=True)
+            driver.source = checkouts_source
+            checkouts = read_items(driver, library_class.CHECKOUT_SELECTOR, in_browser=True)
+            self.assertEqual(driver.scripts, [ITEM_LINES_SCRIPT] * 2)
+            self.assertEqual(library_class.hold_data(holds), library_class.hold_data(holds_source))
+            self.assertEqual(library_class.checkout_data(checkouts), library_class.checkout_data(checkouts_source))
+            library_obj = library_class(driver, extract_in_browser=True)
+            self.assertEqual(library_obj.item_selectors(), (library_class.HOLD_SELECTOR,
+                                                            library_class.CHECKOUT_SELECTOR))
+            titles = [item.title for item in library_obj.parse_snapshot(holds_source, checkouts_source)["holds"]]
+            self.assertEqual([item.title for item in library_obj.parse_snapshot(holds, checkouts)["holds"]], titles)
+
+    def test_items_extracted_with_another_selector_are_rejected(self):
+        items = BrowserItems(".item-wrapper", [["Title"]])
+        self.assertEqual(extract_item_lines(items, ".item-wrapper"), [["Title"]])
+        self.assertRaises(ValueError, extract_item_lines, items, "div.cp-batch-actions-list-item")
+        self.assertIsNone(PPL().item_selectors())
+
+
+def chrome_available():
+    browsers = ("google-chrome", "google-chrome-stable", "chromium", "chromium-browser")
+    return shutil.which("chromedriver") is not None and any(shutil.which(browser) for browser in browsers)
+
+
+@unittest.skipUnless(chrome_available(), "ITEM_LINES_SCRIPT is run in headless Chrome, which isn't installed")
+class BrowserScript(unittest.TestCase):
+    # text nodes the script must skip, merge, collapse or keep exactly like the soup engine
+    edge_page = ('<html><body><div class="item"> <span>Title</span>\n  <script>var hidden = 1;</script>'
+                 '<style>.hidden {}</style><template>hidden</template>before<!-- note -->after\t\n'
+                 '<pre>  kept   as is  </pre><textarea>  </textarea>&nbsp;<b>bold</b> <i>italic</i>\n\n'
+                 '<ruby>kan<rp>(</rp><rt>ji</rt><rp>)</rp></ruby></div>'
+                 '<div class="item"></div><div class="item">  \n  </div></body></html>')
+
+    @classmethod
+    def setUpClass(cls):
+        cls.driver = headless_chrome()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.driver.quit()
+
+    def browser_lines(self, page_source, selector):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "page.html")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(page_source)
+            self.driver.get("file://" + path)
+            return list(extract_in_browser(self.driver, selector))
+
+    def test_script_matches_the_soup_engine_on_the_pages(self):
+        for system in ("ppl", "wpl", "tpl"):
+            for page in ("holds", "checkouts"):
+                page_source = synthetic_page(system, page, 3)
+                selector = PAGE_SELECTORS[(system, page)]
+                self.assertEqual(self.browser_lines(page_source, selector),
+                                 extract_item_lines(page_source, selector, "soup"))
+
+    def test_script_follows_the_whitespace_and_text_node_rules_of_the_soup_engine(self):
+        lines = self.browser_lines(self.edge_page, "div.item")
+        self.assertEqual(lines, extract_item_lines(self.edge_page, "div.item", "soup"))
+        self.assertIn("  kept   as is  ", lines[0])
+        self.assertNotIn("var hidden = 1;", lines[0])
+
+
+@unittest.skipUnless(chrome_available(), "the Selenium flow is run in headless Chrome, which isn't installed")
+class ReplaySelenium(unittest.TestCase):
+    def setUp(self):
+        self.driver = headless_chrome()
+
+    def tearDown(self):
+        self.driver.quit()
+
+    def test_snapshot_reads_the_same_items_as_the_http_backend(self):
+        for library_class, system in ((PPL, "ppl"), (TPL, "tpl")):
+            with self.subTest(system=system), ReplayServer(system) as server:
+                backend = HttpBackend(server.site)
+                try:
+                    expected = library_class().parse_snapshot(*backend.snapshot_pages("patron", "secret"))
+                finally:
+                    backend.close()
+                self.driver.delete_all_cookies()
+                library_obj = library_class(self.driver, account_url=server.base_url, site_url=server.base_url)
+                items = library_obj.snapshot("patron", "secret")
+                for kind in ("holds", "checkouts"):
+                    self.assertTrue(items[kind])
+                    self.assertEqual([item.to_dict() for item in items[kind]],
+                                     [item.to_dict() for item in expected[kind]])
+
+    def test_snapshot_signs_in_once_and_loads_the_checkouts_in_a_second_tab(self):
+        for library_class, system, checkouts_path in ((PPL, "ppl", "/checkedout"), (TPL, "tpl", "/checkouts")):
+            with self.subTest(system=system), ReplayServer(system) as server:
+                self.driver.delete_all_cookies()
+                library_obj = library_class(self.driver, account_url=server.base_url, site_url=server.base_url)
+                library_obj.snapshot("patron", "secret")
+                self.assertEqual(len([request for request in server.requests if request[0] == "POST"]), 1)
+                self.assertIn(("GET", checkouts_path), server.requests)
+                self.assertEqual(len(library_obj.load_times), 2)
+                self.assertEqual(self.driver.window_handles, [self.driver.current_window_handle])
+
+    def test_a_wrong_password_raises_login_error(self):
+        for library_class, system in ((PPL, "ppl"), (TPL, "tpl")):
+            with self.subTest(system=system), ReplayServer(system) as server:
+                self.driver.delete_all_cookies()
+                library_obj = library_class(self.driver, account_url=server.base_url, site_url=server.base_url)
+                with self.assertRaises(LoginError) as raised:
+                    library_obj.snapshot("patron", "wrong")
+                self.assertEqual(raised.exception.outcome.kind, LoginOutcome.BAD_CREDENTIALS)
+                self.assertEqual(len(self.driver.window_handles), 1)
+
+
+class GatewayDriver:
+    """
+    A driver whose performance log holds the network events of the gateway responses of the given payloads
+    """
+
+    def __init__(self, stale_payloads=(), base64_encoded=False, pages=None):
+        self.base64_encoded = base64_encoded
+        self.bodies = {}
+        self.log = []
+        self.loaded = []
+        self.pages = pages or {}  # the payloads of the urls the browser can fetch
+        self.fetched = []
+        for kind, payload in stale_payloads:
+            self.respond(kind, payload)
+
+    @staticmethod
+    def event(method, **params):
+        return {"level": "INFO", "message": json.dumps({"message": {"method": method, "params": params}})}
+
+    def respond(self, kind, payload, url=None):
+        request_id = f"1000.{len(self.bodies)}"
+        url = url or f"https://gateway.bibliocommons.com/v2/libraries/pickering/{kind}?page=1&limit=25"
+        self.bodies[request_id] = json.dumps(payload)
+        self.log.append(self.event("Network.responseReceived", requestId=request_id, type="XHR",
+                                   response={"url": url, "status": 200}))
+        self.log.append(self.event("Network.loadingFinished", requestId=request_id))
+
+    def get_log(self, log_type):
+        assert log_type == "performance"
+        log, self.log = self.log, []
+        return log
+
+    def execute_cdp_cmd(self, cmd, cmd_args):
+        assert cmd == "Network.getResponseBody"
+        body = self.bodies[cmd_args["requestId"]]
+        if self.base64_encoded:
+            return {"body": base64.b64encode(body.encode('utf-8')).decode('ascii'), "base64Encoded": True}
+        return {"body": body, "base64Encoded": False}
+
+    def execute_async_script(self, script, url):
+        self.fetched.append(url)
+        if url not in self.pages:
+            return {"error": "Error: HTTP 404"}
+        return {"body": json.dumps(self.pages[url])}
+
+    def get(self, url):
+        self.loaded.append(url)
+        self.respond("checkouts", load_sample("ppl", "checkouts"))
+
+
+class GatewayCaptures(unittest.TestCase):
+    wpl_holds_url = "https://gateway.bibliocommons.com/v2/libraries/whitby/holds?page=1&limit=2"
+
+    def test_gateway_items_match_the_items_parsed_from_the_pages(self):
+        for system, library_class in (("ppl", PPL), ("wpl", WPL)):
+            pages = library_class().parse_snapshot(synthetic_page(system, "holds", 3),
+                                                   synthetic_page(system, "checkouts", 2))
+            samples = {"holds": [load_sample(system, "holds")], "checkouts": [load_sample(system, "checkouts")]}
+            if system == "wpl":
+                samples["holds"].insert(0, load_sample("wpl", "holds", page=2))
+            for kind in ("holds", "checkouts"):
+                # the samples were captured on the day the checkouts of the pages were due in 6 and 21 days
+                items = items_from_payloads(kind, samples[kind], date(2022, 1, 5))
+                self.assertEqual([vars(item) for item in items],
+                                 [dict(vars(item), date_retrieved=date(2022, 1, 5)) for item in pages[kind]])
+
+    def test_display_dates_abbreviate_months_like_the_pages(self):
+        self.assertEqual(display_date("2024-01-13"), "Jan. 13, 2024")
+        self.assertEqual(display_date("2022-05-09T00:00:00"), "May 09, 2022")
+        self.assertEqual(display_date(None), "")
+
+    def test_later_pages_of_results_are_fetched(self):
+        page_2_url = "https://gateway.bibliocommons.com/v2/libraries/whitby/holds?limit=2&page=2"
+        driver = GatewayDriver(pages={page_2_url: load_sample("wpl", "holds", page=2)})
+        capture = GatewayCapture(driver)
+        driver.respond("holds", load_sample("wpl", "holds"), url=self.wpl_holds_url)
+        self.assertTrue(capture.captured("holds")(driver))
+        self.assertEqual(capture.missing_pages("holds"), [2])
+        capture.fetch_missing_pages("holds")
+        self.assertEqual(driver.fetched, [page_2_url])
+        self.assertEqual(capture.missing_pages("holds"), [])
+        self.assertEqual([item.title for item in capture.items("holds")], ["Why Do We Fight?", "France", "Rated R"])
+
+    def test_a_page_that_cant_be_fetched_fails_the_capture(self):
+        driver = GatewayDriver()
+        capture = GatewayCapture(driver)
+        driver.respond("holds", load_sample("wpl", "holds"), url=self.wpl_holds_url)
+        library_obj = WPL(driver, capture_gateway=True)
+        self.assertRaises(GatewayError, library_obj.gateway_snapshot, capture,
+                          library_obj.account_url + "/v2/checkedout")
+        self.assertEqual(driver.loaded, [])
+
+    def test_gateway_statuses_and_pages(self):
+        holds = load_sample("ppl", "holds")
+        ready = holds["entities"]["holds"]["1470002"]
+        ready.update(status="READY_FOR_PICKUP", pickupByDate="2022-01-19")
+        second_page = {"borrowing": {"holds": {"results": ["1470003", "1470001"]}},
+                       "entities": {"holds": {"1470001": holds["entities"]["holds"]["1470001"]}}}
+        items = items_from_payloads("holds", [holds, second_page], date(2022, 1, 5))
+        self.assertEqual([item.title for item in items], ["Why Do We Fight?", "France", "Rated R"])
+        self.assertEqual((items[1].status, items[1].item_date), ("Ready", "Jan. 19, 2022"))
+        checkouts = load_sample("ppl", "checkouts")
+        statuses = [item.status for item in items_from_payloads("checkouts", [checkouts], date(2022, 1, 10))]
+        self.assertEqual(statuses, ["Due Soon", "Due Later"])
+        statuses = [item.status for item in items_from_payloads("checkouts", [checkouts], date(2022, 1, 12))]
+        self.assertEqual(statuses, ["Overdue", "Due Later"])
+
+    def test_capture_reads_only_new_gateway_responses(self):
+        driver = GatewayDriver(stale_payloads=[("holds", {"borrowing": {}, "entities": {}})], base64_encoded=True)
+        capture = GatewayCapture(driver)
+        self.assertFalse(capture.captured("holds")(driver))
+        driver.respond("holds", {"ignored": True}, url="https://pickering.bibliocommons.com/v2/holds")
+        driver.respond("holds", load_sample("ppl", "holds"))
+        self.assertTrue(capture.captured("holds")(driver))
+        self.assertFalse(capture.captured("checkouts")(driver))
+        self.assertEqual(len(capture.payloads["holds"]), 1)
+        self.assertEqual([item.title for item in capture.items("holds")],
+                         ["Why Do We Fight?", "France", "Rated R"])
+
+    def test_gateway_snapshot(self):
+        driver = GatewayDriver()
+        capture = GatewayCapture(driver)
+        driver.respond("holds", load_sample("ppl", "holds"))
+        library_obj = PPL(driver, capture_gateway=True)
+        snapshot = library_obj.gateway_snapshot(capture, library_obj.account_url + "/checkedout")
+        self.assertEqual(driver.loaded, ["https://pickering.bibliocommons.com/checkedout"])
+        self.assertEqual([len(snapshot["holds"]), len(snapshot["checkouts"])], [3, 2])
+        self.assertEqual(library_obj.checkouts[0].title, "My Life in Full")
+
+
+class ConsolidatedTexts(unittest.TestCase):
+    def test_sections_are_packed_into_as_few_bodies_as_possible(self):
+        sections = ["a" * 700, "b" * 700, "c" * 700, "\n".join(["d" * 100] * 20)]
+        bodies = pack_bodies(sections)
+        self.assertEqual(len(bodies), 3)
+        self.assertEqual(bodies[0], "a" * 700 + "\n\n" + "b" * 700)
+        self.assertTrue(bodies[1].startswith("c" * 700 + "\n\n" + "d" * 100 + "\n"))
+        self.assertTrue(all(len(body) <= MAX_BODY_LENGTH for body in bodies))
+        self.assertEqual(''.join(bodies).replace('\n', ''), ''.join(sections).replace('\n', ''))
+        self.assertEqual(pack_bodies(["x" * 3500], limit=MAX_BODY_LENGTH), ["x" * 1600, "x" * 1600, "x" * 300])
+        self.assertEqual(pack_bodies(["\n", ""]), [])
+
+    def test_one_pooled_client_per_process(self):
+        self.assertIs(twilio_client("ACtest", "token", "http://127.0.0.1:1"),
+                      twilio_client("ACtest", "token", "http://127.0.0.1:1"))
+        self.assertIsNot(twilio_client("ACtest", "token", "http://127.0.0.1:1"),
+                         twilio_client("ACother", "token", "http://127.0.0.1:1"))
+
+    def test_session_sends_one_text_per_recipient(self):
+        checkouts, holds = sample_items(2, False), sample_items(2, True)
+        with TwilioStub() as stub:
+            session = MessagingSession(twilio_client("ACtest", "token", stub.base_url), from_="+15550000000")
+            threads = [threading.Thread(target=session.add_items, args=("+15551234567", library, checkouts, holds))
+                       for library in ("Pickering Public Library", "Whitby Public Library")]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            session.add_items("+15557654321", "Toronto Public Library", holds=holds)
+            session.add_text("+15557654321", "Whitby Public Library isn't responding")
+            sent = session.send()
+            self.assertEqual({phone: len(messages) for phone, messages in sent.items()},
+                             {"+15551234567": 1, "+15557654321": 1})
+            body = stub.bodies("+15551234567")[0]
+            for heading in ("Pickering Public Library CHECKOUTS", "Pickering Public Library HOLDS",
+                            "Whitby Public Library CHECKOUTS", "Whitby Public Library HOLDS"):
+                self.assertEqual(body.count(heading), 1)
+            self.assertTrue(stub.bodies("+15557654321")[0].endswith("Whitby Public Library isn't responding"))
+            self.assertEqual(sent["+15557654321"][0].status, "queued")
+            self.assertEqual((stub.requests, stub.connections), (2, 1))
+            self.assertEqual(session.send(), {})
+
+    def test_long_texts_are_split_within_the_body_limit(self):
+        with TwilioStub() as stub:
+            session = MessagingSession(twilio_client("ACtest", "token", stub.base_url), from_="+15550000000")
+            for library in ("Pickering Public Library", "Whitby Public Library", "Toronto Public Library"):
+                session.add_items("+15551234567", library, sample_items(10, False), sample_items(10, True))
+            expected = session.bodies("+15551234567")
+            session.send()
+            self.assertGreater(len(expected), 1)
+            self.assertEqual(stub.bodies("+15551234567"), expected)
+            self.assertTrue(all(len(body) <= MAX_BODY_LENGTH for body in expected))
+
+    def test_unsent_texts_stay_pending_when_sending_fails(self):
+        with TwilioStub() as stub:
+            # a limit above the API's lets a body through that the stub rejects
+            session = MessagingSession(twilio_client("ACtest", "token", stub.base_url), from_="+15550000000",
+                                       limit=2 * MAX_BODY_LENGTH)
+            session.add_text("+15551234567", "Your holds")
+            session.add_text("+15557654321", "x" * (MAX_BODY_LENGTH + 1))
+            session.add_text("+15550001111", "Your checkouts")
+            self.assertRaises(TwilioRestException, session.send)
+            self.assertEqual(stub.bodies("+15551234567"), ["Your holds"])
+            self.assertEqual(session.pending, {"+15557654321": ["x" * (MAX_BODY_LENGTH + 1)],
+                                               "+15550001111": ["Your checkouts"]})
+            session.limit = MAX_BODY_LENGTH
+            session.send()
+            self.assertEqual(stub.bodies("+15551234567"), ["Your holds"])
+            self.assertEqual(stub.bodies("+15550001111"), ["Your checkouts"])
+            self.assertEqual(session.pending, {})
+
+
+class OutboxDelivery(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "state", "outbox.sqlite3")
+        self.now = 1_700_000_000.0
+        self.outbox = Outbox(self.path, lease=60, clock=lambda: self.now)
+
+    def tearDown(self):
+        self.outbox.close()
+        self.directory.cleanup()
+
+    def test_messages_are_enqueued_once(self):
+        self.assertTrue(self.outbox.enqueue("+15551234567", "Your holds"))
+        self.assertFalse(self.outbox.enqueue("+15551234567", "Your holds"))
+        self.assertTrue(self.outbox.enqueue("+15557654321", "Your holds"))
+        self.now += 24 * 60 * 60
+        self.assertTrue(self.outbox.enqueue("+15551234567", "Your holds"))
+        session = MessagingSession()
+        session.add_text("+15551234567", "Your checkouts")
+        self.assertEqual(session.enqueue(self.outbox), 1)
+        session.add_text("+15551234567", "Your checkouts")
+        self.assertEqual(session.enqueue(self.outbox), 0)
+        self.assertEqual(self.outbox.counts()[PENDING], 4)
+
+    def test_a_restart_resumes_pending_and_abandoned_sends(self):
+        self.outbox.enqueue("+15551234567", "first")
+        self.outbox.enqueue("+15551234567", "second")
+        claimed = self.outbox.claim()
+        self.assertEqual((claimed.body, claimed.status, claimed.attempts), ("first", SENDING, 1))
+        self.outbox.close()
+        # the process that claimed "first" crashed before sending it
+        self.outbox = Outbox(self.path, lease=60, clock=lambda: self.now)
+        second = self.outbox.claim()
+        self.assertEqual(second.body, "second")
+        self.assertIsNone(self.outbox.claim())
+        self.outbox.mark_sent(second.id, "SM2")
+        self.assertEqual(self.outbox.due_in(), 60)
+        self.now += 60
+        reclaimed = self.outbox.claim()
+        self.assertEqual((reclaimed.body, reclaimed.attempts), ("first", 2))
+        self.outbox.retry(reclaimed.id, ConnectionError("reset"), 30)
+        self.assertIsNone(self.outbox.claim())
+        self.now += 30
+        self.assertEqual(self.outbox.claim().id, reclaimed.id)
+
+    def test_deliver_retries_transient_errors_and_fails_the_rest(self):
+        outbox = Outbox(self.path)
+        for body in ("flaky", "invalid", "fine"):
+            outbox.enqueue("+15551234567", body)
+        calls = []
+
+        def send(message):
+            calls.append(message.body)
+            if message.body == "flaky" and calls.count("flaky") == 1:
+                raise requests.ConnectionError("connection reset")
+            if message.body == "invalid":
+                raise TwilioRestException(400, "https://api.twilio.com", "The 'To' number is not valid")
+            return "SM" + message.body
+
+        stats = asyncio.run(deliver(outbox, {"twilio": send}, workers=2, rates={},
+                                    retry_policy=RetryPolicy(attempts=3, base_delay=0.0), poll_interval=0.01))
+        self.assertEqual((stats.sent, stats.retried, stats.failed), (2, 1, 1))
+        self.assertEqual(sorted(calls), ["fine", "flaky", "flaky", "invalid"])
+        self.assertEqual([message.provider_id for message in outbox.messages(SENT)], ["SMflaky", "SMfine"])
+        self.assertIn("not valid", outbox.messages(FAILED)[0].last_error)
+        outbox.close()
+
+    def test_background_delivery_sends_through_twilio(self):
+        with TwilioStub() as stub, Outbox(self.path) as outbox:
+            outbox.enqueue("+15551234567", "left over by an earlier run")
+            sender = TwilioSender(twilio_client("ACtest", "token", stub.base_url), from_="+15550000000")
+            with BackgroundDelivery(outbox, senders={"twilio": sender}, rates={}, poll_interval=0.01) as delivery:
+                session = MessagingSession()
+                session.add_items("+15557654321", "Pickering Public Library", sample_items(2, False))
+                session.enqueue(outbox)
+            self.assertEqual(delivery.stats.sent, 2)
+            self.assertEqual(outbox.counts(), {PENDING: 0, SENDING: 0, SENT: 2, FAILED: 0})
+            self.assertEqual(stub.bodies("+15551234567"), ["left over by an earlier run"])
+            self.assertTrue(all(message.provider_id.startswith("SM") for message in outbox.messages()))
+
+    def test_sends_are_spaced_by_the_rate_of_their_provider(self):
+        async def waits():
+            limiter = ProviderRateLimiter({"twilio": 1200})
+            return [await limiter.wait("twilio") for _ in range(3)] + [await limiter.wait("other")]
+        delays = asyncio.run(waits())
+        self.assertEqual(delays[0], 0.0)
+        self.assertGreater(delays[1], 0.04)
+        self.assertGreater(delays[2], 0.0)
+        self.assertEqual(delays[3], 0.0)
+
+
+class SnapshotDiffs(unittest.TestCase):
+    @staticmethod
+    def item(title, is_hold, status, item_date, system='durham', contributors="Walker, Niki", day=date(2022, 1, 13)):
+        return Item(day, title, "Book", is_hold, status, item_date, "Central Library" if is_hold else "", system,
+                    contributors)
+
+    def test_changes_are_classified(self):
+        previous = [self.item("Ready Soon", True, "Not Ready", "Jan. 20, 2022"),
+                    self.item("Cancelled", True, "Not Ready", "Jan. 20, 2022"),
+                    self.item("Expiry Moved", True, "Not Ready", "Jan. 20, 2022"),
+                    self.item("Renewed", False, "Due Soon", "Jan. 14, 2022"),
+                    self.item("Recalled", False, "Due Later", "Feb. 01, 2022"),
+                    self.item("Late", False, "Due Soon", "Jan. 13, 2022"),
+                    self.item("Returned", False, "Due Later", "Jan. 20, 2022"),
+                    self.item("Unchanged", False, "Due Later", "Jan. 20, 2022"),
+                    self.item("Two Copies", False, "Due Later", "Jan. 20, 2022"),
+                    self.item("Two Copies", False, "Due Later", "Jan. 27, 2022")]
+        current = [self.item("Ready Soon", True, "Ready", "Jan. 20, 2022"),
+                   self.item("Expiry Moved", True, "Not Ready", "Mar. 20, 2022"),
+                   self.item("Renewed", False, "Due Later", "Feb. 04, 2022"),
+                   self.item("Recalled", False, "Due Later", "Jan. 25, 2022"),
+                   self.item("Late", False, "Overdue", "Jan. 13, 2022"),
+                   self.item("Unchanged", False, "Due Later", "Jan. 20, 2022", day=date(2022, 1, 14)),
+                   self.item("Two Copies", False, "Due Later", "Jan. 20, 2022"),
+                   self.item("Two Copies", False, "Due Later", "Jan. 27, 2022"),
+                   self.item("New", False, "Due Later", "Feb. 10, 2022")]
+        changes = [(change.kind, change.item.title) for change in diff_items(previous, current)]
+        self.assertEqual(changes, [(HOLD_READY, "Ready Soon"), (NOW_OVERDUE, "Late"), (DUE_DATE_MOVED, "Recalled"),
+                                   (RENEWED, "Renewed"), (CHECKED_OUT, "New"), (RETURNED, "Returned"),
+                                   (HOLD_REMOVED, "Cancelled"), (HOLD_UPDATED, "Expiry Moved")])
+
+    def test_relative_dates_of_the_same_day_are_unchanged(self):
+        yesterday = [self.item("Soon", False, "Due Tomorrow", "Tomorrow", 'toronto', "Qiu, Juntao")]
+        today = [self.item("Soon", False, "Due Today", "Today", 'toronto', "Qiu, Juntao", day=date(2022, 1, 14))]
+        self.assertEqual([change.kind for change in diff_items(yesterday, today)], [])
+        later = [self.item("Soon", False, "Due Later", "Sat 29 Jan", 'toronto', "Qiu, Juntao", day=date(2022, 1, 14))]
+        self.assertEqual([change.kind for change in diff_items(yesterday, later)], [RENEWED])
+
+    def test_only_changes_are_texted_after_the_first_run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "snapshots.json")
+            items = {"holds": [self.item("Ready Soon", True, "Not Ready", "Jan. 20, 2022")],
+                     "checkouts": [self.item("Learning React", False, "Due Later", "Sat 16 Oct", 'toronto',
+                                             "Banks, Alex (Software engineer)")]}
+            session = MessagingSession()
+            self.assertIsNone(add_account_snapshot(session, "+15551234567", "Toronto Public Library", items,
+                                                   SnapshotStore(path), "tpl", "patron"))
+            self.assertEqual(len(session.pending["+15551234567"]), 2)
+            self.assertFalse(os.path.exists(path))
+            store = SnapshotStore(path)
+            store.update("tpl", "patron", items)
+            store.save()
+            self.assertNotIn("patron", open(path, encoding='utf-8').read())
+
+            store = SnapshotStore(path)
+            self.assertEqual(store.get("tpl", "patron"), items["holds"] + items["checkouts"])
+            session = MessagingSession()
+            self.assertEqual(add_account_snapshot(session, "+15551234567", "Toronto Public Library", items, store,
+                                                  "tpl", "patron"), [])
+            self.assertEqual(session.pending, {})
+
+            items["holds"] = [self.item("Ready Soon", True, "Ready", "Jan. 20, 2022")]
+            changes = add_account_snapshot(session, "+15551234567", "Toronto Public Library", items, store, "tpl",
+                                           "patron")
+            self.assertEqual([change.kind for change in changes], [HOLD_READY])
+            text = session.bodies("+15551234567")
+            self.assertEqual(len(text), 1)
+            self.assertIn("Toronto Public Library UPDATES", text[0])
+            self.assertIn("1. Ready for pickup: Ready Soon (Book) Walker, Niki | Ready | Jan. 20, 2022 | Central "
+                          "Library", text[0])
+            self.assertNotIn("Learning React", text[0])
+
+    def test_a_sharp_drop_is_held_back_until_the_next_run_sees_it(self):
+        checkouts = [self.item(f"Book {i}", False, "Due Later", "Jan. 20, 2022") for i in range(6)]
+
+        def kinds(changes):
+            return [change.kind for change in changes]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "state", "snapshots.json")
+            store = SnapshotStore(path)
+            store.update("ppl", "patron", {"holds": [], "checkouts": checkouts})
+            with self.assertLogs("snapshot_store", level="WARNING"):
+                self.assertEqual(store.update("ppl", "patron", {"holds": [], "checkouts": []}), [])
+            self.assertEqual(store.get("ppl", "patron"), checkouts)
+            self.assertEqual(kinds(store.update("ppl", "patron", {"holds": [], "checkouts": checkouts[:5]})),
+                             [RETURNED])
+            with self.assertLogs("snapshot_store", level="WARNING"):
+                self.assertEqual(store.update("ppl", "patron", {"holds": [], "checkouts": checkouts[:2]}), [])
+            store.save()
+            store = SnapshotStore(path)
+            self.assertEqual(kinds(store.update("ppl", "patron", {"holds": [], "checkouts": checkouts[:2]})),
+                             [RETURNED] * 3)
+
+    def test_items_missing_from_a_snapshot_that_skipped_items_are_kept(self):
+        hold = self.item("Ready Soon", True, "Not Ready", "Jan. 20, 2022")
+        checkouts = [self.item(f"Book {i}", False, "Due Later", "Jan. 20, 2022") for i in range(2)]
+        new_checkout = self.item("Book 2", False, "Due Later", "Jan. 20, 2022")
+        store = SnapshotStore(None)
+        store.update("ppl", "patron", {"holds": [hold], "checkouts": checkouts, "skipped_items": 0})
+        changes = store.update("ppl", "patron", {"holds": [], "checkouts": checkouts[1:] + [new_checkout],
+                                                 "skipped_items": 2})
+        self.assertEqual([change.kind for change in changes], [CHECKED_OUT])
+        self.assertEqual(store.get("ppl", "patron"), checkouts[1:] + [new_checkout, checkouts[0], hold])
+        # once the items parse again, they are neither returned nor checked out again
+        self.assertEqual(store.update("ppl", "patron", {"holds": [hold], "checkouts": checkouts + [new_checkout],
+                                                        "skipped_items": 0}), [])
+        changes = store.update("ppl", "patron", {"holds": [], "checkouts": checkouts, "skipped_items": 0})
+        self.assertEqual([change.kind for change in changes], [RETURNED, HOLD_REMOVED])
@@ -2,29 +2,32 @@
 as a text message"""
 
 from library import TPL
-from selenium import webdriver
+from driver_pool import DriverPool
 from lib_assets import Messenger
 
-def tpl_with_google_doc_text_message(phone_number, username, password):
-    options = webdriver.ChromeOptions()
-    options.add_argument('--headless')
-    driver = webdriver.Chrome(options=options)
-    tpl = TPL(driver)
-    messenger = Messenger(tpl.name)
-    messenger.send_checkouts_text(phone_number, tpl.items_checked_out(username, password), "plain")
+def tpl_with_google_doc_text_message(phone_number, username, password, driver_pool):
+    tpl = TPL(driver_pool=driver_pool)
+    try:
+        messenger = Messenger(tpl.name)
+        messenger.send_checkouts_text(phone_number, tpl.items_checked_out(username, password), "plain")
+    finally:
+        # returns the borrowed driver to the pool even if the scrape or the text failed
+        tpl.close()
 
-def tpl_without_text_message(phone_number, username, password):
-    options = webdriver.ChromeOptions()
-    options.add_argument('--headless')
-    driver = webdriver.Chrome(options=options)
-    tpl = TPL(driver)
-    messenger = Messenger(tpl.name)
-    messenger.send_checkouts_text(phone_number, tpl.items_checked_out(username, password), "doc")
+def tpl_without_text_message(phone_number, username, password, driver_pool):
+    tpl = TPL(driver_pool=driver_pool)
+    try:
+        messenger = Messenger(tpl.name)
+        messenger.send_checkouts_text(phone_number, tpl.items_checked_out(username, password), "doc")
+    finally:
+        tpl.close()
 
 
 if __name__ == "__main__":
     receiving_phone_number = "+1123456789"
     username = "my_username"
     password = "my_password"
-    tpl_with_google_doc_text_message(receiving_phone_number, username, password)
-    tpl_without_text_message(receiving_phone_number, username, password)
\ No newline at end of file
+    # both examples borrow the same Chrome instance instead of starting one each
+    with DriverPool(size=1) as pool:
+        tpl_with_google_doc_text_message(receiving_phone_number, username, password, pool)
+        tpl_without_text_message(receiving_phone_number, username, password, pool)
\ No newline at end of file
@@ -0,0 +1,236 @@
+"""
+Lightweight tracing of the phases of a scrape: page loads, waits, reading page sources, extraction, parsing and
+sending messages. Tracing is off until enable is called, and until then a span costs one global lookup.
+
+Spans are recorded per thread. Once a run is done, the spans can be written to a trace file in the Chrome trace event
+format (open it in chrome://tracing or https://ui.perfetto.dev), or summed per phase with Tracer.summary.
+
+Usage:
+    tracer = tracing.enable()
+    ...
+    tracer.export_chrome_trace("trace.json")
+    print(tracer.summary())
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+from selenium.webdriver.support.ui import WebDriverWait as SeleniumWebDriverWait
+
+# the tracer spans are recorded with, or None while tracing is disabled
+_tracer = None
+_NO_SPAN = nullcontext()
+
+
+class Span:
+    """
+    A phase being timed. Use Tracer.span or span to create one.
+    """
+
+    __slots__ = ("tracer", "name", "category", "args", "start", "child_seconds")
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = 0.0
+        self.child_seconds = 0.0
+
+    def __enter__(self):
+        self.tracer._stack().append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        end = time.perf_counter()
+        stack = self.tracer._stack()
+        stack.pop()
+        if stack:
+            stack[-1].child_seconds += end - self.start
+        if exc_type is not None:
+            self.args = dict(self.args, error=f"{exc_type.__name__}: {exc_value}")
+        self.tracer._record(self, end)
+        return False
+
+
+class Tracer:
+    """
+    Records the spans of every thread
+
+    Attributes:
+      - events: the complete ("X") events of the Chrome trace event format, in the order the spans ended
+    """
+
+    def __init__(self):
+        self.events = []
+        self._phases = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        self._threads = {}
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def span(self, name, category="libscrape", args=None):
+        return Span(self, name, category, args or {})
+
+    def _record(self, span, end):
+        seconds = end - span.start
+        thread = threading.current_thread()
+        event = {"name": span.name, "cat": span.category, "ph": "X", "pid": self._pid, "tid": thread.ident,
+                 "ts": (span.start - self._origin) * 1e6, "dur": seconds * 1e6}
+        if span.args:
+            event["args"] = span.args
+        with self._lock:
+            self.events.append(event)
+            self._threads.setdefault(thread.ident, thread.name)
+            calls, total, self_seconds, longest = self._phases.get(span.name, (0, 0.0, 0.0, 0.0))
+            self._phases[span.name] = (calls + 1, total + seconds, self_seconds + seconds - span.child_seconds,
+                                       max(longest, seconds))
+
+    def phases(self):
+        """
+        Returns the calls, total seconds, seconds outside of nested spans and longest call of every phase
+
+        Returns
+        -------
+        dict
+            (calls, total, self, longest) keyed by span name
+        """
+        with self._lock:
+            return dict(self._phases)
+
+    def export_chrome_trace(self, path):
+        """
+        Writes the spans to a json file in the Chrome trace event format
+        """
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self._threads)
+        metadata = [{"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid, "args": {"name": name}}
+                    for tid, name in threads.items()]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f)
+            f.write('\n')
+
+    def summary(self):
+        """
+        Returns a plain text table of the time spent in every phase, slowest first
+        """
+        lines = [f"{'phase':<44}{'calls':>7}{'total (s)':>11}{'self (s)':>10}{'mean (ms)':>11}{'max (ms)':>10}"]
+        phases = sorted(self.phases().items(), key=lambda phase: -phase[1][1])
+        for name, (calls, total, self_seconds, longest) in phases:
+            lines.append(f"{name[:43]:<44}{calls:>7}{total:>11.3f}{self_seconds:>10.3f}{total / calls * 1000:>11.1f}"
+                         f"{longest * 1000:>10.1f}")
+        return '\n'.join(lines)
+
+
+def enable(tracer=None):
+    """
+    Starts recording spans with tracer (a new Tracer if not given) and returns it
+    """
+    global _tracer
+    _tracer = tracer or Tracer()
+    return _tracer
+
+
+def disable():
+    """
+    Stops recording spans and returns the tracer they were recorded with, if any
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def active_tracer():
+    return _tracer
+
+
+def span(name, category="libscrape", **args):
+    """
+    Returns a context manager that times the phase inside its with block while tracing is enabled
+
+    Parameters
+    ----------
+    name: str
+        The name of the phase (e.g. "driver.get")
+    category: str
+        The category of the phase (e.g. "selenium", "parse", "messaging")
+    args:
+        Details recorded with the span (e.g. url="...")
+    """
+    if _tracer is None:
+        return _NO_SPAN
+    return _tracer.span(name, category, args)
+
+
+def traced(name=None, category="libscrape"):
+    """
+    Decorates a function so that every call is a span while tracing is enabled
+
+    Parameters
+    ----------
+    name: str
+        The name of the phase. Defaults to the qualified name of the function (e.g. "PPL.login").
+    category: str
+        The category of the phase
+    """
+    def decorate(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _tracer.span(span_name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def condition_name(condition):
+    name = getattr(condition, "__name__", None) or type(condition).__name__
+    return "condition" if name == "<lambda>" else name
+
+
+class WebDriverWait(SeleniumWebDriverWait):
+    """
+    A WebDriverWait whose waits are spans named after the expected condition (e.g. "wait: title_is")
+    """
+
+    def until(self, method, message=''):
+        if _tracer is None:
+            return super().until(method, message)
+        with _tracer.span("wait: " + condition_name(method), "selenium"):
+            return super().until(method, message)
+
+
+def traced_get(driver, url):
+    """
+    Loads a url with driver.get as a "driver.get" span
+    """
+    if _tracer is None:
+        return driver.get(url)
+    with _tracer.span("driver.get", "selenium", {"url": url}):
+        return driver.get(url)
+
+
+def traced_page_source(driver):
+    """
+    Returns driver.page_source, read as a "driver.page_source" span
+    """
+    if _tracer is None:
+        return driver.page_source
+    with _tracer.span("driver.page_source", "selenium"):
+        return driver.page_source
@@ -0,0 +1,232 @@
+"""
+A local stand-in for the Messages endpoint of the Twilio API, for testing and benchmarking the sending of texts
+without sending any. The server accepts the POST /2010-04-01/Accounts/<sid>/Messages.json requests of the Twilio
+client, records the messages and answers with the JSON of a queued message. Like the API, it rejects bodies longer
+than messaging.MAX_BODY_LENGTH characters.
+
+Every response can be delayed (latency), so that the benchmark can compare sending a run's texts the old way (a new
+client, and so a new connection, for each library's checkouts and holds) with a MessagingSession (one pooled client
+and one consolidated message per recipient). Point the senders at the server with TWILIO_API_URL=<server.base_url> or
+messaging.twilio_client(api_url=server.base_url).
+
+Usage:
+    python twilio_stub.py --port 8001
+    python twilio_stub.py --benchmark 50 --libraries 3 --items 5 --latency 0.05
+"""
+
+import argparse
+import json
+import random
+import re
+import secrets
+import threading
+import time
+from datetime import date
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from twilio.rest import Client
+
+from lib_assets import Item, Messenger, MessagingSession
+from messaging import MAX_BODY_LENGTH, RebasedHttpClient, twilio_client
+
+MESSAGES_PATH = re.compile(r'^/2010-04-01/Accounts/(?P<account_sid>[^/]+)/Messages\.json$')
+# the code of the error the API answers a body that is too long with
+BODY_TOO_LONG = 21617
+
+
+class TwilioStub:
+    """
+    A local server that stands in for the Messages endpoint of the Twilio API
+
+    Attributes:
+      - latency: the number of seconds every response is delayed, or the (min, max) of a random delay
+      - messages: the form fields of every message accepted (To, From, Body), with its account under "AccountSid"
+      - requests: the number of requests served
+      - connections: the number of connections clients opened
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0, seed=None):
+        self.latency = latency
+        self.messages = []
+        self.requests = 0
+        self.connections = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="twilio-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.stop()
+
+    def bodies(self, phone_number):
+        """
+        Returns the bodies of the messages sent to a phone number, in the order they were accepted
+        """
+        with self._lock:
+            return [message["Body"] for message in self.messages if message.get("To") == phone_number]
+
+    def _delay(self):
+        with self._lock:
+            self.requests += 1
+            return self._rng.uniform(*self.latency) if isinstance(self.latency, tuple) else self.latency
+
+    def _accept(self, account_sid, form):
+        """
+        Records a message and returns the status and JSON of the answer
+        """
+        body = form.get("Body", "")
+        if len(body) > MAX_BODY_LENGTH:
+            return 400, {"code": BODY_TOO_LONG, "status": 400, "more_info": "https://www.twilio.com/docs/errors/21617",
+                         "message": f"The concatenated message body exceeds the {MAX_BODY_LENGTH} character limit."}
+        sid = "SM" + secrets.token_hex(16)
+        with self._lock:
+            self.messages.append(dict(form, AccountSid=account_sid))
+        now = formatdate(usegmt=True)
+        return 201, {"sid": sid, "account_sid": account_sid, "to": form.get("To"), "from": form.get("From"),
+                     "body": body, "status": "queued", "num_segments": str(-(-len(body) // 153) if body else 1),
+                     "num_media": "0", "direction": "outbound-api", "api_version": "2010-04-01",
+                     "date_created": now, "date_updated": now, "date_sent": None, "error_code": None,
+                     "error_message": None, "price": None, "price_unit": "USD",
+                     "uri": f"/2010-04-01/Accounts/{account_sid}/Messages/{sid}.json", "subresource_uris": {}}
+
+    def _handler_class(self):
+        server = self
+
+        class TwilioHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keeps connections alive between requests
+            # the headers and body are written separately, which Nagle's algorithm would hold back on a kept-alive
+            # connection until the client acknowledges the headers
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def send(self, status, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                form = {name: values[0] for name, values in
+                        parse_qs(self.rfile.read(length).decode('utf-8'), keep_blank_values=True).items()}
+                time.sleep(server._delay())
+                match = MESSAGES_PATH.match(self.path.split('?')[0])
+                if match is None:
+                    self.send(404, {"code": 20404, "status": 404, "message": "The requested resource was not found"})
+                    return
+                self.send(*server._accept(match.group("account_sid"), form))
+
+        return TwilioHandler
+
+
+def sample_items(num_items, is_hold):
+    """
+    Returns num_items checkouts or holds with titles of typical length
+    """
+    return [Item(date.today(), f"Sample Title Number {i} of a Library Account", "Book", is_hold,
+                 "Not Ready" if is_hold else "Due Later", "Jan. 13, 2024", "Central Library" if is_hold else "",
+                 'durham', "Walker, Niki") for i in range(num_items)]
+
+
+def benchmark_sending(server, num_recipients, num_libraries=3, num_items=5):
+    """
+    Sends the checkouts and holds of every library to every recipient through the server, first with a new client
+    for each text (as Messenger.send_checkouts_text and send_holds_text used to) and then with a MessagingSession
+
+    Returns
+    -------
+    dict
+        The seconds, API calls and connections of each way, keyed by "per text" and "session"
+    """
+    libraries = [f"Library {i}" for i in range(num_libraries)]
+    checkouts, holds = sample_items(num_items, False), sample_items(num_items, True)
+    recipients = [f"+1555{i:07d}" for i in range(num_recipients)]
+    results = {}
+
+    def measure(name, send):
+        requests, connections = server.requests, server.connections
+        start = time.perf_counter()
+        send()
+        results[name] = {"seconds": time.perf_counter() - start, "api calls": server.requests - requests,
+                         "connections": server.connections - connections}
+
+    def per_text():
+        for phone_number in recipients:
+            for library in libraries:
+                messenger = Messenger(library)
+                for text in (messenger.formulate_checkouts_text(checkouts, "plain"),
+                             messenger.formulate_holds_text(holds, "plain")):
+                    client = Client("ACstub", "token", http_client=RebasedHttpClient(server.base_url))
+                    client.messages.create(body=text, from_="+15550000000", to=phone_number)
+
+    def session():
+        messaging = MessagingSession(twilio_client("ACstub", "token", server.base_url), from_="+15550000000")
+        for phone_number in recipients:
+            for library in libraries:
+                messaging.add_items(phone_number, library, checkouts, holds)
+        messaging.send()
+
+    measure("per text", per_text)
+    measure("session", session)
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--port", type=int, default=8001)
+    arg_parser.add_argument("--latency", type=float, nargs='+', default=[0.0],
+                            help="the seconds every response is delayed, or the min and max of a random delay")
+    arg_parser.add_argument("--seed", type=int, help="the seed of the random latency")
+    arg_parser.add_argument("--benchmark", type=int, metavar="RECIPIENTS",
+                            help="send the texts of this many recipients both ways and report the throughput")
+    arg_parser.add_argument("--libraries", type=int, default=3, help="the number of libraries of every recipient")
+    arg_parser.add_argument("--items", type=int, default=5, help="the number of checkouts and of holds per library")
+    args = arg_parser.parse_args()
+
+    latency = args.latency[0] if len(args.latency) == 1 else tuple(args.latency[:2])
+    stub = TwilioStub(port=0 if args.benchmark else args.port, latency=latency, seed=args.seed)
+    if args.benchmark:
+        with stub:
+            benchmark_results = benchmark_sending(stub, args.benchmark, args.libraries, args.items)
+        print(f"{'sender':<12}{'time (s)':>10}{'api calls':>11}{'connections':>13}{'recipients/s':>14}")
+        for sender, result in benchmark_results.items():
+            rate = args.benchmark / result["seconds"] if result["seconds"] else 0.0
+            print(f"{sender:<12}{result['seconds']:>10.2f}{result['api calls']:>11}{result['connections']:>13}"
+                  f"{rate:>14.1f}")
+    else:
+        print(f"Accepting Twilio messages at {stub.base_url} (Ctrl+C to stop)")
+        try:
+            stub._server.serve_forever()
+        except KeyboardInterrupt:
+            stub._server.server_close()